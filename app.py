@@ -1,14 +1,93 @@
 # -*- coding: utf-8 -*-
 
+import time
+
+# Las importaciones se cronometran: en la primera ejecución del proceso son parte del arranque en frío.
+_inicio_script = time.perf_counter()
+
 import streamlit as st
-import pandas as pd
-import vertexai
-from vertexai.preview.generative_models import GenerativeModel
-import PyPDF2
-import docx
-import re
-import io
 import os
+from bitacora import BitacoraTrabajo, id_trabajo, DIRECTORIO_BITACORAS_POR_DEFECTO
+import motor
+from backends_llm import BackendFalso
+from recuperacion_manual import SeleccionManual, PRESUPUESTO_TOKENS_POR_DEFECTO, MAX_SECCIONES_POR_DEFECTO
+from exportacion import FORMATOS_EXPORTACION, hash_items
+from cola_trabajos import NotificadorTrabajo, ESTADOS_ACTIVOS
+from recursos_streamlit import (obtener_backend_llm, obtener_cache_llm, obtener_banco_items, obtener_resiliencia_llm, obtener_telemetria,
+                                obtener_cola_trabajos, identificar_usuario, registrar_ejecucion_script, leer_excel_cargado,
+                                leer_pdf_cargado, indexar_manual, construir_exportacion)
+
+_segundos_importaciones = time.perf_counter() - _inicio_script
+
+SEGUNDOS_CONSULTA_TRABAJOS = 2
+ICONOS_ESTADO_TRABAJO = {"en_cola": "⏳", "en_curso": "🔄", "terminado": "✅", "error": "❌", "cancelado": "🚫"}
+
+
+# --- TRABAJOS DE LA SESIÓN ---
+def mostrar_trabajos(cola_trabajos):
+    # Estado de los trabajos enviados desde esta sesión. Mientras alguno está activo, el panel se
+    # vuelve a consultar cada pocos segundos sin ejecutar el resto del script.
+    ids_trabajos = st.session_state.get('ids_trabajos', [])
+    trabajos = [trabajo for trabajo in map(cola_trabajos.trabajo, reversed(ids_trabajos)) if trabajo is not None]
+    if not trabajos:
+        return
+    hay_activos = any(trabajo.estado in ESTADOS_ACTIVOS for trabajo in trabajos)
+
+    @st.fragment(run_every=SEGUNDOS_CONSULTA_TRABAJOS if hay_activos else None)
+    def panel_trabajos():
+        st.header("Trabajos")
+        estadisticas_cola = cola_trabajos.estadisticas()
+        st.caption(f"Cola compartida: {estadisticas_cola['en_curso']}/{estadisticas_cola['trabajadores']} trabajadores ocupados · "
+                   f"{estadisticas_cola['en_cola']} trabajo(s) en espera de {estadisticas_cola['usuarios_en_cola']} usuario(s)")
+        recogidos = st.session_state.setdefault('trabajos_recogidos', set())
+        siguen_activos = False
+        for trabajo in trabajos:
+            datos = trabajo.instantanea()
+            siguen_activos = siguen_activos or datos["estado"] in ESTADOS_ACTIVOS
+            with st.container(border=True):
+                st.markdown(f"{ICONOS_ESTADO_TRABAJO[datos['estado']]} **{datos['descripcion']}** · {datos['estado'].replace('_', ' ')}")
+                if datos["estado"] == "en_cola":
+                    posicion = cola_trabajos.posicion_en_cola(datos["id"])
+                    if posicion is not None:
+                        st.caption(f"{posicion} trabajo(s) por delante en la cola.")
+                elif datos["estado"] == "en_curso" and datos["etapa"]:
+                    st.caption(datos["etapa"])
+                for nivel, texto in datos["mensajes"]:
+                    {"info": st.info, "advertencia": st.warning, "error": st.error}[nivel](texto)
+                progreso = datos["progreso"]
+                if progreso:
+                    st.progress(progreso["terminadas"] / progreso["total"])
+                    if datos["estado"] in ESTADOS_ACTIVOS:
+                        for texto_fila in progreso["filas"]:
+                            st.write(texto_fila)
+                elif datos["estado"] == "en_curso" and datos["borrador"]:
+                    st.markdown(datos["borrador"])
+                if datos["estado"] in ESTADOS_ACTIVOS and not datos["cancelacion_pedida"]:
+                    if st.button("Cancelar", key=f"cancelar_{datos['id']}"):
+                        cola_trabajos.cancelar(datos["id"])
+                elif datos["estado"] == "error":
+                    st.error(f"Error técnico: {datos['error']}")
+                elif datos["estado"] == "terminado":
+                    items = datos["resultado"] or []
+                    if not items:
+                        st.error("No se pudo generar ningún ítem.")
+                    else:
+                        st.success(f"{len(items)} ítem(s) generados. Dictamen del primero: {items[0]['final_audit_status']}")
+                        with st.expander("Resumen del Primer Ítem Procesado"):
+                            st.markdown(items[0]['item_text'])
+                    if datos["id"] not in recogidos:
+                        # Los ítems del último trabajo terminado pasan a ser los que se exportan.
+                        recogidos.add(datos["id"])
+                        if items:
+                            st.session_state['processed_items_list'] = items
+                            st.session_state['hash_processed_items'] = hash_items(items)
+                        st.rerun()
+        if hay_activos and not siguen_activos:
+            # Se vuelve a ejecutar la aplicación completa para dejar de consultar.
+            st.rerun()
+
+    panel_trabajos()
+
 
 # --- FUNCIÓN PRINCIPAL QUE ENVUELVE TODA LA APP ---
 def main():
@@ -19,363 +98,94 @@ def main():
         layout="wide"
     )
 
-    # --- VARIABLES DE ENTORNO ---
-    GCP_PROJECT_ID = os.environ.get("GCP_PROJECT_ID")
-    GCP_LOCATION = os.environ.get("GCP_LOCATION")
-
-    # --- INICIALIZACIÓN DE VERTEX AI ---
-    # Este es el punto crítico que queremos diagnosticar.
-    vertexai.init(project=GCP_PROJECT_ID, location=GCP_LOCATION)
-    st.sidebar.success("✅ Conectado a Vertex AI.")
-
-    # --- FUNCIONES DE LA APLICACIÓN ---
-    @st.cache_data
-    def leer_excel_cargado(uploaded_file):
-        if uploaded_file is not None:
-            try:
-                df = pd.read_excel(uploaded_file)
-                st.sidebar.success(f"Archivo Excel '{uploaded_file.name}' cargado exitosamente.")
-                return df
-            except Exception as e:
-                st.sidebar.error(f"Ocurrió un error al leer el archivo Excel: {e}")
-                return None
-        return None
-
-    @st.cache_data
-    def leer_pdf_cargado(uploaded_file):
-        if uploaded_file is not None:
-            try:
-                texto_pdf = ""
-                reader = PyPDF2.PdfReader(io.BytesIO(uploaded_file.read()))
-                for page_num in range(len(reader.pages)):
-                    texto_pdf += reader.pages[page_num].extract_text()
-                st.sidebar.success(f"Archivo PDF '{uploaded_file.name}' leído exitosamente.")
-                return texto_pdf
-            except Exception as e:
-                st.sidebar.error(f"Ocurrió un error al leer el archivo PDF: {e}")
-                return ""
-        return ""
-
-    def get_descripcion_bloom(proceso_cognitivo_elegido):
-        descripcion_bloom_map = {
-            "RECORDAR": "Recuperar información relevante desde la memoria de largo plazo.",
-            "COMPRENDER": "Construir significado a partir de información mediante interpretación, resumen, explicación u otras tareas.",
-            "APLICAR": "Usar procedimientos en situaciones conocidas o nuevas.",
-            "ANALIZAR": "Descomponer información y examinar relaciones entre partes.",
-            "EVALUAR": "Emitir juicios basados en criterios para valorar ideas o soluciones.",
-            "CREAR": "Generar nuevas ideas, productos o formas de reorganizar información."
-        }
-        return descripcion_bloom_map.get(str(proceso_cognitivo_elegido).upper(), "Descripción no disponible.")
-
-    def generar_texto_con_llm(model_name, prompt):
-        try:
-            modelo = GenerativeModel(model_name)
-            response = modelo.generate_content(prompt)
-            return response.text
-        except Exception as e:
-            st.error(f"Error al llamar al modelo '{model_name}' en Vertex AI: {e}")
-            return None
-
-    def auditar_item_con_llm(model_name, item_generado, grado, area, asignatura, estacion,
-                             proceso_cognitivo, nanohabilidad, microhabilidad,
-                             competencia_nanohabilidad, contexto_educativo, manual_reglas_texto="", descripcion_bloom="", grafico_necesario="", descripcion_grafico="", prompt_auditor_adicional=""):
-        auditoria_prompt = f"""
-        Eres un experto en validación de ítems educativos, especializado en pruebas tipo ICFES y las directrices del equipo IMPROVE.
-        Tu tarea es AUDITAR RIGUROSAMENTE el siguiente ítem generado por un modelo de lenguaje.
-        Debes verificar que el ítem cumpla con TODOS los siguientes criterios.
-
-        --- CRITERIOS DE AUDITORÍA ---
-        1.  **Formato del Enunciado:** ¿El enunciado está formulado como pregunta clara y directa?
-        2.  **Número de Opciones:** ¿Hay exactamente 4 opciones (A, B, C, D)?
-        3.  **Respuesta Correcta Indicada:** ¿La sección 'RESPUESTA CORRECTA:' está claramente indicada?
-        4.  **Diseño de Justificaciones:** ¿Las justificaciones siguen el formato requerido (explicación para la correcta, análisis de error para las incorrectas)?
-        5.  **Estilo y Restricciones:** ¿No se usan negaciones mal redactadas, nombres reales, marcas, etc.?
-        6.  **Alineación del Contenido:** ¿El ítem está alineado EXCLUSIVAMENTE con los siguientes elementos?
-            * Grado: {grado}
-            * Área: {area}
-            * Asignatura: {asignatura}
-            * Estación o unidad temática: {estacion}
-            * Proceso Cognitivo (Taxonomía de Bloom): {proceso_cognitivo} (descripción: "{descripcion_bloom}")
-            * Nanohabilidad: {nanohabilidad}
-            * Microhabilidad: {microhabilidad}
-            * Competencia: {competencia_nanohabilidad}
-            * Nivel educativo: {contexto_educativo}
-        7.  **Gráfico (si aplica):** Si el ítem indica que requiere un gráfico, ¿la descripción es clara?
-            * Gráfico Necesario: {grafico_necesario}
-            * Descripción del Gráfico: {descripcion_grafico if grafico_necesario == 'SÍ' else 'N/A'}
-
-        --- MANUAL DE REGLAS ADICIONAL ---
-        {manual_reglas_texto}
-        -----------------------------------
-
-        --- INSTRUCCIONES ADICIONALES PARA LA AUDITORÍA ---
-        {prompt_auditor_adicional if prompt_auditor_adicional else "No se proporcionaron instrucciones adicionales."}
-        ---------------------------------------------------
-
-        ÍTEM A AUDITAR:
-        --------------------
-        {item_generado}
-        --------------------
-
-        Devuelve tu auditoría con este formato estructurado:
-
-        VALIDACIÓN DE CRITERIOS:
-        - Formato del Enunciado: [✅ / ❌] + Comentario (si ❌)
-        - Número de Opciones (4): [✅ / ❌]
-        - Respuesta Correcta Indicada: [✅ / ❌]
-        - Diseño de Justificaciones: [✅ / ⚠️ / ❌] + Observaciones (si ⚠️/❌)
-        - Estilo y Restricciones: [✅ / ⚠️ / ❌] + Observaciones (si ⚠️/❌)
-        - Alineación del Contenido: [✅ / ❌] + Comentario (si ❌)
-        - Gráfico (si aplica): [✅ / ⚠️ / ❌] + Observaciones (si ⚠️/❌)
-
-        DICTAMEN FINAL:
-        [✅ CUMPLE TOTALMENTE / ⚠️ CUMPLE PARCIALMENTE / ❌ RECHAZADO]
-
-        OBSERVACIONES FINALES:
-        [Explica de forma concisa qué aspectos necesitan mejora, si el dictamen no es ✅.]
-        """
-        return generar_texto_con_llm(model_name, auditoria_prompt), auditoria_prompt
-
-    def generar_pregunta_con_seleccion(gen_model_name, audit_model_name,
-                                       fila_datos, criterios_generacion, manual_reglas_texto="",
-                                       informacion_adicional_usuario="",
-                                       prompt_bloom_adicional="", prompt_construccion_adicional="", prompt_especifico_adicional="",
-                                       prompt_auditor_adicional="",
-                                       contexto_general_estacion=""):
-        tipo_pregunta = criterios_generacion.get("tipo_pregunta", "opción múltiple con 4 opciones")
-        dificultad = criterios_generacion.get("dificultad", "media")
-        contexto_educativo = criterios_generacion.get("contexto_educativo", "general")
-        formato_justificacion = criterios_generacion.get("formato_justificacion", """
-            • Justificación correcta: debe explicar el razonamiento o proceso cognitivo (NO por descarte).
-            • Justificaciones incorrectas: deben redactarse como: “El estudiante podría escoger la opción X porque… Sin embargo, esto es incorrecto porque…”
-        """)
-        
-        grado_elegido = fila_datos.get('GRADO', 'no especificado')
-        area_elegida = fila_datos.get('ÁREA', 'no especificada')
-        asignatura_elegida = fila_datos.get('ASIGNATURA', 'no especificada')
-        estacion_elegida = fila_datos.get('ESTACIÓN', 'no especificada')
-        proceso_cognitivo_elegido = fila_datos.get('PROCESO COGNITIVO', 'no especificado')
-        nanohabilidad_elegida = fila_datos.get('NANOHABILIDAD', 'no especificada')
-        microhabilidad_elegida = fila_datos.get('MICROHABILIDAD', 'no especificada')
-        competencia_nanohabilidad_elegida = fila_datos.get('COMPETENCIA NANOHABILIDAD', 'no especificada')
-
-        descripcion_bloom = get_descripcion_bloom(proceso_cognitivo_elegido)
-
-        current_item_text = ""
-        auditoria_status = "❌ RECHAZADO"
-        audit_observations = ""
-        max_refinement_attempts = 5
-        attempt = 0
-        grafico_necesario = "NO"
-        descripcion_grafico = ""
-        item_final_data = None
-        full_generation_prompt = ""
-        full_auditor_prompt = ""
-
-        classification_details = {
-            "Grado": grado_elegido, "Área": area_elegida, "Asignatura": asignatura_elegida,
-            "Estación": estacion_elegida, "Proceso Cognitivo": proceso_cognitivo_elegido,
-            "Nanohabilidad": nanohabilidad_elegida, "Microhabilidad": microhabilidad_elegida,
-            "Competencia Nanohabilidad": competencia_nanohabilidad_elegida
-        }
-
-        while auditoria_status != "✅ CUMPLE TOTALMENTE" and attempt < max_refinement_attempts:
-            attempt += 1
-            
-            prompt_content_for_llm = f"""
-            Eres un diseñador experto en ítems de evaluación educativa, especializado en pruebas tipo ICFES.
-            Tu tarea es construir un ítem de {tipo_pregunta} con una única respuesta correcta.
-
-            --- CONTEXTO Y PARÁMETROS DEL ÍTEM ---
-            - Grado: {grado_elegido}
-            - Área: {area_elegida}
-            - Asignatura: {asignatura_elegida}
-            - Estación o unidad temática: {estacion_elegida}
-            - Proceso cognitivo (Taxonomía de Bloom): {proceso_cognitivo_elegido}
-            - Descripción del proceso cognitivo: "{descripcion_bloom}"
-            
-            --- PROMPT ADICIONAL: TAXONOMÍA DE BLOOM / PROCESOS COGNITIVOS ---
-            {prompt_bloom_adicional if prompt_bloom_adicional else "No se proporcionaron prompts adicionales."}
-            ------------------------------------------------------------------
-
-            - Nanohabilidad (foco principal): {nanohabilidad_elegida}
-            - Nivel educativo: {contexto_educativo}
-            - Dificultad deseada: {dificultad}
-
-            --- CONTEXTO GENERAL DE LA ESTACIÓN (si aplica) ---
-            {f"Considera este contexto general: {contexto_general_estacion}" if contexto_general_estacion else "Genera un contexto individual para este ítem."}
-            ----------------------------------------------------
-
-            --- INSTRUCCIONES PARA LA CONSTRUCCIÓN ---
-            CONTEXTO: Incluye una situación relevante para el grado y área.
-            ENUNCIADO: Formula una pregunta clara y directa. Si usas negaciones, resáltalas en MAYÚSCULAS Y NEGRITA.
-            OPCIONES: Escribe exactamente cuatro opciones (A, B, C, D). Solo una correcta. Los distractores deben ser creíbles.
-            JUSTIFICACIONES: {formato_justificacion}
-
-            --- PROMPT ADICIONAL: REGLAS GENERALES DE CONSTRUCCIÓN ---
-            {prompt_construccion_adicional if prompt_construccion_adicional else "No se proporcionaron prompts adicionales."}
-            ---------------------------------------------------------
-
-            --- REGLAS ADICIONALES DEL MANUAL ---
-            Aplica estrictamente las directrices del siguiente manual:
-            {manual_reglas_texto}
-            ----------------------------------------------------
-
-            --- INFORMACIÓN ADICIONAL DEL USUARIO ---
-            {informacion_adicional_usuario if informacion_adicional_usuario else "No se proporcionó información adicional."}
-            ---------------------------------------------------------------------------
-            
-            --- PROMPT ADICIONAL: COSAS ESPECÍFICAS A TENER EN CUENTA ---
-            {prompt_especifico_adicional if prompt_especifico_adicional else "No se proporcionaron prompts adicionales."}
-            ----------------------------------------------------------
-
-            --- DATO CLAVE PARA LA CONSTRUCCIÓN ---
-            Basa el ítem en la siguiente nanohabilidad: "{nanohabilidad_elegida}"
-
-            --- INSTRUCCIONES DE SALIDA PARA GRÁFICO ---
-            Después de las justificaciones, incluye:
-            GRAFICO_NECESARIO: [SÍ/NO]
-            DESCRIPCION_GRAFICO: [Si es SÍ, descripción detallada. Si es NO, escribe N/A.]
-
-            --- FORMATO ESPERADO DE SALIDA ---
-            PREGUNTA: [Enunciado]
-            A. [Opción A]
-            B. [Opción B]
-            C. [Opción C]
-            D. [Opción D]
-            RESPUESTA CORRECTA: [Letra]
-            JUSTIFICACIONES:
-            A. [Justificación A]
-            B. [Justificación B]
-            C. [Justificación C]
-            D. [Justificación D]
-            GRAFICO_NECESARIO: [SÍ/NO]
-            DESCRIPCION_GRAFICO: [Descripción o N/A]
-            """
-            
-            if attempt > 1:
-                prompt_content_for_llm += f"""
-                --- RETROALIMENTACIÓN DE AUDITORÍA PARA REFINAMIENTO ---
-                El ítem anterior no cumplió los criterios. Revisa estas observaciones y mejora el ítem:
-                Observaciones del Auditor: {audit_observations}
-                --- ÍTEM ANTERIOR A REFINAR ---
-                {current_item_text}
-                -------------------------------
-                """
-            
-            full_generation_prompt = prompt_content_for_llm
-
-            try:
-                with st.spinner(f"Generando contenido con IA ({gen_model_name}, Intento {attempt})..."):
-                    full_llm_response = generar_texto_con_llm(gen_model_name, prompt_content_for_llm)
-                    
-                    if full_llm_response is None:
-                        auditoria_status = "❌ RECHAZADO (Error de Generación)"
-                        audit_observations = "El modelo de generación no pudo producir una respuesta."
-                        break
-                    
-                    item_and_graphic_match = re.search(r"(PREGUNTA:.*?)(GRAFICO_NECESARIO:\s*(SÍ|NO).*?DESCRIPCION_GRAFICO:.*)", full_llm_response, re.DOTALL)
-                    
-                    if item_and_graphic_match:
-                        current_item_text = item_and_graphic_match.group(1).strip()
-                        grafico_info_block = item_and_graphic_match.group(2).strip()
-                        
-                        grafico_necesario_match = re.search(r"GRAFICO_NECESARIO:\s*(SÍ|NO)", grafico_info_block)
-                        grafico_necesario = grafico_necesario_match.group(1).strip() if grafico_necesario_match else "NO"
-
-                        descripcion_grafico_match = re.search(r"DESCRIPCION_GRAFICO:\s*(.*)", grafico_info_block, re.DOTALL)
-                        descripcion_grafico = descripcion_grafico_match.group(1).strip() if descripcion_grafico_match else ""
-                        if descripcion_grafico.upper() == 'N/A':
-                            descripcion_grafico = ""
-                    else:
-                        current_item_text = full_llm_response
-                        grafico_necesario = "NO"
-                        descripcion_grafico = ""
-                        st.warning("No se pudo parsear el formato de gráfico. Asumiendo que no se requiere.")
-
-                with st.spinner(f"Auditando ítem ({audit_model_name}, Intento {attempt})..."):
-                    auditoria_resultado, full_auditor_prompt = auditar_item_con_llm(
-                        audit_model_name,
-                        item_generado=current_item_text,
-                        grado=grado_elegido, area=area_elegida, asignatura=asignatura_seleccionada, estacion=estacion_elegida,
-                        proceso_cognitivo=proceso_cognitivo_seleccionado, nanohabilidad=nanohabilidad_seleccionada,
-                        microhabilidad=microhabilidad_elegida, competencia_nanohabilidad=competencia_nanohabilidad_elegida,
-                        contexto_educativo=contexto_educativo, manual_reglas_texto=manual_reglas_texto,
-                        descripcion_bloom=descripcion_bloom,
-                        grafico_necesario=grafico_necesario,
-                        descripcion_grafico=descripcion_grafico,
-                        prompt_auditor_adicional=prompt_auditor_adicional
-                    )
-                    if auditoria_resultado is None:
-                        auditoria_status = "❌ RECHAZADO (Error de Auditoría)"
-                        audit_observations = "El modelo de auditoría no pudo producir una respuesta."
-                        break
-
-                dictamen_final_match = re.search(r"DICTAMEN FINAL:\s*\[(.*?)]", auditoria_resultado, re.DOTALL)
-                auditoria_status = dictamen_final_match.group(1).strip() if dictamen_final_match else "❌ RECHAZADO (no se pudo extraer dictamen)"
-                
-                observaciones_start = auditoria_resultado.find("OBSERVACIONES FINALES:")
-                audit_observations = auditoria_resultado[observaciones_start + len("OBSERVACIONES FINALES:"):].strip() if observaciones_start != -1 else "No se pudieron extraer observaciones."
-                
-                item_final_data = {
-                    "item_text": current_item_text, "classification": classification_details,
-                    "grafico_necesario": grafico_necesario, "descripcion_grafico": descripcion_grafico,
-                    "final_audit_status": auditoria_status, "final_audit_observations": audit_observations,
-                    "generation_prompt_used": full_generation_prompt, "auditor_prompt_used": full_auditor_prompt
-                }
-
-                if auditoria_status == "✅ CUMPLE TOTALMENTE":
-                    break
-            
-            except Exception as e:
-                audit_observations = f"Error técnico durante la generación: {e}"
-                auditoria_status = "❌ RECHAZADO (error técnico)"
-                item_final_data = {
-                    "item_text": current_item_text if current_item_text else "No se pudo generar el ítem.",
-                    "classification": classification_details, "grafico_necesario": "NO", "descripcion_grafico": "",
-                    "final_audit_status": auditoria_status, "final_audit_observations": audit_observations,
-                    "generation_prompt_used": full_generation_prompt, "auditor_prompt_used": full_auditor_prompt
-                }
-                break
-
-        return item_final_data
-
-    def exportar_a_word(preguntas_procesadas_list):
-        doc = docx.Document()
-        doc.add_heading('Preguntas Generadas y Auditadas', level=1)
-        doc.add_paragraph('Este documento contiene los ítems generados por el sistema de IA y sus resultados de auditoría.\n')
-
-        if not preguntas_procesadas_list:
-            doc.add_paragraph('No se procesaron ítems para este informe.')
-
-        for i, item_data in enumerate(preguntas_procesadas_list):
-            doc.add_heading(f'Ítem #{i+1}', level=2)
-            doc.add_paragraph('--- Clasificación del Ítem ---')
-            for key, value in item_data["classification"].items():
-                p = doc.add_paragraph()
-                p.add_run(f"{key}: ").bold = True
-                p.add_run(str(value))
-            
-            doc.add_paragraph('\n' + item_data["item_text"])
-
-            if item_data.get("grafico_necesario") == "SÍ" and item_data.get("descripcion_grafico"):
-                doc.add_paragraph()
-                p = doc.add_paragraph()
-                p.add_run("--- Gráfico Sugerido ---").bold = True
-                doc.add_paragraph(f"**Tipo y Descripción del Gráfico:** {item_data['descripcion_grafico']}\n")
-
-            doc.add_paragraph()
-            p = doc.add_paragraph()
-            p.add_run("--- Resultado Final de Auditoría ---").bold = True
-            doc.add_paragraph(f"**DICTAMEN FINAL:** {item_data.get('final_audit_status', 'N/A')}")
-            doc.add_paragraph(f"**OBSERVACIONES FINALES:** {item_data.get('final_audit_observations', 'N/A')}\n")
-            
-            doc.add_page_break()
-
-        buffer = io.BytesIO()
-        doc.save(buffer)
-        buffer.seek(0)
-        return buffer
+    # --- INICIALIZACIÓN DEL BACKEND DE LLM ---
+    # LLM_BACKEND=vertex (por defecto) usa GCP_PROJECT_ID y GCP_LOCATION; LLM_BACKEND=falso usa un
+    # backend local simulado. Este es el punto crítico que queremos diagnosticar.
+    backend_llm = obtener_backend_llm()
+    if isinstance(backend_llm, BackendFalso):
+        st.sidebar.warning("🧪 Usando el backend LLM local simulado (sin Vertex AI).")
+    else:
+        st.sidebar.success("✅ Conectado a Vertex AI.")
+
+    # --- CACHÉ DE RESPUESTAS DEL LLM (compartida por todas las sesiones del proceso) ---
+    cache_llm = obtener_cache_llm()
+    ignorar_cache_llm = st.sidebar.checkbox(
+        "Ignorar caché de respuestas en esta ejecución",
+        help="Fuerza llamadas nuevas a Vertex AI; las respuestas obtenidas no se guardan en la caché."
+    )
+    estadisticas_cache = cache_llm.estadisticas()
+    st.sidebar.caption(
+        f"Caché LLM: {estadisticas_cache['entradas']} respuestas guardadas · "
+        f"{estadisticas_cache['aciertos']} aciertos / {estadisticas_cache['fallos']} fallos"
+    )
+    estadisticas_prefijo = backend_llm.estadisticas_prefijo
+    st.sidebar.caption(
+        f"Prefijo estable (manual y reglas): ~{estadisticas_prefijo['tokens_prefijo_desde_cache']} tokens servidos "
+        f"desde caché de contexto · ~{estadisticas_prefijo['tokens_prefijo_repetidos']} tokens reenviados"
+    )
+
+    # --- BANCO DE ÍTEMS APROBADOS (SQLite compartido; ver banco_items.py) ---
+    banco_items = obtener_banco_items()
+    estadisticas_banco = banco_items.estadisticas()
+    st.sidebar.caption(f"Banco de ítems: {estadisticas_banco['items']} ítems aprobados en "
+                       f"{estadisticas_banco['combinaciones']} combinaciones de clasificación")
+    with st.sidebar.expander("🔎 Buscar en el banco de ítems"):
+        texto_busqueda = st.text_input("Texto del ítem", key="busqueda_banco")
+        if texto_busqueda:
+            encontrados = banco_items.buscar(texto_busqueda)
+            if not encontrados:
+                st.caption("Sin resultados.")
+            for id_item, item_banco in encontrados:
+                st.markdown(f"**#{id_item}** · {item_banco['classification']['Estación']} · "
+                            f"{item_banco['classification']['Nanohabilidad']}")
+                st.caption(item_banco["item_text"][:300])
+
+    # --- CAPA RESILIENTE (reintentos, límites por modelo, circuito), compartida por todas las sesiones ---
+    resiliencia_llm = obtener_resiliencia_llm()
+    for nombre_modelo, metricas_modelo in resiliencia_llm.estadisticas().items():
+        st.sidebar.caption(
+            f"{nombre_modelo}: {metricas_modelo['exitos']}/{metricas_modelo['llamadas']} llamadas exitosas · "
+            f"{metricas_modelo['reintentos']} reintentos · {metricas_modelo['segundos_espera_limite']:.0f} s en espera por límite · "
+            f"{metricas_modelo['coberturas_ganadoras']}/{metricas_modelo['coberturas_lanzadas']} coberturas útiles · "
+            f"circuito {metricas_modelo['estado_circuito']} ({metricas_modelo['aperturas_circuito']} aperturas)"
+        )
+
+    # --- TELEMETRÍA (spans y contadores de todas las sesiones del proceso) ---
+    telemetria = obtener_telemetria()
+    with st.sidebar.expander("📈 Rendimiento"):
+        resumen_rendimiento = telemetria.resumen()
+        for operacion, latencia in resumen_rendimiento["latencias"].items():
+            st.caption(f"{operacion}: p50 {latencia['p50']:.2f} s · p95 {latencia['p95']:.2f} s ({latencia['llamadas']} llamadas)")
+        if resumen_rendimiento["tokens_por_item_aprobado"] is not None:
+            st.caption(f"Tokens por ítem aprobado: ~{resumen_rendimiento['tokens_por_item_aprobado']:,.0f} "
+                       f"({resumen_rendimiento['items_aprobados']} ítems aprobados)")
+        if resumen_rendimiento["tasa_aciertos_cache"] is not None:
+            st.caption(f"Aciertos de caché: {resumen_rendimiento['tasa_aciertos_cache']:.0%} · "
+                       f"fallos de parseo: {resumen_rendimiento['fallos_parseo']}")
+        if resumen_rendimiento["items_reutilizados_banco"] or resumen_rendimiento["duplicados_banco"]:
+            st.caption(f"Banco de ítems: {resumen_rendimiento['items_reutilizados_banco']} reutilizados · "
+                       f"{resumen_rendimiento['duplicados_banco']} casi duplicados rechazados")
+        for nivel, datos_nivel in resumen_rendimiento["cascada_auditoria"].items():
+            st.caption(f"Auditoría nivel {nivel} ({', '.join(datos_nivel['modelos'])}): p50 {datos_nivel['p50']:.2f} s · "
+                       f"~{datos_nivel['tokens']:,} tokens · {datos_nivel['tasa_escalamiento']:.0%} escaladas "
+                       f"({datos_nivel['auditorias']} auditorías)")
+        for intento, datos_intento in resumen_rendimiento["tasa_aprobacion_por_intento"].items():
+            st.caption(f"Intento {intento}: {datos_intento['tasa_aprobacion']:.0%} aprobados ({datos_intento['intentos']} intentos)")
+        if resumen_rendimiento["arranque_en_frio_segundos"] is not None:
+            rerun_p50 = resumen_rendimiento["rerun_p50_segundos"]
+            st.caption(f"Arranque en frío: {resumen_rendimiento['arranque_en_frio_segundos']:.2f} s"
+                       + (f" · rerun p50 {rerun_p50:.2f} s" if rerun_p50 is not None else ""))
+        if not resumen_rendimiento["latencias"]:
+            st.caption("Aún no hay llamadas registradas.")
+    if os.environ.get("TELEMETRY_PROMETHEUS_PATH"):
+        telemetria.escribir_prometheus()
+
+    cliente_llm = motor.ClienteLLM(backend_llm, cache=cache_llm, ignorar_cache=ignorar_cache_llm, resiliencia=resiliencia_llm,
+                                   telemetria=telemetria)
+
+    # --- COLA DE TRABAJOS (pool de trabajadores compartido; ver cola_trabajos.py) ---
+    cola_trabajos = obtener_cola_trabajos()
+    usuario = identificar_usuario()
 
     # --- Interfaz de Usuario Principal de Streamlit ---
     st.title("📚 Generador y Auditor de ítems para el proyecto SUMUN 🧠")
@@ -386,17 +196,38 @@ def main():
     uploaded_pdf_file = st.sidebar.file_uploader("Sube tu archivo PDF (Manual_construccion_pruebas_IMProve.pdf)", type=["pdf"])
 
     df_datos = None
+    indice_taxonomia = None
     manual_reglas_texto = ""
+    seleccion_manual = None
 
     if uploaded_excel_file:
-        df_datos = leer_excel_cargado(uploaded_excel_file)
+        try:
+            df_datos, indice_taxonomia = leer_excel_cargado(uploaded_excel_file.getvalue(), uploaded_excel_file.name)
+        except Exception as e:
+            st.sidebar.error(f"Ocurrió un error al leer el archivo Excel: {e}")
     if uploaded_pdf_file:
         manual_reglas_texto = leer_pdf_cargado(uploaded_pdf_file)
-        max_manual_length = 15000
-        if len(manual_reglas_texto) > max_manual_length:
-            st.sidebar.warning(f"Manual truncado a {max_manual_length} caracteres.")
-            manual_reglas_texto = manual_reglas_texto[:max_manual_length]
-        st.sidebar.info(f"Manual de reglas cargado ({len(manual_reglas_texto)} caracteres).")
+        usar_recuperacion_manual = st.sidebar.checkbox(
+            "Enviar solo las secciones del manual relevantes para cada ítem", value=True,
+            help="Indexa el manual completo y elige por ítem las secciones más relacionadas con su área, asignatura, "
+                 "proceso cognitivo y nanohabilidad. Si se desactiva, el manual se recorta a sus primeros caracteres."
+        )
+        if usar_recuperacion_manual:
+            presupuesto_manual_tokens = st.sidebar.number_input(
+                "Presupuesto de tokens del manual por ítem", min_value=500, max_value=20000,
+                value=PRESUPUESTO_TOKENS_POR_DEFECTO, step=500
+            )
+            indice_manual = indexar_manual(manual_reglas_texto)
+            seleccion_manual = SeleccionManual(indice_manual, int(presupuesto_manual_tokens), MAX_SECCIONES_POR_DEFECTO)
+            st.sidebar.info(
+                f"Manual de reglas indexado: {len(indice_manual.secciones)} secciones (~{indice_manual.tokens_totales} tokens); "
+                f"hasta {MAX_SECCIONES_POR_DEFECTO} secciones por ítem."
+            )
+        else:
+            manual_reglas_texto, manual_recortado = motor.recortar_manual(manual_reglas_texto)
+            if manual_recortado:
+                st.sidebar.warning(f"Manual truncado a {motor.MAX_LONGITUD_MANUAL} caracteres.")
+            st.sidebar.info(f"Manual de reglas cargado ({len(manual_reglas_texto)} caracteres).")
     
     if df_datos is None:
         st.info("Para comenzar, sube tu archivo Excel en la barra lateral.")
@@ -404,43 +235,41 @@ def main():
         st.header("Generación y Auditoría de Ítems")
         st.subheader("Selecciona los Criterios para la Generación")
         
-        all_grades = df_datos['GRADO'].dropna().unique().tolist()
-        grado_seleccionado = st.selectbox("Grado", sorted(all_grades))
-        df_filtrado_grado = df_datos[df_datos['GRADO'].astype(str) == str(grado_seleccionado)]
-        
-        all_areas = df_filtrado_grado['ÁREA'].dropna().unique().tolist()
-        area_seleccionada = st.selectbox("Área", sorted(all_areas))
-        df_filtrado_area = df_filtrado_grado[df_filtrado_grado['ÁREA'] == area_seleccionada]
-        
-        all_asignaturas = df_filtrado_area['ASIGNATURA'].dropna().unique().tolist()
-        asignatura_seleccionada = st.selectbox("Asignatura", sorted(all_asignaturas))
-        df_filtrado_asignatura = df_filtrado_area[df_filtrado_area['ASIGNATURA'] == asignatura_seleccionada]
-        
-        all_estaciones = df_filtrado_asignatura['ESTACIÓN'].dropna().unique().tolist()
-        estacion_seleccionada = st.selectbox("Estación", sorted(all_estaciones))
-        df_filtrado_estacion = df_filtrado_asignatura[df_filtrado_asignatura['ESTACIÓN'] == estacion_seleccionada]
+        grado_seleccionado = st.selectbox("Grado", indice_taxonomia.opciones())
+        area_seleccionada = st.selectbox("Área", indice_taxonomia.opciones(grado_seleccionado))
+        asignatura_seleccionada = st.selectbox("Asignatura", indice_taxonomia.opciones(grado_seleccionado, area_seleccionada))
+        estacion_seleccionada = st.selectbox("Estación", indice_taxonomia.opciones(grado_seleccionado, area_seleccionada, asignatura_seleccionada))
+        ruta_estacion = (grado_seleccionado, area_seleccionada, asignatura_seleccionada, estacion_seleccionada)
         
         st.subheader("Modo de Generación de Ítems")
         generate_all_for_station = st.checkbox("Generar TODOS los ítems de esta Estación")
         
         contexto_general_estacion = ""
+        reutilizar_banco = False
         if generate_all_for_station:
             contexto_general_estacion = st.text_area("Escribe una idea para el contexto general de la estación (opcional, la IA puede crearlo):", height=150)
+            max_items_en_paralelo = st.number_input("Máximo de ítems procesándose en paralelo", min_value=1, max_value=16, value=4, step=1)
+            tamano_lote_auditoria = st.number_input(
+                "Ítems por solicitud de auditoría", min_value=1, max_value=8, value=1, step=1,
+                help="Agrupa las auditorías de los ítems que terminan a la vez en una sola solicitud (mismo manual y criterios). "
+                     "Si el veredicto de un ítem no se puede separar, ese ítem se audita por separado."
+            )
+            reutilizar_banco = st.checkbox(
+                "Reutilizar ítems aprobados del banco", value=True,
+                help="Las filas de la estación que ya tienen un ítem ✅ CUMPLE TOTALMENTE en el banco se sirven desde allí; "
+                     "solo se generan las que faltan."
+            )
 
         proceso_cognitivo_seleccionado = None
         nanohabilidad_seleccionada = None
         df_item_seleccionado = None
 
         if not generate_all_for_station:
-            all_procesos = df_filtrado_estacion['PROCESO COGNITIVO'].dropna().unique().tolist()
-            proceso_cognitivo_seleccionado = st.selectbox("Proceso Cognitivo", sorted(all_procesos))
-            df_filtrado_proceso = df_filtrado_estacion[df_filtrado_estacion['PROCESO COGNITIVO'] == proceso_cognitivo_seleccionado]
-            
-            all_nanohabilidades = df_filtrado_proceso['NANOHABILIDAD'].dropna().unique().tolist()
-            nanohabilidad_seleccionada = st.selectbox("Nanohabilidad", sorted(all_nanohabilidades))
-            df_item_seleccionado = df_filtrado_proceso[df_filtrado_proceso['NANOHABILIDAD'] == nanohabilidad_seleccionada]
+            proceso_cognitivo_seleccionado = st.selectbox("Proceso Cognitivo", indice_taxonomia.opciones(*ruta_estacion))
+            nanohabilidad_seleccionada = st.selectbox("Nanohabilidad", indice_taxonomia.opciones(*ruta_estacion, proceso_cognitivo_seleccionado))
+            df_item_seleccionado = indice_taxonomia.filas(*ruta_estacion, proceso_cognitivo_seleccionado, nanohabilidad_seleccionada)
         else:
-            df_item_seleccionado = df_filtrado_estacion.copy()
+            df_item_seleccionado = indice_taxonomia.filas(*ruta_estacion)
 
         if df_item_seleccionado.empty:
             st.error("No hay datos para generar con los filtros actuales.")
@@ -490,83 +319,153 @@ def main():
                         key="audit_prompt_add"
                     )
 
+            reanudar_trabajo = st.checkbox(
+                "Reanudar desde la bitácora si este trabajo se interrumpió", value=True,
+                help="Los ítems ya terminados se reutilizan y los que quedaron a medias continúan desde su último intento. "
+                     "Desmárcalo para empezar desde cero."
+            )
+
+            validar_estructura = st.checkbox(
+                "Validar la estructura del ítem localmente antes de auditarlo", value=True,
+                help="Los ítems sin 4 opciones A–D, sin respuesta correcta válida, sin 4 justificaciones o sin bloque de gráfico "
+                     "vuelven al refinamiento sin gastar una llamada de auditoría."
+            )
+
             st.subheader("Configuración de Modelos de IA (Vertex AI)")
             col1, col2 = st.columns(2)
             with col1:
                 gen_model_name = st.selectbox("Modelo para Generación", ["gemini-2.0-flash", "gemini-2.5-pro", "gemini-2.0-flash-lite"])
             with col2: 
                 audit_model_name = st.selectbox("Modelo para Auditoría", ["gemini-2.0-flash-lite", "gemini-2.0-flash", "gemini-2.5-pro"])
+            cascada_auditoria = None
+            if st.checkbox("Auditoría en cascada", help="El modelo de auditoría audita primero y solo los dictámenes dudosos "
+                                                         "se vuelven a auditar con un modelo más fuerte, cuyo dictamen reemplaza al anterior."):
+                col_escalamiento, col_motivos = st.columns(2)
+                with col_escalamiento:
+                    modelo_escalamiento = st.selectbox("Modelo de escalamiento", ["gemini-2.5-pro", "gemini-2.0-flash"])
+                with col_motivos:
+                    motivos_escalamiento = st.multiselect(
+                        "Escalar cuando", list(motor.MOTIVOS_ESCALAMIENTO), default=list(motor.MOTIVOS_ESCALAMIENTO),
+                        format_func=motor.MOTIVOS_ESCALAMIENTO.get
+                    )
+                cascada_auditoria = motor.CascadaAuditoria([modelo_escalamiento], motivos_escalamiento)
+            candidatos_en_paralelo = st.number_input(
+                "Candidatos en paralelo en el primer intento de cada ítem", min_value=1, max_value=8, value=1, step=1,
+                help="Genera y audita varios candidatos a la vez y usa el primero aprobado; solo si ninguno se aprueba se "
+                     "refina el mejor. Consume más tokens pero reduce el tiempo por ítem."
+            )
+            salida_json = st.checkbox(
+                "Respuestas en JSON con esquema", value=False,
+                help="El generador y el auditor responden con JSON validado contra un esquema en lugar de texto libre, "
+                     "así que un desvío de formato no cuesta un intento de refinamiento. El ítem no se muestra mientras se genera."
+            )
 
             if st.button("Generar y Auditar Ítem(s)"):
-                criterios_para_preguntas = {
-                    "tipo_pregunta": "opción múltiple con 4 opciones", "dificultad": "media",
-                    "contexto_educativo": "estudiantes de preparatoria (bachillerato)",
-                    "formato_justificacion": """
-                        • Justificación correcta: debe explicar el razonamiento (NO por descarte).
-                        • Justificaciones incorrectas: deben redactarse como: “El estudiante podría escoger la opción X porque… Sin embargo, esto es incorrecto porque…”
-                    """
-                }
-                processed_items_list = []
-
-                if generate_all_for_station:
-                    st.info(f"Generando ítems para la Estación: {estacion_seleccionada}")
-                    unique_procesos = df_item_seleccionado[['PROCESO COGNITIVO', 'NANOHABILIDAD', 'MICROHABILIDAD', 'COMPETENCIA NANOHABILIDAD']].drop_duplicates().to_dict('records')
-                    progress_bar = st.progress(0)
-                    
-                    for i, item_spec_row in enumerate(unique_procesos):
-                        st.write(f"Procesando {i+1}/{len(unique_procesos)}: {item_spec_row['PROCESO COGNITIVO']}...")
-                        current_fila_datos = {'GRADO': grado_seleccionado, 'ÁREA': area_seleccionada, 'ASIGNATURA': asignatura_seleccionada, 'ESTACIÓN': estacion_seleccionada, **item_spec_row}
-                        item_data = generar_pregunta_con_seleccion(gen_model_name, audit_model_name, current_fila_datos, criterios_para_preguntas, manual_reglas_texto, informacion_adicional_usuario, prompt_bloom_adicional, prompt_construccion_adicional, prompt_especifico_adicional, prompt_auditor_adicional, contexto_general_estacion)
-                        if item_data:
-                            processed_items_list.append(item_data)
-                        progress_bar.progress((i + 1) / len(unique_procesos))
-                    st.success("Proceso completado.")
-
-                else:
-                    st.info(f"Generando ítem individual para: {nanohabilidad_seleccionada}")
-                    item_data = generar_pregunta_con_seleccion(gen_model_name, audit_model_name, df_item_seleccionado.iloc[0], criterios_para_preguntas, manual_reglas_texto, informacion_adicional_usuario, prompt_bloom_adicional, prompt_construccion_adicional, prompt_especifico_adicional, prompt_auditor_adicional)
-                    if item_data:
-                        processed_items_list.append(item_data)
-                        st.success(f"Ítem generado. Dictamen: {item_data.get('final_audit_status')}")
-
-                st.session_state['processed_items_list'] = processed_items_list
-                
-                if processed_items_list:
-                    st.subheader("Resumen del Primer Ítem Procesado:")
-                    first_item = processed_items_list[0]
-                    st.markdown(first_item['item_text'])
-                    st.info(f"Dictamen: {first_item['final_audit_status']}")
-                else:
-                    st.error("No se pudo generar ningún ítem.")
-            
+                criterios_para_preguntas = motor.CRITERIOS_POR_DEFECTO
+
+                # Cada ítem terminado (y cada intento) se escribe en la bitácora en cuanto ocurre, así que
+                # una sesión caída o una instancia reciclada puede retomar el trabajo al repetir la solicitud.
+                identificador_trabajo = id_trabajo(
+                    backend=backend_llm.nombre, gen_model_name=gen_model_name, audit_model_name=audit_model_name,
+                    criterios=criterios_para_preguntas, manual=manual_reglas_texto,
+                    informacion_adicional_usuario=informacion_adicional_usuario, prompt_bloom_adicional=prompt_bloom_adicional,
+                    prompt_construccion_adicional=prompt_construccion_adicional, prompt_especifico_adicional=prompt_especifico_adicional,
+                    prompt_auditor_adicional=prompt_auditor_adicional, contexto_general_estacion=contexto_general_estacion,
+                    validar_estructura=validar_estructura, candidatos_en_paralelo=int(candidatos_en_paralelo), salida_json=salida_json,
+                    cascada_auditoria=(cascada_auditoria.modelos_escalamiento, cascada_auditoria.motivos) if cascada_auditoria else None,
+                    reutilizar_banco=reutilizar_banco,
+                    seleccion_manual=(seleccion_manual.presupuesto_tokens, seleccion_manual.max_secciones) if seleccion_manual else None
+                )
+
+                # El trabajo se ejecuta en un hilo de la cola, no en el del script: no puede usar st.*.
+                # Informa su avance a través del propio trabajo (etapa, mensajes, borrador y progreso).
+                def ejecutar_trabajo(trabajo):
+                    notificador_trabajo = NotificadorTrabajo(trabajo)
+                    bitacora_trabajo = BitacoraTrabajo.para_trabajo(
+                        os.environ.get("ITEMS_JOURNAL_DIR", DIRECTORIO_BITACORAS_POR_DEFECTO), identificador_trabajo,
+                        reiniciar=not reanudar_trabajo
+                    )
+                    resumen_bitacora = bitacora_trabajo.resumen()
+                    if resumen_bitacora["terminados"] or resumen_bitacora["en_progreso"]:
+                        trabajo.agregar_mensaje("info",
+                            f"Reanudando trabajo: {resumen_bitacora['terminados']} ítem(s) ya terminados y "
+                            f"{resumen_bitacora['en_progreso']} en refinamiento según la bitácora."
+                        )
+
+                    if not generate_all_for_station:
+                        item_data = motor.generar_pregunta_con_seleccion(cliente_llm, gen_model_name, audit_model_name, df_item_seleccionado.iloc[0], criterios_para_preguntas, manual_reglas_texto, informacion_adicional_usuario, prompt_bloom_adicional, prompt_construccion_adicional, prompt_especifico_adicional, prompt_auditor_adicional, notificador=notificador_trabajo, bitacora=bitacora_trabajo, validar_estructura=validar_estructura, seleccion_manual=seleccion_manual, candidatos_en_paralelo=int(candidatos_en_paralelo), salida_json=salida_json, cascada_auditoria=cascada_auditoria, banco_items=banco_items, detener=trabajo.detener)
+                        return [item_data] if item_data else []
+
+                    unique_procesos = motor.filas_de_estacion(df_item_seleccionado)
+                    textos_filas = [""] * len(unique_procesos)
+                    filas_terminadas = []
+                    textos_estado = {"en_cola": "⏳ En cola", "procesando": "🔄 Procesando"}
+
+                    def mostrar_estado_fila(i, estado, detalle):
+                        # El motor invoca este callback desde el hilo del trabajo, no desde los hilos de cada ítem.
+                        texto = textos_estado.get(estado)
+                        if estado == "terminado":
+                            texto = f"✅ Terminado ({detalle.get('final_audit_status', 'N/A') if detalle else 'sin resultado'})"
+                        elif estado == "error":
+                            texto = f"❌ Error técnico ({detalle})"
+                        textos_filas[i] = f"{texto} {i+1}/{len(unique_procesos)}: {unique_procesos[i]['PROCESO COGNITIVO']} — {unique_procesos[i]['NANOHABILIDAD']}"
+                        if estado in ("terminado", "error"):
+                            filas_terminadas.append(i)
+                        trabajo.actualizar(progreso={"filas": list(textos_filas), "terminadas": len(filas_terminadas),
+                                                     "total": len(unique_procesos)})
+
+                    resultados_estacion = motor.generar_items_estacion(
+                        cliente_llm, gen_model_name, audit_model_name, grado_seleccionado, area_seleccionada,
+                        asignatura_seleccionada, estacion_seleccionada, unique_procesos, criterios_para_preguntas,
+                        manual_reglas_texto, informacion_adicional_usuario, prompt_bloom_adicional, prompt_construccion_adicional,
+                        prompt_especifico_adicional, prompt_auditor_adicional, contexto_general_estacion,
+                        max_en_paralelo=int(max_items_en_paralelo), al_cambiar_estado=mostrar_estado_fila,
+                        bitacora=bitacora_trabajo, validar_estructura=validar_estructura, seleccion_manual=seleccion_manual,
+                        candidatos_en_paralelo=int(candidatos_en_paralelo), tamano_lote_auditoria=int(tamano_lote_auditoria),
+                        salida_json=salida_json, cascada_auditoria=cascada_auditoria,
+                        banco_items=banco_items, reutilizar_banco=reutilizar_banco, detener=trabajo.detener
+                    )
+                    return [item_data for item_data in resultados_estacion if item_data]
+
+                descripcion_trabajo = (f"Estación: {estacion_seleccionada}" if generate_all_for_station
+                                       else f"Ítem: {nanohabilidad_seleccionada}")
+                trabajo = cola_trabajos.enviar(usuario, descripcion_trabajo, ejecutar_trabajo,
+                                               modelos=(gen_model_name, audit_model_name,
+                                                        *(cascada_auditoria.modelos_escalamiento if cascada_auditoria else ())))
+                st.session_state.setdefault('ids_trabajos', []).append(trabajo.id)
+                st.info(f"Trabajo enviado a la cola ({descripcion_trabajo}). Puedes seguir usando la aplicación mientras se procesa.")
+
+            mostrar_trabajos(cola_trabajos)
+
             st.header("Exportar Resultados")
             if 'processed_items_list' in st.session_state and st.session_state['processed_items_list']:
                 num_items = len(st.session_state['processed_items_list'])
                 st.write(f"Hay {num_items} ítem(s) listos para exportar.")
-                
-                word_buffer = exportar_a_word(st.session_state['processed_items_list'])
-                st.download_button(
-                    label="Descargar Ítem(s) en Word", data=word_buffer,
-                    file_name=f"items_{estacion_seleccionada.replace(' ', '_')}.docx",
-                    mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-                )
-
-                combined_prompts_content = ""
-                for i, item_data in enumerate(st.session_state['processed_items_list']):
-                    combined_prompts_content += f"--- ÍTEM #{i+1} ({item_data['classification']['Proceso Cognitivo']}) ---\n"
-                    combined_prompts_content += f"--- PROMPT GENERADOR ---\n{item_data.get('generation_prompt_used', 'N/A')}\n\n"
-                    combined_prompts_content += f"--- PROMPT AUDITOR ---\n{item_data.get('auditor_prompt_used', 'N/A')}\n\n{'='*80}\n\n"
 
-                st.download_button(
-                    label="Descargar Prompts como TXT", data=combined_prompts_content.encode('utf-8'),
-                    file_name=f"prompts_{estacion_seleccionada.replace(' ', '_')}.txt", mime="text/plain"
-                )
+                # Los archivos se construyen solo cuando se piden y se memorizan por el hash de la lista de
+                # ítems, así que los reruns por otros widgets no vuelven a armar el DOCX.
+                formato_exportacion = st.radio("Formato de exportación", list(FORMATOS_EXPORTACION), horizontal=True)
+                clave_exportacion = (formato_exportacion, st.session_state['hash_processed_items'])
+                exportaciones_preparadas = st.session_state.setdefault('exportaciones_preparadas', set())
+                if clave_exportacion not in exportaciones_preparadas and st.button(f"Preparar {formato_exportacion}"):
+                    exportaciones_preparadas.add(clave_exportacion)
+
+                if clave_exportacion in exportaciones_preparadas:
+                    prefijo_archivo, extension, tipo_mime, _ = FORMATOS_EXPORTACION[formato_exportacion]
+                    st.download_button(
+                        label=f"Descargar {formato_exportacion}",
+                        data=construir_exportacion(formato_exportacion, st.session_state['hash_processed_items'],
+                                                   st.session_state['processed_items_list']),
+                        file_name=f"{prefijo_archivo}_{str(estacion_seleccionada).replace(' ', '_')}.{extension}",
+                        mime=tipo_mime
+                    )
 
 
 # --- BLOQUE DE EJECUCIÓN CON CAPTURA DE ERRORES ---
 if __name__ == "__main__":
     try:
         main()
+        registrar_ejecucion_script(obtener_telemetria(), time.perf_counter() - _inicio_script, _segundos_importaciones)
     except Exception as e:
         # Si algo falla, especialmente la inicialización de Vertex AI, se mostrará aquí.
         st.set_page_config(layout="centered")
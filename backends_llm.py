@@ -0,0 +1,469 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import hashlib
+import itertools
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+
+# --- BACKENDS DE LLM ---
+# Todas las llamadas al modelo pasan por un backend. El de Vertex AI reutiliza un cliente
+# GenerativeModel por nombre de modelo; el backend "falso" es determinista y local, para medir
+# y hacer pruebas de carga del ciclo generar→auditar sin red ni credenciales de GCP.
+# generar_en_flujo devuelve la respuesta por fragmentos a medida que llegan; quien la consume puede
+# dejar de iterar (y cerrar el generador) para no esperar el resto.
+
+
+class ErrorBackendLLM(Exception):
+    def __init__(self, mensaje, reintentable=False):
+        super().__init__(mensaje)
+        self.reintentable = reintentable
+
+
+SEGUNDOS_ESPERA_CREACION_CACHE_CONTEXTO = 60
+
+
+def estimar_tokens(texto):
+    # Aproximación de ~4 caracteres por token, suficiente para reportar ahorro de prefijos.
+    return math.ceil(len(texto) / 4) if texto else 0
+
+
+def hash_prefijo(prefijo):
+    return hashlib.sha256(prefijo.encode("utf-8")).hexdigest()
+
+
+# Uso de tokens informado por el backend (usage_metadata de Vertex) para la última llamada del
+# hilo; quien hizo la llamada lo toma con tomar_uso_tokens() en el mismo hilo.
+_uso_por_hilo = threading.local()
+
+
+def registrar_uso_tokens(tokens_entrada, tokens_salida, tokens_cache=0):
+    _uso_por_hilo.uso = {"tokens_entrada": tokens_entrada or 0, "tokens_salida": tokens_salida or 0,
+                         "tokens_cache": tokens_cache or 0}
+
+
+def tomar_uso_tokens():
+    uso = getattr(_uso_por_hilo, "uso", None)
+    _uso_por_hilo.uso = None
+    return uso
+
+
+def _registrar_uso_de_respuesta(respuesta):
+    uso = getattr(respuesta, "usage_metadata", None)
+    if uso is not None:
+        registrar_uso_tokens(getattr(uso, "prompt_token_count", 0), getattr(uso, "candidates_token_count", 0),
+                             getattr(uso, "cached_content_token_count", 0))
+
+
+class BackendLLM:
+    nombre = "base"
+
+    def __init__(self):
+        self._lock_prefijos = threading.Lock()
+        self._prefijos_vistos = set()
+        self.estadisticas_prefijo = {
+            "llamadas_con_cache_contexto": 0,
+            "llamadas_sin_cache_contexto": 0,
+            "tokens_prefijo_desde_cache": 0,
+            "tokens_prefijo_repetidos": 0,
+        }
+
+    @classmethod
+    def desde_entorno(cls):
+        return cls()
+
+    def generar(self, model_name, prompt, generation_config=None):
+        raise NotImplementedError
+
+    def generar_con_prefijo(self, model_name, prefijo, sufijo, generation_config=None):
+        # Sin caché de contexto el prefijo estable se reenvía completo; se contabiliza cuántos
+        # tokens de prefijo ya enviados antes se están repitiendo.
+        self._registrar_prefijo(model_name, prefijo, desde_cache=False)
+        return self.generar(model_name, prefijo + sufijo, generation_config)
+
+    def generar_en_flujo(self, model_name, prefijo, sufijo, generation_config=None):
+        # Por defecto, un backend sin streaming entrega la respuesta completa en un solo fragmento.
+        yield self.generar_con_prefijo(model_name, prefijo, sufijo, generation_config)
+
+    def _registrar_prefijo(self, model_name, prefijo, desde_cache):
+        if not prefijo:
+            return
+        tokens = estimar_tokens(prefijo)
+        clave = (model_name, hash_prefijo(prefijo))
+        with self._lock_prefijos:
+            if desde_cache:
+                self.estadisticas_prefijo["llamadas_con_cache_contexto"] += 1
+                self.estadisticas_prefijo["tokens_prefijo_desde_cache"] += tokens
+                return
+            self.estadisticas_prefijo["llamadas_sin_cache_contexto"] += 1
+            if clave in self._prefijos_vistos:
+                self.estadisticas_prefijo["tokens_prefijo_repetidos"] += tokens
+            else:
+                self._prefijos_vistos.add(clave)
+
+
+class BackendVertex(BackendLLM):
+    nombre = "vertex"
+
+    def __init__(self, project=None, location=None, usar_cache_contexto=True, min_tokens_cache_contexto=4096,
+                 ttl_cache_contexto_minutos=60):
+        super().__init__()
+        import vertexai
+        vertexai.init(project=project, location=location)
+        self.usar_cache_contexto = usar_cache_contexto
+        self.min_tokens_cache_contexto = min_tokens_cache_contexto
+        self.ttl_cache_contexto = datetime.timedelta(minutes=ttl_cache_contexto_minutos)
+        self._modelos = {}
+        self._caches_contexto = {}
+        self._modelos_sin_cache_contexto = set()
+        self._prefijos_sin_cache_contexto = set()
+        self._creaciones_cache_contexto = {}
+        self._lock = threading.Lock()
+        self._lock_caches_contexto = threading.Lock()
+
+    @classmethod
+    def desde_entorno(cls):
+        return cls(
+            project=os.environ.get("GCP_PROJECT_ID"),
+            location=os.environ.get("GCP_LOCATION"),
+            usar_cache_contexto=os.environ.get("VERTEX_CONTEXT_CACHE", "1") != "0",
+            min_tokens_cache_contexto=int(os.environ.get("VERTEX_CONTEXT_CACHE_MIN_TOKENS", 4096)),
+            ttl_cache_contexto_minutos=int(os.environ.get("VERTEX_CONTEXT_CACHE_TTL_MINUTES", 60))
+        )
+
+    def obtener_modelo(self, model_name):
+        # Pool de clientes: un GenerativeModel por nombre de modelo para todo el proceso.
+        with self._lock:
+            modelo = self._modelos.get(model_name)
+            if modelo is None:
+                from vertexai.preview.generative_models import GenerativeModel
+                modelo = GenerativeModel(model_name)
+                self._modelos[model_name] = modelo
+            return modelo
+
+    def generar(self, model_name, prompt, generation_config=None):
+        configuracion = _configuracion_vertex(generation_config)
+        response = self.obtener_modelo(model_name).generate_content(prompt, generation_config=configuracion)
+        _registrar_uso_de_respuesta(response)
+        return response.text
+
+    def generar_con_prefijo(self, model_name, prefijo, sufijo, generation_config=None):
+        modelo_cacheado = self._modelo_con_cache_contexto(model_name, prefijo)
+        if modelo_cacheado is not None:
+            try:
+                response = modelo_cacheado.generate_content(sufijo, generation_config=_configuracion_vertex(generation_config))
+                self._registrar_prefijo(model_name, prefijo, desde_cache=True)
+                _registrar_uso_de_respuesta(response)
+                return response.text
+            except Exception as e:
+                # Solo si la caché expiró o ya no existe en el servidor se descarta y se envía el prompt
+                # completo; cualquier otro error sigue su curso (reintentos de la capa de resiliencia).
+                if not es_cache_contexto_no_disponible(e):
+                    raise
+                self._descartar_cache_contexto(model_name, prefijo)
+        return super().generar_con_prefijo(model_name, prefijo, sufijo, generation_config)
+
+    def generar_en_flujo(self, model_name, prefijo, sufijo, generation_config=None):
+        configuracion = _configuracion_vertex(generation_config)
+        modelo_cacheado = self._modelo_con_cache_contexto(model_name, prefijo)
+        if modelo_cacheado is not None:
+            try:
+                # El error de una caché expirada llega con el primer fragmento; después ya no se puede
+                # reintentar sin repetir texto, así que solo se cae al prompt completo hasta ese punto.
+                respuesta = iter(modelo_cacheado.generate_content(sufijo, generation_config=configuracion, stream=True))
+                primeros = list(itertools.islice(respuesta, 1))
+            except Exception as e:
+                if not es_cache_contexto_no_disponible(e):
+                    raise
+                self._descartar_cache_contexto(model_name, prefijo)
+            else:
+                self._registrar_prefijo(model_name, prefijo, desde_cache=True)
+                yield from _textos_de_fragmentos(respuesta, primeros)
+                return
+        self._registrar_prefijo(model_name, prefijo, desde_cache=False)
+        respuesta = self.obtener_modelo(model_name).generate_content(prefijo + sufijo, generation_config=configuracion, stream=True)
+        yield from _textos_de_fragmentos(respuesta)
+
+    def _descartar_cache_contexto(self, model_name, prefijo):
+        with self._lock_caches_contexto:
+            self._caches_contexto.pop((model_name, hash_prefijo(prefijo)), None)
+
+    def _modelo_con_cache_contexto(self, model_name, prefijo):
+        # Caché de contexto de Vertex AI para el prefijo estable (manual, reglas y formato de salida).
+        # Solo se intenta si el prefijo supera el mínimo de tokens y el modelo la soporta.
+        clave = (model_name, hash_prefijo(prefijo))
+        if (not self.usar_cache_contexto or model_name in self._modelos_sin_cache_contexto
+                or clave in self._prefijos_sin_cache_contexto or estimar_tokens(prefijo) < self.min_tokens_cache_contexto):
+            return None
+        ahora = datetime.datetime.now(datetime.timezone.utc)
+        with self._lock_caches_contexto:
+            entrada = self._caches_contexto.get(clave)
+            if entrada is not None and entrada[1] > ahora:
+                return entrada[0]
+            # La creación es una llamada de red: se hace fuera del lock y una sola vez por prefijo; las
+            # demás llamadas con el mismo prefijo esperan a que termine en lugar de crear otra caché.
+            creacion = self._creaciones_cache_contexto.get(clave)
+            if creacion is None:
+                self._creaciones_cache_contexto[clave] = threading.Event()
+        if creacion is not None:
+            creacion.wait(SEGUNDOS_ESPERA_CREACION_CACHE_CONTEXTO)
+            with self._lock_caches_contexto:
+                entrada = self._caches_contexto.get(clave)
+            return entrada[0] if entrada is not None and entrada[1] > ahora else None
+        try:
+            from vertexai.preview import caching
+            from vertexai.preview.generative_models import GenerativeModel
+            contenido_cacheado = caching.CachedContent.create(
+                model_name=model_name, contents=[prefijo], ttl=self.ttl_cache_contexto
+            )
+            modelo_cacheado = GenerativeModel.from_cached_content(cached_content=contenido_cacheado)
+        except Exception as e:
+            # Solo se deja de intentar si el modelo no soporta la caché o el prefijo no llega al mínimo
+            # de tokens del servidor; un error transitorio se reintenta en la siguiente llamada.
+            motivo = motivo_sin_cache_contexto(e)
+            with self._lock_caches_contexto:
+                if motivo == "modelo":
+                    self._modelos_sin_cache_contexto.add(model_name)
+                elif motivo == "tokens":
+                    self._prefijos_sin_cache_contexto.add(clave)
+                self._creaciones_cache_contexto.pop(clave).set()
+            return None
+        with self._lock_caches_contexto:
+            # Se renueva un minuto antes de que expire en el servidor.
+            self._caches_contexto[clave] = (modelo_cacheado, ahora + self.ttl_cache_contexto - datetime.timedelta(minutes=1))
+            self._creaciones_cache_contexto.pop(clave).set()
+        return modelo_cacheado
+
+
+def _configuracion_vertex(generation_config):
+    # El SDK no acepta el esquema de respuesta como dict crudo (los tipos en minúscula, "object",
+    # fallan con KeyError): el constructor de GenerationConfig lo convierte al formato de la API.
+    if not isinstance(generation_config, dict):
+        return generation_config
+    from vertexai.preview.generative_models import GenerationConfig
+    return GenerationConfig(**generation_config)
+
+
+def es_cache_contexto_no_disponible(error):
+    # Caché de contexto expirada o borrada en el servidor (NotFound / 404, o el mensaje lo indica).
+    if type(error).__name__ == "NotFound" or getattr(error, "code", None) == 404:
+        return True
+    mensaje = str(error).lower()
+    return "cached content" in mensaje and ("expired" in mensaje or "not found" in mensaje)
+
+
+def motivo_sin_cache_contexto(error):
+    # "modelo" si el modelo no soporta la caché de contexto, "tokens" si el contenido no alcanza el
+    # mínimo de tokens del servidor, o None para cualquier otro error (transitorio o desconocido).
+    mensaje = str(error).lower()
+    if "minimum token count" in mensaje or "too few tokens" in mensaje or "min_total_token_count" in mensaje:
+        return "tokens"
+    if ("not supported" in mensaje or "does not support" in mensaje) and "cach" in mensaje:
+        return "modelo"
+    return None
+
+
+class BackendFalso(BackendLLM):
+    nombre = "falso"
+
+    def __init__(self, latencia_segundos=0.5, variacion_latencia=0.5, tasa_fallos=0.0, tasa_rechazo=0.3, semilla=0,
+                 tasa_formato_invalido=0.0, distribucion_latencia="uniforme"):
+        super().__init__()
+        # "uniforme": latencia ± variacion_latencia; "lognormal": mediana latencia_segundos y cola
+        # larga (sigma = variacion_latencia), más parecida a la de un servicio de LLM real.
+        if distribucion_latencia not in ("uniforme", "lognormal"):
+            raise ValueError(f"Distribución de latencia desconocida: '{distribucion_latencia}'.")
+        self.distribucion_latencia = distribucion_latencia
+        self.tasa_formato_invalido = tasa_formato_invalido
+        self.latencia_segundos = latencia_segundos
+        self.variacion_latencia = variacion_latencia
+        self.tasa_fallos = tasa_fallos
+        self.tasa_rechazo = tasa_rechazo
+        self.semilla = semilla
+        self.llamadas = 0
+        self._llamadas_por_prompt = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def desde_entorno(cls):
+        return cls(
+            latencia_segundos=float(os.environ.get("LLM_FAKE_LATENCY_SECONDS", 0.5)),
+            variacion_latencia=float(os.environ.get("LLM_FAKE_LATENCY_JITTER", 0.5)),
+            tasa_fallos=float(os.environ.get("LLM_FAKE_FAILURE_RATE", 0.0)),
+            tasa_rechazo=float(os.environ.get("LLM_FAKE_REJECTION_RATE", 0.3)),
+            semilla=int(os.environ.get("LLM_FAKE_SEED", 0)),
+            tasa_formato_invalido=float(os.environ.get("LLM_FAKE_MALFORMED_RATE", 0.0)),
+            distribucion_latencia=os.environ.get("LLM_FAKE_LATENCY_DISTRIBUTION", "uniforme")
+        )
+
+    def _rng(self, model_name, prompt):
+        # La misma (semilla, modelo, prompt) produce siempre la misma latencia, fallo y respuesta.
+        digest = hashlib.sha256(f"{self.semilla}|{model_name}|{prompt}".encode("utf-8")).digest()
+        return random.Random(int.from_bytes(digest[:8], "big"))
+
+    def _respuesta_simulada(self, model_name, prompt, generation_config=None):
+        # Devuelve (latencia, texto, fallo) deterministas para el prompt. Con response_mime_type
+        # application/json la respuesta es el mismo contenido serializado según el esquema.
+        with self._lock:
+            self.llamadas += 1
+            repeticion = self._llamadas_por_prompt.get((model_name, prompt), 0)
+            self._llamadas_por_prompt[(model_name, prompt)] = repeticion + 1
+        rng = self._rng(model_name, prompt)
+        if self.distribucion_latencia == "lognormal":
+            latencia = self.latencia_segundos * math.exp(self.variacion_latencia * rng.gauss(0, 1))
+        else:
+            latencia = self.latencia_segundos * (1 + self.variacion_latencia * (2 * rng.random() - 1))
+        # Los fallos simulados son transitorios: se sortean también por repetición, así que un
+        # reintento del mismo prompt puede tener éxito (y la respuesta sigue siendo la misma).
+        if self._rng(model_name, f"{prompt}|{repeticion}").random() < self.tasa_fallos:
+            return latencia, None, ErrorBackendLLM(f"Fallo simulado del backend falso para '{model_name}'.", reintentable=True)
+        en_json = (generation_config or {}).get("response_mime_type") == "application/json"
+        if "--- AUDITORÍA POR LOTES ---" in prompt:
+            return latencia, self._auditoria_lote_simulada(model_name, prompt, en_json), None
+        if "ÍTEM A AUDITAR" in prompt:
+            return latencia, self._auditoria_simulada(rng, en_json), None
+        return latencia, self._item_simulado(rng, en_json), None
+
+    def generar(self, model_name, prompt, generation_config=None):
+        latencia, texto, fallo = self._respuesta_simulada(model_name, prompt, generation_config)
+        if latencia > 0:
+            time.sleep(latencia)
+        if fallo is not None:
+            raise fallo
+        return texto
+
+    def generar_en_flujo(self, model_name, prefijo, sufijo, generation_config=None):
+        # Simula el streaming: el primer fragmento llega tras un 20 % de la latencia y el resto se
+        # reparte línea por línea, de modo que cortar el flujo antes también ahorra tiempo.
+        self._registrar_prefijo(model_name, prefijo, desde_cache=False)
+        latencia, texto, fallo = self._respuesta_simulada(model_name, prefijo + sufijo, generation_config)
+        if latencia > 0:
+            time.sleep(latencia * 0.2)
+        if fallo is not None:
+            raise fallo
+        lineas = texto.splitlines(keepends=True)
+        for i, linea in enumerate(lineas):
+            if i and latencia > 0:
+                time.sleep(latencia * 0.8 / len(lineas))
+            yield linea
+
+    def _item_simulado(self, rng, en_json=False):
+        correcta = rng.choice("ABCD")
+        numero = rng.randint(2, 99)
+        # Con un esquema de respuesta el modelo no puede omitir campos: el borrador mal formado solo
+        # se simula en el modo de texto (el sorteo se hace igual, para no alterar el resto).
+        if rng.random() < self.tasa_formato_invalido and not en_json:
+            # Borrador mal formado: solo tres opciones y sin bloque de gráfico.
+            return (
+                f"PREGUNTA: ¿Cuál es el doble de {numero}?\nA. {numero * 2}\nB. {numero}\nC. {numero + 2}\n"
+                f"RESPUESTA CORRECTA: A\nJUSTIFICACIONES:\nA. Es el doble.\nB. Es el mismo número.\nC. Suma en lugar de multiplicar."
+            )
+        por_letra = {
+            letra: f"Es correcta porque aplica el procedimiento adecuado con el valor {numero}." if letra == correcta
+            else f"El estudiante podría escoger la opción {letra} porque confunde el procedimiento. Sin embargo, esto es incorrecto porque omite un paso."
+            for letra in "ABCD"
+        }
+        if en_json:
+            return json.dumps({
+                "pregunta": f"En una situación escolar se registra el valor {numero}. ¿Cuál es el resultado correcto?",
+                "opciones": {"A": str(numero), "B": str(numero + 1), "C": str(numero * 2), "D": str(numero - 1)},
+                "respuesta_correcta": correcta,
+                "justificaciones": por_letra,
+                "grafico_necesario": False,
+                "descripcion_grafico": "",
+            }, ensure_ascii=False, indent=2)
+        justificaciones = "\n".join(f"{letra}. {texto}" for letra, texto in por_letra.items())
+        return (
+            f"PREGUNTA: En una situación escolar se registra el valor {numero}. ¿Cuál es el resultado correcto?\n"
+            f"A. {numero}\nB. {numero + 1}\nC. {numero * 2}\nD. {numero - 1}\n"
+            f"RESPUESTA CORRECTA: {correcta}\n"
+            f"JUSTIFICACIONES:\n{justificaciones}\n"
+            f"GRAFICO_NECESARIO: NO\n"
+            f"DESCRIPCION_GRAFICO: N/A"
+        )
+
+    def _auditoria_lote_simulada(self, model_name, prompt, en_json=False):
+        # Un bloque delimitado por ítem; el veredicto de cada uno depende solo de su propio texto.
+        bloques = re.findall(r"=== ÍTEM (\d+) ===(.*?)=== FIN ÍTEM \1 ===", prompt, re.DOTALL)
+        if en_json:
+            return json.dumps({"auditorias": [
+                {"numero": int(numero), **json.loads(self._auditoria_simulada(self._rng(model_name, texto_item), True))}
+                for numero, texto_item in bloques
+            ]}, ensure_ascii=False, indent=2)
+        return "\n\n".join(
+            f"=== AUDITORÍA ÍTEM {numero} ===\n{self._auditoria_simulada(self._rng(model_name, texto_item))}\n=== FIN AUDITORÍA ÍTEM {numero} ==="
+            for numero, texto_item in bloques
+        )
+
+    def _auditoria_simulada(self, rng, en_json=False):
+        sorteo = rng.random()
+        if sorteo >= self.tasa_rechazo:
+            dictamen, observaciones = "✅ CUMPLE TOTALMENTE", "Sin observaciones."
+        elif sorteo >= self.tasa_rechazo / 2:
+            dictamen, observaciones = "⚠️ CUMPLE PARCIALMENTE", "Las justificaciones incorrectas deben explicar mejor el error."
+        else:
+            dictamen, observaciones = "❌ RECHAZADO", "El enunciado no está alineado con la nanohabilidad."
+        if en_json:
+            return json.dumps({
+                "criterios": [{"criterio": criterio, "resultado": "✅", "comentario": ""}
+                              for criterio in ("Formato del Enunciado", "Número de Opciones (4)", "Respuesta Correcta Indicada")],
+                "dictamen_final": dictamen,
+                "observaciones_finales": observaciones,
+            }, ensure_ascii=False, indent=2)
+        return (
+            "VALIDACIÓN DE CRITERIOS:\n"
+            "- Formato del Enunciado: ✅\n- Número de Opciones (4): ✅\n- Respuesta Correcta Indicada: ✅\n"
+            f"\nDICTAMEN FINAL:\n[{dictamen}]\n\nOBSERVACIONES FINALES:\n{observaciones}"
+        )
+
+
+def _textos_de_fragmentos(respuesta, primeros=()):
+    # El uso de tokens llega en el último fragmento; si el flujo se corta antes, no se registra.
+    # Al cerrar este generador se cierra también el stream de la respuesta: el cliente deja de
+    # esperarla, aunque el servidor puede terminar (y cobrar) la generación de todos modos.
+    try:
+        for fragmento in itertools.chain(primeros, respuesta):
+            _registrar_uso_de_respuesta(fragmento)
+            try:
+                texto = fragmento.text
+            except ValueError:
+                # Fragmentos sin texto (p. ej. solo con el motivo de finalización).
+                continue
+            if texto:
+                yield texto
+    finally:
+        cerrar = getattr(respuesta, "close", None)
+        if cerrar is not None:
+            cerrar()
+
+
+BACKENDS_DISPONIBLES = {
+    BackendVertex.nombre: BackendVertex,
+    BackendFalso.nombre: BackendFalso,
+}
+
+_registro_backends = {}
+_lock_registro = threading.Lock()
+
+
+def obtener_backend(nombre=None):
+    # Registro a nivel de módulo: cada backend (y su pool de clientes) se crea una vez por proceso.
+    nombre = (nombre or os.environ.get("LLM_BACKEND", BackendVertex.nombre)).lower()
+    if nombre not in BACKENDS_DISPONIBLES:
+        raise ValueError(f"Backend de LLM desconocido: '{nombre}'. Opciones: {', '.join(BACKENDS_DISPONIBLES)}")
+    with _lock_registro:
+        if nombre not in _registro_backends:
+            _registro_backends[nombre] = BACKENDS_DISPONIBLES[nombre].desde_entorno()
+        return _registro_backends[nombre]
+
+
+def registrar_backend(backend):
+    # Permite inyectar un backend ya configurado (p. ej. un BackendFalso con otra latencia).
+    with _lock_registro:
+        _registro_backends[backend.nombre] = backend
+    return backend
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+# --- BANCO DE ÍTEMS APROBADOS ---
+# Los ítems aprobados (✅ CUMPLE TOTALMENTE) se guardan en SQLite con su clasificación completa.
+# Un índice sobre la tupla de clasificación permite servir de inmediato los ítems ya existentes de
+# una fila de la estación (grado/área/asignatura/estación/proceso/nanohabilidad/microhabilidad/
+# competencia), y un índice de texto
+# completo (FTS5) sobre el texto del ítem permite buscarlos y encontrar candidatos a duplicado.
+# Un ítem nuevo se considera casi duplicado si la similitud de Jaccard entre los trigramas de
+# palabras de su enunciado y opciones y los de un ítem del banco supera el umbral.
+
+logger = logging.getLogger(__name__)
+
+RUTA_BANCO_POR_DEFECTO = os.path.join(".cache", "banco_items.sqlite")
+UMBRAL_DUPLICADO_POR_DEFECTO = 0.7
+MAX_CANDIDATOS_DUPLICADO = 20
+
+# Columna de la tabla → clave de "classification" en item_final_data.
+COLUMNAS_CLASIFICACION = {
+    "grado": "Grado", "area": "Área", "asignatura": "Asignatura", "estacion": "Estación",
+    "proceso_cognitivo": "Proceso Cognitivo", "nanohabilidad": "Nanohabilidad", "microhabilidad": "Microhabilidad",
+    "competencia": "Competencia Nanohabilidad",
+}
+# Combinación por la que se reutilizan ítems: la misma que distingue las filas de una estación, de
+# modo que un ítem solo se sirve a una fila con exactamente su clasificación.
+COLUMNAS_REUTILIZACION = tuple(COLUMNAS_CLASIFICACION)
+
+
+def terminos_item(item_text):
+    # Solo el enunciado y las opciones: las justificaciones siguen una plantilla parecida en todos los ítems.
+    comparable = item_text.split("JUSTIFICACIONES:", 1)[0]
+    sin_tildes = unicodedata.normalize("NFKD", comparable.lower()).encode("ascii", "ignore").decode("ascii")
+    return re.findall(r"[a-z0-9]+", sin_tildes)
+
+
+def trigramas(terminos):
+    if len(terminos) < 3:
+        return {tuple(terminos)} if terminos else set()
+    return {tuple(terminos[i:i + 3]) for i in range(len(terminos) - 2)}
+
+
+def similitud_jaccard(a, b):
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+class BancoItems:
+    def __init__(self, ruta=RUTA_BANCO_POR_DEFECTO, umbral_duplicado=UMBRAL_DUPLICADO_POR_DEFECTO):
+        self.ruta = ruta
+        self.umbral_duplicado = umbral_duplicado
+        self._lock = threading.Lock()
+
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        # Una sola conexión compartida entre hilos, serializada con el lock.
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False, timeout=30)
+        with self._lock, self._conexion:
+            self._conexion.execute("PRAGMA journal_mode=WAL")
+            self._conexion.execute(f"""
+                CREATE TABLE IF NOT EXISTS items (
+                    id INTEGER PRIMARY KEY,
+                    {", ".join(f"{columna} TEXT NOT NULL" for columna in COLUMNAS_CLASIFICACION)},
+                    item_text TEXT NOT NULL,
+                    dictamen TEXT NOT NULL,
+                    item_final_data TEXT NOT NULL,
+                    creado REAL NOT NULL
+                )
+            """)
+            # El índice anterior cubría solo hasta la nanohabilidad; se reemplaza por el de la combinación completa.
+            self._conexion.execute("DROP INDEX IF EXISTS idx_items_clasificacion")
+            self._conexion.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_items_reutilizacion ON items ({', '.join(COLUMNAS_REUTILIZACION)})"
+            )
+            # Índice de texto completo sincronizado con la tabla por triggers (tabla de contenido externo).
+            self.con_texto_completo = True
+            try:
+                self._conexion.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(item_text, content='items', content_rowid='id')"
+                )
+                self._conexion.execute("""
+                    CREATE TRIGGER IF NOT EXISTS items_fts_insertar AFTER INSERT ON items BEGIN
+                        INSERT INTO items_fts (rowid, item_text) VALUES (new.id, new.item_text);
+                    END
+                """)
+                self._conexion.execute("""
+                    CREATE TRIGGER IF NOT EXISTS items_fts_borrar AFTER DELETE ON items BEGIN
+                        INSERT INTO items_fts (items_fts, rowid, item_text) VALUES ('delete', old.id, old.item_text);
+                    END
+                """)
+            except sqlite3.OperationalError as e:
+                # SQLite compilado sin FTS5: la búsqueda y los duplicados se limitan a la misma estación.
+                logger.warning("Banco de ítems sin índice de texto completo (FTS5 no disponible): %s", e)
+                self.con_texto_completo = False
+
+    # --- Escritura ---
+    def guardar(self, item_final_data):
+        # Devuelve el id del ítem guardado. El mismo texto con la misma clasificación (p. ej. un ítem
+        # servido de nuevo desde la caché del LLM al repetir una fila) no se guarda dos veces.
+        clasificacion = item_final_data["classification"]
+        with self._lock, self._conexion:
+            existente = self._mismo_item(item_final_data["item_text"], clasificacion)
+            if existente is not None:
+                return existente
+            cursor = self._conexion.execute(
+                f"INSERT INTO items ({', '.join(COLUMNAS_CLASIFICACION)}, item_text, dictamen, item_final_data, creado) "
+                f"VALUES ({', '.join('?' * (len(COLUMNAS_CLASIFICACION) + 4))})",
+                (*(str(clasificacion.get(clave, "")) for clave in COLUMNAS_CLASIFICACION.values()),
+                 item_final_data["item_text"], item_final_data["final_audit_status"],
+                 json.dumps(item_final_data, ensure_ascii=False, default=str), time.time())
+            )
+            return cursor.lastrowid
+
+    # --- Consulta ---
+    def items_de(self, clasificacion, dictamen=None, limite=None):
+        # Ítems con la misma clasificación completa (ver COLUMNAS_REUTILIZACION), del más reciente al más antiguo.
+        condiciones = [f"{columna} = ?" for columna in COLUMNAS_REUTILIZACION]
+        parametros = [str(clasificacion.get(COLUMNAS_CLASIFICACION[columna], "")) for columna in COLUMNAS_REUTILIZACION]
+        if dictamen is not None:
+            condiciones.append("dictamen = ?")
+            parametros.append(dictamen)
+        consulta = f"SELECT item_final_data FROM items WHERE {' AND '.join(condiciones)} ORDER BY id DESC"
+        if limite is not None:
+            consulta += f" LIMIT {int(limite)}"
+        with self._lock:
+            return [json.loads(fila[0]) for fila in self._conexion.execute(consulta, parametros)]
+
+    def buscar(self, texto, limite=10):
+        # Búsqueda de texto completo (ranking BM25 de FTS5); devuelve [(id, item_final_data), ...].
+        consulta = self._consulta_texto_completo(terminos_item(texto) or re.findall(r"\w+", texto.lower()))
+        if not consulta:
+            return []
+        if not self.con_texto_completo:
+            with self._lock:
+                filas = self._conexion.execute(
+                    "SELECT id, item_final_data FROM items WHERE item_text LIKE ? ORDER BY id DESC LIMIT ?", (f"%{texto}%", limite)
+                ).fetchall()
+        else:
+            with self._lock:
+                filas = self._conexion.execute(
+                    "SELECT items.id, items.item_final_data FROM items_fts JOIN items ON items.id = items_fts.rowid "
+                    "WHERE items_fts MATCH ? ORDER BY items_fts.rank LIMIT ?", (consulta, limite)
+                ).fetchall()
+        return [(id_item, json.loads(datos)) for id_item, datos in filas]
+
+    def duplicado_de(self, item_text, clasificacion):
+        # Devuelve (id, similitud) del ítem del banco más parecido si supera el umbral, o None. Los
+        # candidatos son los ítems de la misma estación y los mejor rankeados por texto completo; el
+        # mismo ítem ya guardado con esta clasificación no cuenta como duplicado de sí mismo.
+        firma = trigramas(terminos_item(item_text))
+        if not firma:
+            return None
+        columnas_estacion = COLUMNAS_REUTILIZACION[:4]
+        with self._lock:
+            mismo_item = self._mismo_item(item_text, clasificacion)
+            candidatos = dict(self._conexion.execute(
+                f"SELECT id, item_text FROM items WHERE {' AND '.join(f'{columna} = ?' for columna in columnas_estacion)}",
+                [str(clasificacion.get(COLUMNAS_CLASIFICACION[columna], "")) for columna in columnas_estacion]
+            ).fetchall())
+            consulta = self._consulta_texto_completo(terminos_item(item_text))
+            if self.con_texto_completo and consulta:
+                candidatos.update(self._conexion.execute(
+                    "SELECT items.id, items.item_text FROM items_fts JOIN items ON items.id = items_fts.rowid "
+                    "WHERE items_fts MATCH ? ORDER BY items_fts.rank LIMIT ?", (consulta, MAX_CANDIDATOS_DUPLICADO)
+                ).fetchall())
+        candidatos.pop(mismo_item, None)
+        mejor = max(((id_item, similitud_jaccard(firma, trigramas(terminos_item(texto)))) for id_item, texto in candidatos.items()),
+                    key=lambda par: par[1], default=None)
+        return mejor if mejor is not None and mejor[1] >= self.umbral_duplicado else None
+
+    def _mismo_item(self, item_text, clasificacion):
+        # Se llama con el lock tomado.
+        fila = self._conexion.execute(
+            f"SELECT id FROM items WHERE {' AND '.join(f'{columna} = ?' for columna in COLUMNAS_CLASIFICACION)} "
+            "AND item_text = ? ORDER BY id LIMIT 1",
+            (*(str(clasificacion.get(clave, "")) for clave in COLUMNAS_CLASIFICACION.values()), item_text)
+        ).fetchone()
+        return fila[0] if fila is not None else None
+
+    @staticmethod
+    def _consulta_texto_completo(terminos):
+        # Consulta FTS5 "término OR término ...", con cada término entre comillas para escapar la sintaxis.
+        unicos = list(dict.fromkeys(termino for termino in terminos if len(termino) > 1))[:32]
+        return " OR ".join(f'"{termino}"' for termino in unicos)
+
+    def estadisticas(self):
+        with self._lock:
+            total, combinaciones = self._conexion.execute(
+                f"SELECT COUNT(*), COUNT(DISTINCT {' || char(31) || '.join(COLUMNAS_REUTILIZACION)}) FROM items"
+            ).fetchone()
+        return {"items": total, "combinaciones": combinaciones}
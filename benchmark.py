@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import motor
+from backends_llm import BackendFalso
+from exportacion import exportar_a_word
+from resiliencia import ResilienciaLLM
+from telemetria import percentil
+from validador import validar_estructura_item
+
+# --- BENCHMARKS DEL CICLO GENERAR→AUDITAR Y DE LA EXPORTACIÓN ---
+# Ejemplos:
+#   python benchmark.py
+#   python benchmark.py --guardar-linea-base linea_base.json
+#   python benchmark.py --comparar-con linea_base.json      # termina con código 1 si hay regresiones
+# Todos los escenarios usan el backend falso (determinista, sin red ni credenciales) con latencia
+# lognormal y la tasa de rechazo indicada, así que dos ejecuciones con los mismos parámetros hacen
+# exactamente las mismas llamadas. Cada escenario informa rendimiento (operaciones por segundo),
+# percentiles de latencia y memoria pico; la memoria se mide en una segunda pasada con tracemalloc
+# para que su costo no altere los tiempos.
+
+logger = logging.getLogger("benchmark")
+
+ESCENARIOS = ("arranque", "parseo", "item", "estacion", "exportacion_word")
+PROCESOS_COGNITIVOS = ("RECORDAR", "COMPRENDER", "APLICAR", "ANALIZAR", "EVALUAR", "CREAR")
+# Métrica comparada con la línea base → (mayor es mejor, diferencia absoluta mínima para considerarla).
+METRICAS_COMPARADAS = {
+    "p50_segundos": (False, 0.001),
+    "p95_segundos": (False, 0.001),
+    "por_segundo": (True, 0.0),
+    "memoria_pico_mb": (False, 0.5),
+}
+
+
+def fila_sintetica(i, estacion="Estación de prueba"):
+    return {
+        'GRADO': 10, 'ÁREA': 'Matemáticas', 'ASIGNATURA': 'Aritmética', 'ESTACIÓN': estacion,
+        'PROCESO COGNITIVO': PROCESOS_COGNITIVOS[i % len(PROCESOS_COGNITIVOS)],
+        'NANOHABILIDAD': f'Nanohabilidad sintética {i}', 'MICROHABILIDAD': f'Microhabilidad sintética {i // 3}',
+        'COMPETENCIA NANOHABILIDAD': 'Resuelve problemas con números enteros.'
+    }
+
+
+def crear_cliente(args):
+    backend = BackendFalso(latencia_segundos=args.latencia, variacion_latencia=args.variacion_latencia,
+                           tasa_fallos=args.tasa_fallos, tasa_rechazo=args.tasa_rechazo,
+                           tasa_formato_invalido=args.tasa_formato_invalido, distribucion_latencia="lognormal")
+    resiliencia = ResilienciaLLM(backoff_base_segundos=args.latencia / 10, backoff_max_segundos=args.latencia)
+    return motor.ClienteLLM(backend, resiliencia=resiliencia)
+
+
+def medir(tareas, ejecutar, en_paralelo=1):
+    # Devuelve (duraciones de cada tarea, segundos totales). Con en_paralelo > 1 las tareas se
+    # reparten en el mismo pool de hilos que usa el modo estación.
+    def cronometrar(tarea):
+        inicio = time.perf_counter()
+        ejecutar(tarea)
+        return time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    if en_paralelo > 1:
+        duraciones = motor.ejecutar_en_paralelo(tareas, cronometrar, en_paralelo, nombre_hilos="benchmark")
+    else:
+        duraciones = [cronometrar(tarea) for tarea in tareas]
+    return duraciones, time.perf_counter() - inicio
+
+
+def memoria_pico_mb(funcion):
+    tracemalloc.start()
+    try:
+        funcion()
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return pico / 1024 / 1024
+
+
+def resultado(duraciones, segundos_totales, operaciones, memoria_mb, **extra):
+    return {
+        "operaciones": operaciones,
+        "segundos_totales": segundos_totales,
+        "p50_segundos": percentil(duraciones, 50),
+        "p95_segundos": percentil(duraciones, 95),
+        "por_segundo": operaciones / segundos_totales if segundos_totales else 0.0,
+        "memoria_pico_mb": memoria_mb,
+        **extra
+    }
+
+
+# --- ESCENARIOS ---
+def escenario_arranque(args):
+    # Importar app.py en un intérprete nuevo: lo que paga un arranque en frío de Cloud Run antes de
+    # atender la primera solicitud (sin contar el arranque del propio intérprete).
+    directorio = os.path.dirname(os.path.abspath(__file__))
+    codigo = ("import time; inicio = time.perf_counter(); import app; "
+              "import resource; print(time.perf_counter() - inicio, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)")
+    duraciones, memorias = [], []
+    for _ in range(args.repeticiones_arranque):
+        salida = subprocess.run([sys.executable, "-c", codigo], cwd=directorio, capture_output=True, text=True, check=True)
+        segundos, memoria_kb = salida.stdout.split()[-2:]
+        duraciones.append(float(segundos))
+        memorias.append(int(memoria_kb) / 1024)
+    # Aquí la memoria es el RSS máximo del proceso hijo, no la memoria de Python medida con tracemalloc.
+    return {"arranque_importaciones": resultado(duraciones, sum(duraciones), len(duraciones), max(memorias))}
+
+
+def escenario_parseo(args):
+    # Respuestas del generador y del auditor simuladas (sin latencia), parseadas como en el ciclo real.
+    backend = BackendFalso(latencia_segundos=0, tasa_rechazo=args.tasa_rechazo, tasa_formato_invalido=args.tasa_formato_invalido)
+    items = [backend.generar("benchmark", f"Generar ítem {i}") for i in range(args.repeticiones_parseo)]
+    auditorias = [backend.generar("benchmark", f"--- ÍTEM A AUDITAR --- {i}") for i in range(args.repeticiones_parseo)]
+
+    def parsear_item(texto):
+        item_text, grafico, descripcion, formato_reconocido = motor.parsear_item_generado(texto)
+        validar_estructura_item(item_text, grafico, descripcion, formato_reconocido)
+
+    def parsear_auditoria(texto):
+        motor.dictamen_aprobado_en(texto)
+        motor.parsear_auditoria(texto)
+
+    resultados = {}
+    for nombre, textos, funcion in (("parseo_item", items, parsear_item), ("parseo_auditoria", auditorias, parsear_auditoria)):
+        duraciones, total = medir(textos, funcion)
+        memoria = memoria_pico_mb(lambda: medir(textos, funcion))
+        resultados[nombre] = resultado(duraciones, total, len(textos), memoria)
+    return resultados
+
+
+def escenario_item(args):
+    # Un ítem por tarea con generar_pregunta_con_seleccion, con varios ítems en vuelo a la vez.
+    def ejecutar(cliente_llm):
+        def generar(i):
+            motor.generar_pregunta_con_seleccion(cliente_llm, "gen-benchmark", "audit-benchmark", fila_sintetica(i),
+                                                 motor.CRITERIOS_POR_DEFECTO, candidatos_en_paralelo=args.candidatos,
+                                                 salida_json=args.salida_json, cascada_auditoria=cascada_auditoria(args))
+        return medir(list(range(args.items)), generar, args.items_en_paralelo)
+
+    cliente_llm = crear_cliente(args)
+    duraciones, total = ejecutar(cliente_llm)
+    memoria = memoria_pico_mb(lambda: ejecutar(crear_cliente(args)))
+    return {"item": resultado(duraciones, total, args.items, memoria, **_resumen_ciclo(cliente_llm))}
+
+
+def escenario_estacion(args):
+    # Una estación completa con generar_items_estacion; las latencias por ítem salen de la telemetría.
+    filas = [fila_sintetica(i, "Estación de benchmark") for i in range(args.items_estacion)]
+    filas = [{columna: fila[columna] for columna in motor.COLUMNAS_FILA_ESTACION} for fila in filas]
+
+    def ejecutar(cliente_llm):
+        return medir([filas], lambda filas_estacion: motor.generar_items_estacion(
+            cliente_llm, "gen-benchmark", "audit-benchmark", 10, 'Matemáticas', 'Aritmética', "Estación de benchmark",
+            filas_estacion, motor.CRITERIOS_POR_DEFECTO, max_en_paralelo=args.items_en_paralelo,
+            candidatos_en_paralelo=args.candidatos, tamano_lote_auditoria=args.lote_auditoria, salida_json=args.salida_json,
+            cascada_auditoria=cascada_auditoria(args)
+        ))
+
+    cliente_llm = crear_cliente(args)
+    _, total = ejecutar(cliente_llm)
+    memoria = memoria_pico_mb(lambda: ejecutar(crear_cliente(args)))
+    duraciones = cliente_llm.telemetria.valores_observados("item_segundos")
+    return {"estacion": resultado(duraciones, total, len(filas), memoria, **_resumen_ciclo(cliente_llm))}
+
+
+def escenario_exportacion_word(args):
+    backend = BackendFalso(latencia_segundos=0)
+    items = []
+    for i in range(max(args.tamanos_exportacion)):
+        item_text, grafico, descripcion, _ = motor.parsear_item_generado(backend.generar("benchmark", f"Generar ítem {i}"))
+        status, observaciones = motor.parsear_auditoria(backend.generar("benchmark", f"--- ÍTEM A AUDITAR --- {i}"))
+        items.append({
+            "item_text": item_text, "classification": {clave.title(): valor for clave, valor in fila_sintetica(i).items()},
+            "grafico_necesario": grafico, "descripcion_grafico": descripcion,
+            "final_audit_status": status, "final_audit_observations": observaciones
+        })
+
+    resultados = {}
+    for tamano in args.tamanos_exportacion:
+        lote = items[:tamano]
+        duraciones, total = medir(range(args.repeticiones_exportacion), lambda _: exportar_a_word(lote))
+        memoria = memoria_pico_mb(lambda: exportar_a_word(lote))
+        # Aquí "por_segundo" son ítems exportados por segundo.
+        resultados[f"exportacion_word_{tamano}"] = resultado(duraciones, total, tamano * args.repeticiones_exportacion, memoria)
+    return resultados
+
+
+def cascada_auditoria(args):
+    return motor.CascadaAuditoria(["audit-benchmark-escalamiento"]) if args.cascada else None
+
+
+def _resumen_ciclo(cliente_llm):
+    resumen = cliente_llm.telemetria.resumen()
+    llamadas = sum(latencia["llamadas"] for latencia in resumen["latencias"].values())
+    return {
+        "llamadas_llm": llamadas,
+        "items_aprobados": resumen["items_aprobados"],
+        "tasa_aprobacion_por_intento": {str(intento): datos["tasa_aprobacion"]
+                                        for intento, datos in resumen["tasa_aprobacion_por_intento"].items()},
+        "tasa_escalamiento_por_nivel": {str(nivel): datos["tasa_escalamiento"]
+                                        for nivel, datos in resumen["cascada_auditoria"].items()},
+    }
+
+
+FUNCIONES_ESCENARIOS = {
+    "arranque": escenario_arranque,
+    "parseo": escenario_parseo,
+    "item": escenario_item,
+    "estacion": escenario_estacion,
+    "exportacion_word": escenario_exportacion_word,
+}
+
+
+# --- LÍNEA BASE ---
+def comparar_con_linea_base(resultados, linea_base, tolerancia):
+    # Devuelve una lista de textos, uno por métrica que empeoró más que la tolerancia.
+    regresiones = []
+    for nombre, actual in resultados.items():
+        base = linea_base.get(nombre)
+        if base is None:
+            continue
+        for metrica, (mayor_es_mejor, diferencia_minima) in METRICAS_COMPARADAS.items():
+            valor, valor_base = actual.get(metrica), base.get(metrica)
+            if valor is None or valor_base is None or abs(valor - valor_base) <= diferencia_minima:
+                continue
+            if mayor_es_mejor and valor < valor_base * (1 - tolerancia) or not mayor_es_mejor and valor > valor_base * (1 + tolerancia):
+                regresiones.append(f"{nombre}.{metrica}: {valor:.4g} (línea base {valor_base:.4g})")
+    return regresiones
+
+
+def formatear_informe(resultados):
+    lineas = [f"{'escenario':<26}{'operaciones':>12}{'por segundo':>14}{'p50 (ms)':>12}{'p95 (ms)':>12}{'memoria (MB)':>14}"]
+    for nombre, datos in resultados.items():
+        lineas.append(
+            f"{nombre:<26}{datos['operaciones']:>12}{datos['por_segundo']:>14.1f}{(datos['p50_segundos'] or 0) * 1000:>12.2f}"
+            f"{(datos['p95_segundos'] or 0) * 1000:>12.2f}{datos['memoria_pico_mb']:>14.2f}"
+        )
+    return "\n".join(lineas)
+
+
+def construir_parser():
+    parser = argparse.ArgumentParser(description="Benchmarks del ciclo generar→auditar y de la exportación, con el backend simulado.")
+    parser.add_argument("--escenarios", nargs="+", choices=ESCENARIOS, default=list(ESCENARIOS))
+    parser.add_argument("--latencia", type=float, default=0.05, help="Latencia mediana simulada por llamada al LLM (segundos).")
+    parser.add_argument("--variacion-latencia", type=float, default=0.5, help="Sigma de la latencia lognormal (cola de la distribución).")
+    parser.add_argument("--tasa-rechazo", type=float, default=0.3, help="Proporción de auditorías simuladas que no aprueban el ítem.")
+    parser.add_argument("--tasa-formato-invalido", type=float, default=0.05, help="Proporción de borradores simulados mal formados.")
+    parser.add_argument("--tasa-fallos", type=float, default=0.0, help="Proporción de llamadas simuladas con error transitorio.")
+    parser.add_argument("--items", type=int, default=24, help="Ítems del escenario 'item'.")
+    parser.add_argument("--items-estacion", type=int, default=24, help="Filas de la estación del escenario 'estacion'.")
+    parser.add_argument("--items-en-paralelo", type=int, default=4)
+    parser.add_argument("--candidatos", type=int, default=1)
+    parser.add_argument("--lote-auditoria", type=int, default=1)
+    parser.add_argument("--salida-json", action="store_true", help="Ítems y auditorías en modo JSON con esquema.")
+    parser.add_argument("--cascada", action="store_true", help="Auditoría en cascada con un modelo de escalamiento simulado.")
+    parser.add_argument("--repeticiones-arranque", type=int, default=5)
+    parser.add_argument("--repeticiones-parseo", type=int, default=2000)
+    parser.add_argument("--tamanos-exportacion", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeticiones-exportacion", type=int, default=3)
+    parser.add_argument("--salida", help="Escribe los resultados en este archivo JSON.")
+    parser.add_argument("--guardar-linea-base", metavar="RUTA", help="Guarda los resultados como línea base.")
+    parser.add_argument("--comparar-con", metavar="RUTA", help="Compara con una línea base y falla si alguna métrica empeora.")
+    parser.add_argument("--tolerancia", type=float, default=0.25, help="Empeoramiento relativo admitido frente a la línea base.")
+    return parser
+
+
+def main(argv=None):
+    args = construir_parser().parse_args(argv)
+    # Las advertencias del ciclo (borradores mal formados, rechazos) son parte del escenario: no se muestran.
+    logging.basicConfig(level=logging.ERROR, format="%(asctime)s %(levelname)s %(message)s")
+    logger.setLevel(logging.INFO)
+
+    resultados = {}
+    for escenario in args.escenarios:
+        logger.info("Ejecutando escenario '%s'...", escenario)
+        resultados.update(FUNCIONES_ESCENARIOS[escenario](args))
+    print(formatear_informe(resultados))
+
+    documento = {
+        "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(), "plataforma": platform.platform(), "cpus": os.cpu_count(),
+        "parametros": {clave: valor for clave, valor in vars(args).items()
+                       if clave not in ("salida", "guardar_linea_base", "comparar_con", "tolerancia")},
+        "resultados": resultados,
+    }
+    for ruta in (args.salida, args.guardar_linea_base):
+        if ruta:
+            with open(ruta, "w", encoding="utf-8") as archivo:
+                json.dump(documento, archivo, ensure_ascii=False, indent=2)
+            logger.info("Resultados guardados en %s", ruta)
+
+    if args.comparar_con:
+        with open(args.comparar_con, encoding="utf-8") as archivo:
+            linea_base = json.load(archivo)
+        if linea_base.get("parametros") != documento["parametros"]:
+            logger.warning("La línea base se midió con otros parámetros: %s", linea_base.get("parametros"))
+        regresiones = comparar_con_linea_base(resultados, linea_base["resultados"], args.tolerancia)
+        if regresiones:
+            logger.error("Regresiones frente a %s (tolerancia %.0f %%):\n  %s", args.comparar_con, args.tolerancia * 100,
+                         "\n  ".join(regresiones))
+            return 1
+        logger.info("Sin regresiones frente a %s (tolerancia %.0f %%).", args.comparar_con, args.tolerancia * 100)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+# --- BITÁCORA DE TRABAJOS REANUDABLE ---
+# Cada intento (generación + auditoría) y cada ítem terminado se agregan a un archivo JSONL,
+# con fsync, apenas ocurren. La clave de cada ítem es la tupla de clasificación
+# (grado, área, asignatura, estación, proceso, nanohabilidad, microhabilidad, competencia).
+# Al reanudar, los ítems terminados se reutilizan y los que quedaron a medias continúan el
+# refinamiento desde su último intento registrado.
+
+logger = logging.getLogger(__name__)
+
+DIRECTORIO_BITACORAS_POR_DEFECTO = os.path.join(".cache", "bitacoras")
+
+
+def id_trabajo(**parametros):
+    # Identifica un trabajo por todo lo que cambia el resultado (modelos, criterios, manual, prompts).
+    contenido = json.dumps(parametros, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()[:16]
+
+
+def clave_item(classification_details):
+    return tuple(str(valor) for valor in classification_details.values())
+
+
+class BitacoraTrabajo:
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._items_terminados = {}
+        self._ultimos_intentos = {}
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self._cargar()
+
+    @classmethod
+    def para_trabajo(cls, directorio, identificador, reiniciar=False):
+        ruta = os.path.join(directorio, f"{identificador}.jsonl")
+        if reiniciar and os.path.exists(ruta):
+            # La bitácora anterior se conserva aparte en lugar de borrarse.
+            os.replace(ruta, f"{ruta}.{int(time.time())}.descartada")
+        return cls(ruta)
+
+    def _cargar(self):
+        if not os.path.exists(self.ruta):
+            return
+        with open(self.ruta, encoding="utf-8") as archivo:
+            for numero_linea, linea in enumerate(archivo, start=1):
+                try:
+                    registro = json.loads(linea)
+                except json.JSONDecodeError:
+                    # Una línea incompleta (p. ej. el proceso murió a mitad de escritura) se descarta.
+                    logger.warning("Línea %s de la bitácora %s ilegible; se omite.", numero_linea, self.ruta)
+                    continue
+                self._aplicar(registro)
+
+    def _aplicar(self, registro):
+        clave = tuple(registro["clave"])
+        if registro["tipo"] == "item":
+            self._items_terminados[clave] = registro["item_final_data"]
+        elif registro["tipo"] == "intento":
+            anterior = self._ultimos_intentos.get(clave)
+            if anterior is None or registro["intento"] >= anterior["intento"]:
+                self._ultimos_intentos[clave] = registro
+
+    def _agregar(self, registro):
+        linea = json.dumps(registro, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            with open(self.ruta, "a", encoding="utf-8") as archivo:
+                archivo.write(linea)
+                archivo.flush()
+                os.fsync(archivo.fileno())
+            self._aplicar(registro)
+
+    def item_terminado(self, clave):
+        with self._lock:
+            return self._items_terminados.get(clave)
+
+    def ultimo_intento(self, clave):
+        # Devuelve {"intento": n, "item_final_data": {...}} o None.
+        with self._lock:
+            return self._ultimos_intentos.get(clave)
+
+    def registrar_intento(self, clave, intento, item_final_data):
+        self._agregar({"tipo": "intento", "clave": list(clave), "intento": intento,
+                       "item_final_data": item_final_data, "ts": time.time()})
+
+    def registrar_item(self, clave, item_final_data):
+        self._agregar({"tipo": "item", "clave": list(clave), "item_final_data": item_final_data, "ts": time.time()})
+
+    def resumen(self):
+        with self._lock:
+            en_progreso = set(self._ultimos_intentos) - set(self._items_terminados)
+            return {"terminados": len(self._items_terminados), "en_progreso": len(en_progreso)}
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# --- CACHÉ PERSISTENTE DE RESPUESTAS DEL LLM ---
+# Las respuestas se guardan en SQLite, direccionadas por el hash de (modelo, prompt, configuración
+# de generación). La expiración es por TTL y, al superar el máximo de entradas, se expulsan las
+# menos usadas recientemente (LRU según la fecha del último acceso).
+
+RUTA_CACHE_POR_DEFECTO = os.path.join(".cache", "llm_respuestas.sqlite")
+TTL_POR_DEFECTO_SEGUNDOS = 7 * 24 * 3600
+MAX_ENTRADAS_POR_DEFECTO = 5000
+
+
+def clave_cache(model_name, prompt, generation_config=None, corte=None):
+    # corte identifica la condición con la que se cortó el flujo de la respuesta: una respuesta
+    # truncada no puede servirse a quien pide el texto completo (ni al revés).
+    datos = {"modelo": model_name, "prompt": prompt, "config": generation_config or {}}
+    if corte:
+        datos["corte"] = corte
+    contenido = json.dumps(datos, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+
+class CacheRespuestasLLM:
+    def __init__(self, ruta=RUTA_CACHE_POR_DEFECTO, ttl_segundos=TTL_POR_DEFECTO_SEGUNDOS,
+                 max_entradas=MAX_ENTRADAS_POR_DEFECTO):
+        self.ruta = ruta
+        self.ttl_segundos = ttl_segundos
+        self.max_entradas = max_entradas
+        self.aciertos = 0
+        self.fallos = 0
+        self._lock = threading.Lock()
+
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        # Una sola conexión compartida entre hilos, serializada con el lock.
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False, timeout=30)
+        with self._lock, self._conexion:
+            self._conexion.execute("PRAGMA journal_mode=WAL")
+            self._conexion.execute("""
+                CREATE TABLE IF NOT EXISTS respuestas (
+                    clave TEXT PRIMARY KEY,
+                    modelo TEXT NOT NULL,
+                    respuesta TEXT NOT NULL,
+                    creado REAL NOT NULL,
+                    ultimo_acceso REAL NOT NULL
+                )
+            """)
+            self._conexion.execute("CREATE INDEX IF NOT EXISTS idx_respuestas_acceso ON respuestas (ultimo_acceso)")
+
+    def obtener(self, clave):
+        ahora = time.time()
+        with self._lock, self._conexion:
+            fila = self._conexion.execute(
+                "SELECT respuesta, creado FROM respuestas WHERE clave = ?", (clave,)
+            ).fetchone()
+            if fila is None or (self.ttl_segundos and ahora - fila[1] > self.ttl_segundos):
+                if fila is not None:
+                    self._conexion.execute("DELETE FROM respuestas WHERE clave = ?", (clave,))
+                self.fallos += 1
+                return None
+            self._conexion.execute("UPDATE respuestas SET ultimo_acceso = ? WHERE clave = ?", (ahora, clave))
+            self.aciertos += 1
+            return fila[0]
+
+    def guardar(self, clave, model_name, respuesta):
+        ahora = time.time()
+        with self._lock, self._conexion:
+            self._conexion.execute(
+                "INSERT OR REPLACE INTO respuestas (clave, modelo, respuesta, creado, ultimo_acceso) VALUES (?, ?, ?, ?, ?)",
+                (clave, model_name, respuesta, ahora, ahora)
+            )
+            self._expulsar(ahora)
+
+    def _expulsar(self, ahora):
+        if self.ttl_segundos:
+            self._conexion.execute("DELETE FROM respuestas WHERE creado < ?", (ahora - self.ttl_segundos,))
+        total = self._conexion.execute("SELECT COUNT(*) FROM respuestas").fetchone()[0]
+        exceso = total - self.max_entradas
+        if exceso > 0:
+            self._conexion.execute(
+                "DELETE FROM respuestas WHERE clave IN (SELECT clave FROM respuestas ORDER BY ultimo_acceso ASC LIMIT ?)",
+                (exceso,)
+            )
+
+    def limpiar(self):
+        with self._lock, self._conexion:
+            self._conexion.execute("DELETE FROM respuestas")
+
+    def estadisticas(self):
+        with self._lock:
+            entradas = self._conexion.execute("SELECT COUNT(*) FROM respuestas").fetchone()[0]
+        consultas = self.aciertos + self.fallos
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": (self.aciertos / consultas) if consultas else 0.0,
+            "entradas": entradas,
+        }
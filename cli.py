@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import collections
+import logging
+import os
+import re
+import sys
+
+from backends_llm import obtener_backend, BACKENDS_DISPONIBLES
+from banco_items import BancoItems, RUTA_BANCO_POR_DEFECTO
+from bitacora import BitacoraTrabajo, id_trabajo
+from cache_llm import CacheRespuestasLLM, RUTA_CACHE_POR_DEFECTO, TTL_POR_DEFECTO_SEGUNDOS, MAX_ENTRADAS_POR_DEFECTO
+import motor
+from resiliencia import ResilienciaLLM
+from telemetria import Telemetria
+from recuperacion_manual import IndiceManual, SeleccionManual, PRESUPUESTO_TOKENS_POR_DEFECTO, MAX_SECCIONES_POR_DEFECTO
+from exportacion import EscritorXLSX, exportar_a_word, item_a_linea_jsonl
+from taxonomia import leer_libro_excel
+
+# --- LÍNEA DE COMANDOS: GENERACIÓN DE BANCOS DE ÍTEMS COMPLETOS ---
+# Ejemplo:
+#   python cli.py --excel ESTRUCTURA_TOTAL.xlsx --manual Manual_construccion_pruebas_IMProve.pdf --salida banco/
+# Genera y audita los ítems de cada combinación grado/área/asignatura/estación del libro,
+# escribiendo banco/items.jsonl, banco/items.xlsx y un DOCX por estación en banco/docx/, más la telemetría
+# en banco/telemetria.jsonl y banco/metricas.prom. Si la ejecución se interrumpe, al repetir el mismo
+# comando se reanuda desde la bitácora en banco/bitacoras/. Los ítems aprobados se guardan además en
+# el banco de ítems (--banco); con --reutilizar-banco solo se generan los que aún no tienen uno aprobado.
+
+logger = logging.getLogger("cli")
+
+
+def nombre_archivo_seguro(*partes):
+    return re.sub(r"[^\w\-]+", "_", "_".join(str(parte) for parte in partes)).strip("_")
+
+
+def construir_parser():
+    parser = argparse.ArgumentParser(description="Genera y audita ítems para todas las estaciones de ESTRUCTURA_TOTAL.xlsx.")
+    parser.add_argument("--excel", required=True, help="Ruta al libro ESTRUCTURA_TOTAL.xlsx.")
+    parser.add_argument("--manual", help="Ruta al PDF del manual de construcción de pruebas.")
+    parser.add_argument("--salida", default="banco_items", help="Directorio de salida (JSONL y DOCX).")
+    parser.add_argument("--modelo-generacion", default="gemini-2.0-flash")
+    parser.add_argument("--modelo-auditoria", default="gemini-2.0-flash-lite")
+    parser.add_argument("--backend", choices=sorted(BACKENDS_DISPONIBLES), help="Backend de LLM (por defecto, LLM_BACKEND o vertex).")
+    parser.add_argument("--estaciones-en-paralelo", type=int, default=2)
+    parser.add_argument("--items-en-paralelo", type=int, default=4, help="Ítems en paralelo dentro de cada estación.")
+    parser.add_argument("--candidatos", type=int, default=1,
+                        help="Candidatos generados y auditados en paralelo en el primer intento de cada ítem (más tokens, menos latencia).")
+    parser.add_argument("--lote-auditoria", type=int, default=1,
+                        help="Ítems por solicitud de auditoría dentro de cada estación (1 audita cada ítem por separado).")
+    parser.add_argument("--modelos-escalamiento-auditoria", nargs="+", metavar="MODELO",
+                        help="Auditoría en cascada: los dictámenes dudosos del modelo de auditoría se escalan a estos modelos, en orden.")
+    parser.add_argument("--motivos-escalamiento", nargs="+", choices=list(motor.MOTIVOS_ESCALAMIENTO),
+                        default=list(motor.MOTIVOS_ESCALAMIENTO), help="Motivos por los que se escala una auditoría en cascada.")
+    parser.add_argument("--banco", default=os.environ.get("ITEM_BANK_PATH", RUTA_BANCO_POR_DEFECTO),
+                        help="Banco SQLite de ítems aprobados (se guardan allí y se evitan casi duplicados).")
+    parser.add_argument("--sin-banco", action="store_true", help="No usa el banco de ítems.")
+    parser.add_argument("--reutilizar-banco", action="store_true",
+                        help="Sirve desde el banco las filas que ya tienen un ítem aprobado y solo genera las que faltan.")
+    parser.add_argument("--salida-json", action="store_true",
+                        help="Pide al generador y al auditor JSON validado contra un esquema en lugar de texto libre.")
+    parser.add_argument("--grado", help="Limita la ejecución a un grado.")
+    parser.add_argument("--area", help="Limita la ejecución a un área.")
+    parser.add_argument("--asignatura", help="Limita la ejecución a una asignatura.")
+    parser.add_argument("--estacion", help="Limita la ejecución a una estación.")
+    parser.add_argument("--presupuesto-manual-tokens", type=int, default=PRESUPUESTO_TOKENS_POR_DEFECTO,
+                        help="Tokens del manual por ítem (secciones relevantes elegidas con BM25). 0 recorta el manual como antes.")
+    parser.add_argument("--secciones-manual", type=int, default=MAX_SECCIONES_POR_DEFECTO, help="Máximo de secciones del manual por ítem.")
+    parser.add_argument("--ignorar-cache", action="store_true", help="No usa ni guarda respuestas en la caché del LLM.")
+    parser.add_argument("--sin-validacion-local", action="store_true", help="Envía todos los ítems a la auditoría con LLM sin validar antes su estructura.")
+    parser.add_argument("--reiniciar", action="store_true", help="Descarta la bitácora de una ejecución anterior y empieza desde cero.")
+    return parser
+
+
+def main(argv=None):
+    args = construir_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(threadName)s %(message)s")
+
+    df_datos = leer_libro_excel(args.excel)
+
+    manual_reglas_texto = ""
+    seleccion_manual = None
+    if args.manual:
+        with open(args.manual, "rb") as archivo_pdf:
+            manual_reglas_texto = motor.extraer_texto_pdf(archivo_pdf.read())
+        if args.presupuesto_manual_tokens > 0:
+            indice_manual = IndiceManual(manual_reglas_texto)
+            seleccion_manual = SeleccionManual(indice_manual, args.presupuesto_manual_tokens, args.secciones_manual)
+            logger.info("Manual indexado: %s secciones (~%s tokens).", len(indice_manual.secciones), indice_manual.tokens_totales)
+        else:
+            manual_reglas_texto, recortado = motor.recortar_manual(manual_reglas_texto)
+            if recortado:
+                logger.warning("Manual truncado a %s caracteres.", motor.MAX_LONGITUD_MANUAL)
+
+    filtros = {"GRADO": args.grado, "ÁREA": args.area, "ASIGNATURA": args.asignatura, "ESTACIÓN": args.estacion}
+    for columna, valor in filtros.items():
+        if valor is not None:
+            df_datos = df_datos[df_datos[columna].astype(str) == str(valor)]
+
+    estaciones = motor.estaciones_del_libro(df_datos)
+    if not estaciones:
+        logger.error("No hay estaciones para generar con los filtros indicados.")
+        return 1
+    logger.info("Se generarán ítems para %s estación(es).", len(estaciones))
+
+    cliente_llm = motor.ClienteLLM(
+        obtener_backend(args.backend),
+        cache=CacheRespuestasLLM(
+            ruta=os.environ.get("LLM_CACHE_PATH", RUTA_CACHE_POR_DEFECTO),
+            ttl_segundos=int(os.environ.get("LLM_CACHE_TTL_SECONDS", TTL_POR_DEFECTO_SEGUNDOS)),
+            max_entradas=int(os.environ.get("LLM_CACHE_MAX_ENTRIES", MAX_ENTRADAS_POR_DEFECTO))
+        ),
+        ignorar_cache=args.ignorar_cache,
+        resiliencia=ResilienciaLLM.desde_entorno(),
+        telemetria=Telemetria.desde_entorno(os.path.join(args.salida, "telemetria.jsonl"))
+    )
+
+    banco_items = None if args.sin_banco else BancoItems(args.banco)
+
+    cascada_auditoria = None
+    if args.modelos_escalamiento_auditoria:
+        cascada_auditoria = motor.CascadaAuditoria(args.modelos_escalamiento_auditoria, args.motivos_escalamiento)
+
+    bitacora_trabajo = BitacoraTrabajo.para_trabajo(
+        os.path.join(args.salida, "bitacoras"),
+        id_trabajo(backend=cliente_llm.backend.nombre, gen_model_name=args.modelo_generacion, audit_model_name=args.modelo_auditoria,
+                   criterios=motor.CRITERIOS_POR_DEFECTO, manual=manual_reglas_texto,
+                   validar_estructura=not args.sin_validacion_local, candidatos_en_paralelo=args.candidatos,
+                   salida_json=args.salida_json, reutilizar_banco=args.reutilizar_banco and not args.sin_banco,
+                   cascada_auditoria=(cascada_auditoria.modelos_escalamiento, cascada_auditoria.motivos) if cascada_auditoria else None,
+                   seleccion_manual=(args.presupuesto_manual_tokens, args.secciones_manual) if seleccion_manual else None),
+        reiniciar=args.reiniciar
+    )
+    resumen_bitacora = bitacora_trabajo.resumen()
+    if resumen_bitacora["terminados"] or resumen_bitacora["en_progreso"]:
+        logger.info("Reanudando desde %s: %s ítem(s) terminados, %s en refinamiento.",
+                    bitacora_trabajo.ruta, resumen_bitacora["terminados"], resumen_bitacora["en_progreso"])
+
+    def procesar_estacion(estacion):
+        grado, area, asignatura, nombre_estacion, df_estacion = estacion
+        return motor.generar_items_estacion(
+            cliente_llm, args.modelo_generacion, args.modelo_auditoria, grado, area, asignatura, nombre_estacion,
+            motor.filas_de_estacion(df_estacion), motor.CRITERIOS_POR_DEFECTO, manual_reglas_texto,
+            max_en_paralelo=args.items_en_paralelo, bitacora=bitacora_trabajo,
+            validar_estructura=not args.sin_validacion_local, seleccion_manual=seleccion_manual,
+            candidatos_en_paralelo=args.candidatos, tamano_lote_auditoria=args.lote_auditoria,
+            salida_json=args.salida_json, cascada_auditoria=cascada_auditoria,
+            banco_items=banco_items, reutilizar_banco=args.reutilizar_banco
+        )
+
+    os.makedirs(os.path.join(args.salida, "docx"), exist_ok=True)
+    dictamenes = collections.Counter()
+
+    escritor_xlsx = EscritorXLSX(os.path.join(args.salida, "items.xlsx"))
+    with open(os.path.join(args.salida, "items.jsonl"), "w", encoding="utf-8") as archivo_jsonl:
+        def al_cambiar_estado(i, estado, detalle):
+            grado, area, asignatura, nombre_estacion, _ = estaciones[i]
+            if estado == "procesando":
+                logger.info("Estación %s/%s en proceso: %s / %s / %s / %s", i + 1, len(estaciones), grado, area, asignatura, nombre_estacion)
+            elif estado == "error":
+                logger.error("Estación %s/%s falló: %s", i + 1, len(estaciones), detalle)
+            elif estado == "terminado":
+                items_estacion = [item_data for item_data in detalle if item_data]
+                for item_data in items_estacion:
+                    archivo_jsonl.write(item_a_linea_jsonl(item_data))
+                    escritor_xlsx.agregar(item_data)
+                    dictamenes[item_data.get("final_audit_status", "N/A")] += 1
+                archivo_jsonl.flush()
+                ruta_docx = os.path.join(args.salida, "docx", nombre_archivo_seguro("items", grado, area, asignatura, nombre_estacion) + ".docx")
+                with open(ruta_docx, "wb") as archivo_docx:
+                    archivo_docx.write(exportar_a_word(items_estacion).getvalue())
+                logger.info("Estación %s/%s terminada: %s ítem(s) → %s", i + 1, len(estaciones), len(items_estacion), ruta_docx)
+
+        # Las llamadas al LLM son de E/S, así que basta un pool de hilos por estación (y otro por
+        # ítem dentro de cada estación) para mantener varias solicitudes en vuelo.
+        motor.ejecutar_en_paralelo(estaciones, procesar_estacion, args.estaciones_en_paralelo, al_cambiar_estado, nombre_hilos="cli")
+    escritor_xlsx.cerrar()
+
+    logger.info("Resumen de dictámenes: %s", dict(dictamenes))
+    for nombre_modelo, metricas_modelo in cliente_llm.resiliencia.estadisticas().items():
+        logger.info("Llamadas a %s: %s", nombre_modelo, metricas_modelo)
+    logger.info("Rendimiento: %s", cliente_llm.telemetria.resumen())
+    logger.info("Métricas en formato Prometheus: %s", cliente_llm.telemetria.escribir_prometheus(os.path.join(args.salida, "metricas.prom")))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import contextlib
+import itertools
+import logging
+import os
+import threading
+import time
+
+from resiliencia import _limites_desde_entorno
+
+# --- COLA DE TRABAJOS EN SEGUNDO PLANO ---
+# La generación se envía como trabajo a una cola única por proceso, atendida por un pool acotado de
+# hilos compartido por todas las sesiones. La sesión de Streamlit solo consulta el estado del
+# trabajo, así que los reruns por otros widgets no interrumpen la generación.
+#   - Reparto justo: cada usuario tiene su propia fila (FIFO) y los trabajadores toman el siguiente
+#     trabajo por turnos entre usuarios, de modo que una estación grande no bloquea a los demás.
+#   - Tope opcional de trabajos por modelo: un trabajo solo empieza si ninguno de sus modelos alcanzó
+#     su máximo de trabajos en curso (JOBS_MAX_PER_MODEL, o por modelo con JOBS_MODEL_LIMITS). El
+#     límite de llamadas simultáneas a cada modelo lo aplica la capa de resiliencia (ver resiliencia.py).
+#   - Cancelación cooperativa: un trabajo en cola se descarta; uno en curso recibe la señal
+#     trabajo.detener, que el motor consulta entre llamadas al modelo, y el hilo trabajador no queda
+#     libre hasta que sus ítems en curso se detienen.
+
+logger = logging.getLogger(__name__)
+
+ESTADOS_ACTIVOS = ("en_cola", "en_curso")
+MAX_TERMINADOS_POR_USUARIO = 20
+
+
+class Trabajo:
+    def __init__(self, id_trabajo, usuario, descripcion, funcion, modelos):
+        self.id = id_trabajo
+        self.usuario = usuario
+        self.descripcion = descripcion
+        self.funcion = funcion
+        self.modelos = tuple(sorted(set(modelos)))
+        self.estado = "en_cola"
+        self.etapa = ""
+        self.mensajes = []
+        self.borrador = None
+        self.progreso = {}
+        self.resultado = None
+        self.error = None
+        self.creado = time.time()
+        self.inicio = None
+        self.fin = None
+        # Señal de cancelación que el motor consulta entre llamadas al modelo (parámetro detener).
+        self.detener = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelacion_pedida(self):
+        return self.detener.is_set()
+
+    def actualizar(self, **campos):
+        # Llamado desde el hilo trabajador; la sesión lee con instantanea(). Solo registra el progreso:
+        # la cancelación la atiende el motor con trabajo.detener, sin cortar a los notificadores.
+        with self._lock:
+            for nombre, valor in campos.items():
+                setattr(self, nombre, valor)
+
+    def agregar_mensaje(self, nivel, texto):
+        with self._lock:
+            self.mensajes.append((nivel, texto))
+
+    def instantanea(self):
+        with self._lock:
+            return {
+                "id": self.id, "usuario": self.usuario, "descripcion": self.descripcion, "modelos": self.modelos,
+                "estado": self.estado, "etapa": self.etapa, "mensajes": list(self.mensajes), "borrador": self.borrador,
+                "progreso": dict(self.progreso), "resultado": self.resultado, "error": self.error,
+                "creado": self.creado, "inicio": self.inicio, "fin": self.fin,
+                "cancelacion_pedida": self.cancelacion_pedida,
+            }
+
+
+class NotificadorTrabajo:
+    # Notificador del motor para un trabajo en segundo plano: guarda la etapa, los mensajes y el
+    # borrador en el trabajo, que la interfaz muestra al consultar su estado.
+    def __init__(self, trabajo):
+        self.trabajo = trabajo
+
+    @contextlib.contextmanager
+    def etapa(self, texto):
+        logger.info("[%s] %s", self.trabajo.id, texto)
+        self.trabajo.actualizar(etapa=texto)
+        yield
+
+    def advertencia(self, texto):
+        logger.warning("[%s] %s", self.trabajo.id, texto)
+        self.trabajo.agregar_mensaje("advertencia", texto)
+
+    def error(self, texto):
+        logger.error("[%s] %s", self.trabajo.id, texto)
+        self.trabajo.agregar_mensaje("error", texto)
+
+    def borrador(self, texto_parcial):
+        self.trabajo.actualizar(borrador=texto_parcial)
+
+
+class ColaTrabajos:
+    def __init__(self, max_trabajadores=2, max_por_modelo=0, limites_por_modelo=None, telemetria=None,
+                 max_terminados_por_usuario=MAX_TERMINADOS_POR_USUARIO):
+        self.max_trabajadores = max(1, max_trabajadores)
+        self.max_por_modelo = max_por_modelo
+        self.limites_por_modelo = limites_por_modelo or {}
+        self.telemetria = telemetria
+        self.max_terminados_por_usuario = max_terminados_por_usuario
+        # usuario → fila de trabajos pendientes; el orden del diccionario es el turno de los usuarios.
+        self._pendientes = collections.OrderedDict()
+        self._trabajos = {}
+        self._en_curso_por_modelo = collections.Counter()
+        self._en_curso = 0
+        self._contador_ids = itertools.count(1)
+        self._condicion = threading.Condition()
+        self._hilos = []
+
+    @classmethod
+    def desde_entorno(cls, telemetria=None):
+        return cls(
+            max_trabajadores=int(os.environ.get("JOBS_MAX_WORKERS", 2)),
+            max_por_modelo=int(os.environ.get("JOBS_MAX_PER_MODEL", 0)),
+            limites_por_modelo={modelo: int(limite) for modelo, limite in
+                                _limites_desde_entorno(os.environ.get("JOBS_MODEL_LIMITS")).items()},
+            telemetria=telemetria
+        )
+
+    # --- Envío y consulta ---
+    def enviar(self, usuario, descripcion, funcion, modelos=()):
+        # funcion(trabajo) se ejecuta en un hilo trabajador y devuelve el resultado del trabajo.
+        with self._condicion:
+            trabajo = Trabajo(f"t{next(self._contador_ids)}", usuario, descripcion, funcion, modelos)
+            self._trabajos[trabajo.id] = trabajo
+            self._pendientes.setdefault(usuario, collections.deque()).append(trabajo)
+            self._iniciar_hilos()
+            self._condicion.notify()
+        if self.telemetria is not None:
+            self.telemetria.contar("trabajos_enviados_total")
+        return trabajo
+
+    def trabajo(self, id_trabajo):
+        with self._condicion:
+            return self._trabajos.get(id_trabajo)
+
+    def trabajos_de(self, usuario):
+        with self._condicion:
+            return [trabajo for trabajo in self._trabajos.values() if trabajo.usuario == usuario]
+
+    def posicion_en_cola(self, id_trabajo):
+        # Trabajos pendientes de todos los usuarios que se atenderían antes, según el turno actual.
+        with self._condicion:
+            filas = [list(fila) for fila in self._pendientes.values()]
+        orden = [trabajo.id for ronda in itertools.zip_longest(*filas) for trabajo in ronda if trabajo is not None]
+        return orden.index(id_trabajo) if id_trabajo in orden else None
+
+    def cancelar(self, id_trabajo):
+        with self._condicion:
+            trabajo = self._trabajos.get(id_trabajo)
+            if trabajo is None or trabajo.estado not in ESTADOS_ACTIVOS:
+                return False
+            trabajo.detener.set()
+            if trabajo.estado == "en_cola":
+                self._pendientes[trabajo.usuario].remove(trabajo)
+                if not self._pendientes[trabajo.usuario]:
+                    del self._pendientes[trabajo.usuario]
+                self._finalizar(trabajo, "cancelado")
+        return True
+
+    def estadisticas(self):
+        with self._condicion:
+            return {
+                "trabajadores": self.max_trabajadores,
+                "en_curso": self._en_curso,
+                "en_cola": sum(len(fila) for fila in self._pendientes.values()),
+                "usuarios_en_cola": len(self._pendientes),
+                "en_curso_por_modelo": dict(self._en_curso_por_modelo),
+            }
+
+    # --- Planificación ---
+    def _limite_modelo(self, modelo):
+        return self.limites_por_modelo.get(modelo, self.max_por_modelo)
+
+    def _hay_cupo(self, trabajo):
+        return all(not self._limite_modelo(modelo) or self._en_curso_por_modelo[modelo] < self._limite_modelo(modelo)
+                   for modelo in trabajo.modelos)
+
+    def _siguiente(self):
+        # Turno rotativo entre usuarios: se toma el primer trabajo del primer usuario (en orden de
+        # turno) cuyos modelos tengan cupo, y ese usuario pasa al final del turno.
+        for usuario, fila in self._pendientes.items():
+            if self._hay_cupo(fila[0]):
+                trabajo = fila.popleft()
+                if fila:
+                    self._pendientes.move_to_end(usuario)
+                else:
+                    del self._pendientes[usuario]
+                return trabajo
+        return None
+
+    def _iniciar_hilos(self):
+        # Los hilos se crean con el primer trabajo, no al importar el módulo.
+        while len(self._hilos) < self.max_trabajadores:
+            hilo = threading.Thread(target=self._trabajador, name=f"trabajos-{len(self._hilos) + 1}", daemon=True)
+            self._hilos.append(hilo)
+            hilo.start()
+
+    def _trabajador(self):
+        while True:
+            with self._condicion:
+                trabajo = self._siguiente()
+                while trabajo is None:
+                    self._condicion.wait()
+                    trabajo = self._siguiente()
+                self._en_curso += 1
+                self._en_curso_por_modelo.update(trabajo.modelos)
+                trabajo.estado, trabajo.inicio = "en_curso", time.time()
+            if self.telemetria is not None:
+                self.telemetria.observar("trabajo_espera_segundos", trabajo.inicio - trabajo.creado)
+            estado = "terminado"
+            try:
+                resultado = trabajo.funcion(trabajo)
+                with trabajo._lock:
+                    trabajo.resultado = resultado
+                # Un trabajo cancelado termina normalmente, con los ítems que alcanzó a completar.
+                if trabajo.cancelacion_pedida:
+                    estado = "cancelado"
+            except Exception as e:
+                logger.exception("Error en el trabajo %s (%s)", trabajo.id, trabajo.descripcion)
+                estado = "error"
+                with trabajo._lock:
+                    trabajo.error = str(e)
+            with self._condicion:
+                self._en_curso -= 1
+                self._en_curso_por_modelo -= collections.Counter(trabajo.modelos)
+                self._finalizar(trabajo, estado)
+                # Al liberarse cupo de un modelo puede quedar habilitado más de un trabajo.
+                self._condicion.notify_all()
+
+    def _finalizar(self, trabajo, estado):
+        # Se llama con la condición tomada.
+        with trabajo._lock:
+            trabajo.estado, trabajo.fin = estado, time.time()
+        if self.telemetria is not None:
+            self.telemetria.contar("trabajos_total", estado=estado)
+            if trabajo.inicio is not None:
+                self.telemetria.observar("trabajo_segundos", trabajo.fin - trabajo.inicio)
+        # Solo se conservan los últimos trabajos terminados de cada usuario.
+        terminados = [t for t in self._trabajos.values() if t.usuario == trabajo.usuario and t.estado not in ESTADOS_ACTIVOS]
+        for antiguo in terminados[:-self.max_terminados_por_usuario]:
+            del self._trabajos[antiguo.id]
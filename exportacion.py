@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import io
+import json
+
+# --- EXPORTACIÓN DE ÍTEMS PROCESADOS ---
+# Los escritores agregan los ítems uno a uno, de modo que un banco grande se puede escribir a
+# medida que se generan (la CLI lo hace por estación) sin armar todo en memoria de una vez.
+
+COLUMNAS_XLSX = ["Grado", "Área", "Asignatura", "Estación", "Proceso Cognitivo", "Nanohabilidad", "Microhabilidad",
+                 "Competencia Nanohabilidad", "Ítem", "Gráfico necesario", "Descripción del gráfico", "Dictamen final",
+                 "Observaciones finales"]
+
+
+def hash_items(preguntas_procesadas_list):
+    # Identifica una lista de ítems por su contenido, para memoizar los archivos exportados.
+    contenido = json.dumps(preguntas_procesadas_list, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+
+class EscritorWord:
+    def __init__(self):
+        # python-docx se importa al exportar, no al iniciar la aplicación.
+        import docx
+        self.doc = docx.Document()
+        self.doc.add_heading('Preguntas Generadas y Auditadas', level=1)
+        self.doc.add_paragraph('Este documento contiene los ítems generados por el sistema de IA y sus resultados de auditoría.\n')
+        self.items_escritos = 0
+
+    def agregar(self, item_data):
+        doc = self.doc
+        self.items_escritos += 1
+        doc.add_heading(f'Ítem #{self.items_escritos}', level=2)
+        doc.add_paragraph('--- Clasificación del Ítem ---')
+        for key, value in item_data["classification"].items():
+            p = doc.add_paragraph()
+            p.add_run(f"{key}: ").bold = True
+            p.add_run(str(value))
+
+        doc.add_paragraph('\n' + item_data["item_text"])
+
+        if item_data.get("grafico_necesario") == "SÍ" and item_data.get("descripcion_grafico"):
+            doc.add_paragraph()
+            p = doc.add_paragraph()
+            p.add_run("--- Gráfico Sugerido ---").bold = True
+            doc.add_paragraph(f"**Tipo y Descripción del Gráfico:** {item_data['descripcion_grafico']}\n")
+
+        doc.add_paragraph()
+        p = doc.add_paragraph()
+        p.add_run("--- Resultado Final de Auditoría ---").bold = True
+        doc.add_paragraph(f"**DICTAMEN FINAL:** {item_data.get('final_audit_status', 'N/A')}")
+        doc.add_paragraph(f"**OBSERVACIONES FINALES:** {item_data.get('final_audit_observations', 'N/A')}\n")
+
+        doc.add_page_break()
+
+    def guardar(self, destino):
+        if not self.items_escritos:
+            self.doc.add_paragraph('No se procesaron ítems para este informe.')
+        self.doc.save(destino)
+
+
+class EscritorXLSX:
+    # Libro en modo write_only de openpyxl: las filas se escriben por streaming, sin guardar celdas en memoria.
+    def __init__(self, destino):
+        import openpyxl
+        from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+        self._limpiar = lambda valor: ILLEGAL_CHARACTERS_RE.sub("", valor) if isinstance(valor, str) else valor
+        self.destino = destino
+        self.libro = openpyxl.Workbook(write_only=True)
+        self.hoja = self.libro.create_sheet("Ítems")
+        self.hoja.append(COLUMNAS_XLSX)
+
+    def agregar(self, item_data):
+        clasificacion = item_data["classification"]
+        fila = [str(valor) for valor in clasificacion.values()] + [
+            item_data["item_text"], item_data.get("grafico_necesario", "NO"), item_data.get("descripcion_grafico", ""),
+            item_data.get("final_audit_status", "N/A"), item_data.get("final_audit_observations", "N/A")
+        ]
+        self.hoja.append([self._limpiar(valor) for valor in fila])
+
+    def cerrar(self):
+        self.libro.save(self.destino)
+
+
+def exportar_a_word(preguntas_procesadas_list):
+    escritor = EscritorWord()
+    for item_data in preguntas_procesadas_list:
+        escritor.agregar(item_data)
+    buffer = io.BytesIO()
+    escritor.guardar(buffer)
+    buffer.seek(0)
+    return buffer
+
+
+def exportar_a_excel(preguntas_procesadas_list):
+    buffer = io.BytesIO()
+    escritor = EscritorXLSX(buffer)
+    for item_data in preguntas_procesadas_list:
+        escritor.agregar(item_data)
+    escritor.cerrar()
+    buffer.seek(0)
+    return buffer
+
+
+def item_a_linea_jsonl(item_data):
+    return json.dumps(item_data, ensure_ascii=False, default=str) + "\n"
+
+
+def exportar_a_jsonl(preguntas_procesadas_list):
+    return "".join(item_a_linea_jsonl(item_data) for item_data in preguntas_procesadas_list)
+
+
+def exportar_prompts_txt(preguntas_procesadas_list):
+    partes = []
+    for i, item_data in enumerate(preguntas_procesadas_list):
+        partes.append(f"--- ÍTEM #{i+1} ({item_data['classification']['Proceso Cognitivo']}) ---\n")
+        partes.append(f"--- PROMPT GENERADOR ---\n{item_data.get('generation_prompt_used', 'N/A')}\n\n")
+        partes.append(f"--- PROMPT AUDITOR ---\n{item_data.get('auditor_prompt_used', 'N/A')}\n\n{'='*80}\n\n")
+    return "".join(partes)
+
+
+# Formato → (prefijo del archivo, extensión, tipo MIME, función que devuelve bytes)
+FORMATOS_EXPORTACION = {
+    "Word (DOCX)": ("items", "docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                    lambda items: exportar_a_word(items).getvalue()),
+    "Excel (XLSX)": ("items", "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                     lambda items: exportar_a_excel(items).getvalue()),
+    "JSONL": ("items", "jsonl", "application/jsonl", lambda items: exportar_a_jsonl(items).encode('utf-8')),
+    "Prompts (TXT)": ("prompts", "txt", "text/plain", lambda items: exportar_prompts_txt(items).encode('utf-8')),
+}
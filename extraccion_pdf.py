@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+import concurrent.futures
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+
+# --- EXTRACCIÓN DE TEXTO DEL MANUAL EN PDF ---
+# Las páginas se extraen en paralelo con un pool de procesos (PyPDF2 es CPU puro) por rangos de
+# páginas, y el texto se une una sola vez al final. El resultado se guarda en disco por el hash
+# del contenido del archivo, de modo que el mismo manual se procesa una sola vez aunque el
+# contenedor se reinicie (o entre instancias, si PDF_CACHE_DIR apunta a un volumen compartido).
+
+logger = logging.getLogger(__name__)
+
+DIRECTORIO_CACHE_PDF_POR_DEFECTO = os.path.join(".cache", "pdf")
+MIN_PAGINAS_EN_PARALELO = 64
+
+
+def _extraer_rango(datos_pdf, inicio, fin, reader=None):
+    import PyPDF2
+    reader = reader or PyPDF2.PdfReader(io.BytesIO(datos_pdf))
+    paginas = []
+    for numero_pagina in range(inicio, fin):
+        t0 = time.perf_counter()
+        texto = reader.pages[numero_pagina].extract_text() or ""
+        paginas.append((numero_pagina, texto, time.perf_counter() - t0))
+    return paginas
+
+
+def _leer_cache(ruta):
+    try:
+        with open(ruta, encoding="utf-8") as archivo:
+            return json.load(archivo)
+    except (OSError, ValueError):
+        return None
+
+
+def _escribir_cache(ruta, resultado):
+    # Escritura atómica: otra sesión nunca ve un archivo a medio escribir.
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    # Un temporal único por escritura: dos hilos del mismo proceso pueden guardar el mismo PDF a la vez.
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=os.path.dirname(ruta), suffix=".tmp", delete=False) as archivo:
+        json.dump(resultado, archivo, ensure_ascii=False)
+    os.replace(archivo.name, ruta)
+
+
+def extraer_manual_pdf(datos_pdf, directorio_cache=None, max_procesos=None):
+    # Devuelve {"texto", "paginas", "segundos_por_pagina", "segundos_totales", "desde_cache", "hash"}.
+    directorio_cache = directorio_cache or os.environ.get("PDF_CACHE_DIR", DIRECTORIO_CACHE_PDF_POR_DEFECTO)
+    hash_contenido = hashlib.sha256(datos_pdf).hexdigest()
+    ruta_cache = os.path.join(directorio_cache, f"{hash_contenido}.json")
+
+    t0 = time.perf_counter()
+    guardado = _leer_cache(ruta_cache)
+    if guardado is not None:
+        return {**guardado, "texto": "\n".join(guardado["paginas"]), "desde_cache": True,
+                "segundos_totales": time.perf_counter() - t0}
+
+    import PyPDF2
+    reader = PyPDF2.PdfReader(io.BytesIO(datos_pdf))
+    total_paginas = len(reader.pages)
+    max_procesos = max_procesos or min(os.cpu_count() or 1, 8)
+    if total_paginas < MIN_PAGINAS_EN_PARALELO or max_procesos == 1:
+        extraidas = _extraer_rango(datos_pdf, 0, total_paginas, reader)
+    else:
+        # Un rango de páginas por tarea, para enviar los bytes del PDF pocas veces a los procesos.
+        tamano_rango = -(-total_paginas // (max_procesos * 2))
+        rangos = [(inicio, min(inicio + tamano_rango, total_paginas)) for inicio in range(0, total_paginas, tamano_rango)]
+        # "spawn" evita heredar por fork el estado de los hilos del servidor de Streamlit.
+        contexto = multiprocessing.get_context("spawn")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_procesos, mp_context=contexto) as executor:
+            futuros = [executor.submit(_extraer_rango, datos_pdf, inicio, fin) for inicio, fin in rangos]
+            extraidas = [pagina for futuro in futuros for pagina in futuro.result()]
+
+    extraidas.sort(key=lambda pagina: pagina[0])
+    resultado = {
+        "hash": hash_contenido,
+        "paginas": [texto for _, texto, _ in extraidas],
+        "segundos_por_pagina": [segundos for _, _, segundos in extraidas],
+    }
+    _escribir_cache(ruta_cache, resultado)
+    segundos_totales = time.perf_counter() - t0
+    logger.info("PDF %s: %s páginas extraídas en %.2f s.", hash_contenido[:12], total_paginas, segundos_totales)
+    return {**resultado, "texto": "\n".join(resultado["paginas"]), "desde_cache": False, "segundos_totales": segundos_totales}
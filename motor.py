@@ -0,0 +1,1074 @@
+# -*- coding: utf-8 -*-
+
+import concurrent.futures
+import contextlib
+import logging
+import re
+import threading
+import time
+
+from backends_llm import estimar_tokens, tomar_uso_tokens
+from bitacora import clave_item
+from cache_llm import clave_cache
+from extraccion_pdf import extraer_manual_pdf
+from salida_estructurada import (ESQUEMA_AUDITORIA, ESQUEMA_AUDITORIA_LOTE, ESQUEMA_ITEM, INSTRUCCION_SALIDA_JSON,
+                                 ErrorSalidaEstructurada, auditoria_json_a_texto, auditorias_lote_json_a_textos,
+                                 configuracion_json, item_json_a_texto)
+from telemetria import Telemetria
+from validador import validar_estructura_item, observaciones_validacion
+
+# --- MOTOR DE GENERACIÓN Y AUDITORÍA (SIN INTERFAZ) ---
+# Contiene el ciclo generar→auditar→refinar sin dependencias de Streamlit, para que lo usen
+# tanto app.py como la línea de comandos (cli.py). La interfaz se comunica con el motor a través
+# de un "notificador" (etapas, advertencias y errores).
+
+logger = logging.getLogger(__name__)
+
+MAX_LONGITUD_MANUAL = 15000
+MAX_INTENTOS_REFINAMIENTO = 5
+DICTAMEN_APROBADO = "✅ CUMPLE TOTALMENTE"
+DICTAMEN_RECHAZO_ESTRUCTURAL = "❌ RECHAZADO (validación estructural)"
+DICTAMEN_NO_EXTRAIDO = "❌ RECHAZADO (no se pudo extraer dictamen)"
+DICTAMEN_DUPLICADO = "❌ RECHAZADO (duplicado en el banco de ítems)"
+COLUMNAS_FILA_ESTACION = ['PROCESO COGNITIVO', 'NANOHABILIDAD', 'MICROHABILIDAD', 'COMPETENCIA NANOHABILIDAD']
+COLUMNAS_ESTACION = ['GRADO', 'ÁREA', 'ASIGNATURA', 'ESTACIÓN']
+
+CRITERIOS_POR_DEFECTO = {
+    "tipo_pregunta": "opción múltiple con 4 opciones", "dificultad": "media",
+    "contexto_educativo": "estudiantes de preparatoria (bachillerato)",
+    "formato_justificacion": """
+        • Justificación correcta: debe explicar el razonamiento (NO por descarte).
+        • Justificaciones incorrectas: deben redactarse como: “El estudiante podría escoger la opción X porque… Sin embargo, esto es incorrecto porque…”
+    """
+}
+
+
+# --- NOTIFICADORES ---
+class NotificadorRegistro:
+    # Notificador por defecto: envía etapas, advertencias y errores al logging estándar.
+    def etapa(self, texto):
+        logger.info(texto)
+        return contextlib.nullcontext()
+
+    def advertencia(self, texto):
+        logger.warning(texto)
+
+    def error(self, texto):
+        logger.error(texto)
+
+    # Sin interfaz no hay borrador que mostrar, así que la generación no necesita streaming.
+    borrador = None
+
+
+NOTIFICADOR_POR_DEFECTO = NotificadorRegistro()
+
+
+# --- CLIENTE LLM (backend + caché de respuestas) ---
+class ClienteLLM:
+    def __init__(self, backend, cache=None, ignorar_cache=False, resiliencia=None, telemetria=None):
+        self.backend = backend
+        self.cache = cache
+        self.ignorar_cache = ignorar_cache
+        # Reintentos, límite de solicitudes, cobertura e interruptor de circuito (ver resiliencia.py).
+        self.resiliencia = resiliencia
+        # Spans y contadores por llamada y por intento (ver telemetria.py); en memoria si no se indica otra.
+        self.telemetria = telemetria if telemetria is not None else Telemetria()
+
+    def generar_texto(self, model_name, prompt, prefijo_cacheable="", notificador=None,
+                      al_recibir_fragmento=None, detener_cuando=None, operacion="llamada", generation_config=None):
+        # prefijo_cacheable es la parte estable del prompt (manual, reglas, formato de salida); el
+        # backend puede servirla desde la caché de contexto de Vertex AI y enviar solo `prompt`.
+        # Con al_recibir_fragmento o detener_cuando la respuesta se pide por streaming: el primero
+        # recibe el texto acumulado con cada fragmento y el segundo, si devuelve True, corta el flujo.
+        # operacion ("generacion", "auditoria", ...) solo etiqueta la telemetría de la llamada;
+        # generation_config (p. ej. el esquema de la salida JSON) se pasa tal cual al backend.
+        notificador = notificador or NOTIFICADOR_POR_DEFECTO
+        clave = clave_cache(f"{self.backend.nombre}/{model_name}", prefijo_cacheable + prompt, generation_config,
+                            corte=getattr(detener_cuando, "__name__", None))
+        if self.cache is not None and not self.ignorar_cache:
+            respuesta_guardada = self.cache.obtener(clave)
+            self.telemetria.contar("llm_cache_total", resultado="acierto" if respuesta_guardada is not None else "fallo",
+                                   modelo=model_name, operacion=operacion)
+            if respuesta_guardada is not None:
+                if al_recibir_fragmento is not None:
+                    al_recibir_fragmento(respuesta_guardada)
+                return respuesta_guardada
+        if al_recibir_fragmento is None and detener_cuando is None:
+            def invocar():
+                return self.backend.generar_con_prefijo(model_name, prefijo_cacheable, prompt, generation_config)
+        else:
+            def invocar():
+                return self._generar_en_flujo(model_name, prompt, prefijo_cacheable, al_recibir_fragmento, detener_cuando,
+                                              generation_config)
+
+        uso_informado = {}
+
+        def llamar():
+            # El backend informa el uso de tokens en el hilo que hizo la llamada (puede ser el de una cobertura).
+            tomar_uso_tokens()
+            respuesta = invocar()
+            uso_informado.update(tomar_uso_tokens() or {})
+            return respuesta
+
+        with self.telemetria.span("llm_llamada", modelo=model_name, operacion=operacion) as span:
+            try:
+                if self.resiliencia is not None:
+                    # Con al_recibir_fragmento la llamada actualiza la interfaz: no puede duplicarse en otro hilo.
+                    respuesta = self.resiliencia.ejecutar(model_name, llamar, permitir_cobertura=al_recibir_fragmento is None)
+                else:
+                    respuesta = llamar()
+                # ignorar_cache solo fuerza la llamada: la respuesta nueva no reemplaza a la guardada.
+                if self.cache is not None and not self.ignorar_cache:
+                    self.cache.guardar(clave, model_name, respuesta)
+            except Exception as e:
+                span.update(estado="error", error=str(e))
+                self.telemetria.contar("llm_errores_total", modelo=model_name, operacion=operacion, tipo=type(e).__name__)
+                notificador.error(f"Error al llamar al modelo '{model_name}' (backend {self.backend.nombre}): {e}")
+                return None
+            # Sin usage_metadata (backend falso o flujo cortado antes del último fragmento) se estima.
+            uso = uso_informado or {"tokens_entrada": estimar_tokens(prefijo_cacheable + prompt),
+                                    "tokens_salida": estimar_tokens(respuesta), "tokens_cache": 0}
+            span.update(uso, tokens_estimados=not uso_informado, caracteres_respuesta=len(respuesta))
+            for tipo in ("entrada", "salida", "cache"):
+                if uso[f"tokens_{tipo}"]:
+                    self.telemetria.contar("llm_tokens_total", uso[f"tokens_{tipo}"], modelo=model_name, operacion=operacion, tipo=tipo)
+        return respuesta
+
+    def _generar_en_flujo(self, model_name, prompt, prefijo_cacheable, al_recibir_fragmento, detener_cuando, generation_config=None):
+        fragmentos = []
+        flujo = self.backend.generar_en_flujo(model_name, prefijo_cacheable, prompt, generation_config)
+        try:
+            for fragmento in flujo:
+                fragmentos.append(fragmento)
+                texto_parcial = "".join(fragmentos)
+                if al_recibir_fragmento is not None:
+                    al_recibir_fragmento(texto_parcial)
+                if detener_cuando is not None and detener_cuando(texto_parcial):
+                    break
+        finally:
+            # Cerrar el generador cierra el stream del backend: el cliente deja de esperar más tokens
+            # (el servidor no necesariamente cancela la generación ni su cobro).
+            flujo.close()
+        return "".join(fragmentos)
+
+
+# --- MANUAL DE REGLAS ---
+def extraer_texto_pdf(datos_pdf):
+    return extraer_manual_pdf(datos_pdf)["texto"]
+
+
+def recortar_manual(manual_reglas_texto, max_longitud=MAX_LONGITUD_MANUAL):
+    # Devuelve (texto, fue_recortado).
+    if len(manual_reglas_texto) > max_longitud:
+        return manual_reglas_texto[:max_longitud], True
+    return manual_reglas_texto, False
+
+
+# --- PROMPTS ---
+def get_descripcion_bloom(proceso_cognitivo_elegido):
+    descripcion_bloom_map = {
+        "RECORDAR": "Recuperar información relevante desde la memoria de largo plazo.",
+        "COMPRENDER": "Construir significado a partir de información mediante interpretación, resumen, explicación u otras tareas.",
+        "APLICAR": "Usar procedimientos en situaciones conocidas o nuevas.",
+        "ANALIZAR": "Descomponer información y examinar relaciones entre partes.",
+        "EVALUAR": "Emitir juicios basados en criterios para valorar ideas o soluciones.",
+        "CREAR": "Generar nuevas ideas, productos o formas de reorganizar información."
+    }
+    return descripcion_bloom_map.get(str(proceso_cognitivo_elegido).upper(), "Descripción no disponible.")
+
+
+def construir_prefijo_auditoria(manual_reglas_texto="", prompt_auditor_adicional="", salida_json=False):
+    # Parte estable del prompt de auditoría: idéntica para todos los ítems de una ejecución.
+    prefijo = f"""
+        Eres un experto en validación de ítems educativos, especializado en pruebas tipo ICFES y las directrices del equipo IMPROVE.
+        Tu tarea es AUDITAR RIGUROSAMENTE el ítem generado por un modelo de lenguaje que se presenta al final.
+        Debes verificar que el ítem cumpla con TODOS los siguientes criterios.
+
+        --- CRITERIOS DE AUDITORÍA ---
+        1.  **Formato del Enunciado:** ¿El enunciado está formulado como pregunta clara y directa?
+        2.  **Número de Opciones:** ¿Hay exactamente 4 opciones (A, B, C, D)?
+        3.  **Respuesta Correcta Indicada:** ¿La sección 'RESPUESTA CORRECTA:' está claramente indicada?
+        4.  **Diseño de Justificaciones:** ¿Las justificaciones siguen el formato requerido (explicación para la correcta, análisis de error para las incorrectas)?
+        5.  **Estilo y Restricciones:** ¿No se usan negaciones mal redactadas, nombres reales, marcas, etc.?
+        6.  **Alineación del Contenido:** ¿El ítem está alineado EXCLUSIVAMENTE con los PARÁMETROS DEL ÍTEM indicados al final?
+        7.  **Gráfico (si aplica):** Si el ítem indica que requiere un gráfico, ¿la descripción es clara?
+
+        --- MANUAL DE REGLAS ADICIONAL ---
+        {manual_reglas_texto}
+        -----------------------------------
+
+        --- INSTRUCCIONES ADICIONALES PARA LA AUDITORÍA ---
+        {prompt_auditor_adicional if prompt_auditor_adicional else "No se proporcionaron instrucciones adicionales."}
+        ---------------------------------------------------
+
+        Devuelve tu auditoría con este formato estructurado:
+
+        VALIDACIÓN DE CRITERIOS:
+        - Formato del Enunciado: [✅ / ❌] + Comentario (si ❌)
+        - Número de Opciones (4): [✅ / ❌]
+        - Respuesta Correcta Indicada: [✅ / ❌]
+        - Diseño de Justificaciones: [✅ / ⚠️ / ❌] + Observaciones (si ⚠️/❌)
+        - Estilo y Restricciones: [✅ / ⚠️ / ❌] + Observaciones (si ⚠️/❌)
+        - Alineación del Contenido: [✅ / ❌] + Comentario (si ❌)
+        - Gráfico (si aplica): [✅ / ⚠️ / ❌] + Observaciones (si ⚠️/❌)
+
+        DICTAMEN FINAL:
+        [✅ CUMPLE TOTALMENTE / ⚠️ CUMPLE PARCIALMENTE / ❌ RECHAZADO]
+
+        OBSERVACIONES FINALES:
+        [Explica de forma concisa qué aspectos necesitan mejora, si el dictamen no es ✅.]
+        """
+    return prefijo + INSTRUCCION_SALIDA_JSON if salida_json else prefijo
+
+
+def construir_sufijo_auditoria(item_generado, grado, area, asignatura, estacion,
+                               proceso_cognitivo, nanohabilidad, microhabilidad,
+                               competencia_nanohabilidad, contexto_educativo, descripcion_bloom="",
+                               grafico_necesario="", descripcion_grafico="", manual_reglas_item=""):
+    seccion_manual = f"""
+        --- MANUAL DE REGLAS PARA ESTE ÍTEM ---
+        {manual_reglas_item}
+        ---------------------------------------
+""" if manual_reglas_item else ""
+    return f"""
+        --- PARÁMETROS DEL ÍTEM (criterios 6 y 7) ---
+            * Grado: {grado}
+            * Área: {area}
+            * Asignatura: {asignatura}
+            * Estación o unidad temática: {estacion}
+            * Proceso Cognitivo (Taxonomía de Bloom): {proceso_cognitivo} (descripción: "{descripcion_bloom}")
+            * Nanohabilidad: {nanohabilidad}
+            * Microhabilidad: {microhabilidad}
+            * Competencia: {competencia_nanohabilidad}
+            * Nivel educativo: {contexto_educativo}
+            * Gráfico Necesario: {grafico_necesario}
+            * Descripción del Gráfico: {descripcion_grafico if grafico_necesario == 'SÍ' else 'N/A'}
+{seccion_manual}
+        ÍTEM A AUDITAR:
+        --------------------
+        {item_generado}
+        --------------------
+        """
+
+
+def auditar_item_con_llm(cliente_llm, model_name, item_generado, grado, area, asignatura, estacion,
+                         proceso_cognitivo, nanohabilidad, microhabilidad,
+                         competencia_nanohabilidad, contexto_educativo, manual_reglas_texto="", descripcion_bloom="", grafico_necesario="", descripcion_grafico="", prompt_auditor_adicional="",
+                         notificador=None, detener_en_dictamen=True, auditor_lotes=None, salida_json=False,
+                         cascada=None, ultimo_intento=False, manual_en_sufijo=False):
+    # Con manual_en_sufijo el manual (seleccionado por ítem) va en la parte variable del prompt: así el
+    # prefijo es el mismo para todos los ítems y el auditor por lotes puede agruparlos.
+    prefijo_auditoria = construir_prefijo_auditoria(
+        "Se indica junto a los parámetros de cada ítem." if manual_en_sufijo else manual_reglas_texto,
+        prompt_auditor_adicional, salida_json
+    )
+    sufijo_auditoria = construir_sufijo_auditoria(
+        item_generado, grado, area, asignatura, estacion, proceso_cognitivo, nanohabilidad, microhabilidad,
+        competencia_nanohabilidad, contexto_educativo, descripcion_bloom, grafico_necesario, descripcion_grafico,
+        manual_reglas_texto if manual_en_sufijo else ""
+    )
+    auditoria_prompt = prefijo_auditoria + sufijo_auditoria
+
+    def auditar_con_modelo(modelo, con_lotes=True):
+        if auditor_lotes is not None and con_lotes:
+            return auditor_lotes.auditar(prefijo_auditoria, sufijo_auditoria, notificador)
+        if salida_json:
+            # Un JSON cortado a medias no se puede validar: con salida JSON la auditoría se lee completa.
+            auditoria_resultado = cliente_llm.generar_texto(
+                modelo, sufijo_auditoria, prefijo_cacheable=prefijo_auditoria, notificador=notificador,
+                operacion="auditoria", generation_config=configuracion_json(ESQUEMA_AUDITORIA)
+            )
+            return convertir_salida_json(auditoria_json_a_texto, auditoria_resultado, "auditoría")
+        # Si el dictamen ya es aprobatorio no hacen falta observaciones para refinar: se corta el flujo
+        # en cuanto se lee la línea del DICTAMEN FINAL.
+        return cliente_llm.generar_texto(
+            modelo, sufijo_auditoria, prefijo_cacheable=prefijo_auditoria, notificador=notificador,
+            detener_cuando=dictamen_aprobado_en if detener_en_dictamen else None, operacion="auditoria"
+        )
+
+    if cascada is not None:
+        return cascada.auditar(cliente_llm.telemetria, model_name, auditar_con_modelo, ultimo_intento,
+                               notificador or NOTIFICADOR_POR_DEFECTO), auditoria_prompt
+    return auditar_con_modelo(model_name), auditoria_prompt
+
+
+# --- AUDITORÍA EN CASCADA ---
+# El modelo de auditoría elegido (rápido y barato) audita primero; solo los dictámenes dudosos se
+# escalan, uno a uno, a los modelos de escalamiento (de menor a mayor costo), cuyo dictamen
+# reemplaza al anterior. Cada nivel registra latencia, tokens y tasa de escalamiento en la
+# telemetría, para ajustar los motivos de escalamiento con datos.
+MOTIVOS_ESCALAMIENTO = {
+    "parcial": "dictamen ⚠️ CUMPLE PARCIALMENTE",
+    "sin_dictamen": "no se pudo extraer el dictamen",
+    "aprobado_con_objeciones": "aprobado con criterios marcados ⚠️ o ❌",
+    "aprobado_ultimo_intento": "aprobado en el último intento de refinamiento",
+}
+
+
+def motivo_escalamiento(auditoria_resultado, ultimo_intento, motivos=tuple(MOTIVOS_ESCALAMIENTO)):
+    # Devuelve el primer motivo (de los habilitados) por el que la auditoría debe escalarse, o None.
+    dictamen, _ = parsear_auditoria(auditoria_resultado)
+    inicio_dictamen = auditoria_resultado.find("DICTAMEN FINAL:")
+    criterios = auditoria_resultado[:inicio_dictamen] if inicio_dictamen != -1 else ""
+    condiciones = {
+        "parcial": dictamen.startswith("⚠"),
+        "sin_dictamen": dictamen == DICTAMEN_NO_EXTRAIDO,
+        "aprobado_con_objeciones": dictamen == DICTAMEN_APROBADO and ("⚠" in criterios or "❌" in criterios),
+        "aprobado_ultimo_intento": dictamen == DICTAMEN_APROBADO and ultimo_intento,
+    }
+    return next((motivo for motivo in motivos if condiciones[motivo]), None)
+
+
+class CascadaAuditoria:
+    def __init__(self, modelos_escalamiento, motivos=tuple(MOTIVOS_ESCALAMIENTO)):
+        desconocidos = set(motivos) - set(MOTIVOS_ESCALAMIENTO)
+        if desconocidos:
+            raise ValueError(f"Motivos de escalamiento desconocidos: {', '.join(sorted(desconocidos))}.")
+        self.modelos_escalamiento = tuple(modelos_escalamiento)
+        self.motivos = tuple(motivos)
+
+    def auditar(self, telemetria, model_name, auditar_con_modelo, ultimo_intento, notificador):
+        # auditar_con_modelo(modelo, con_lotes) hace una auditoría; solo el primer nivel usa el
+        # auditor por lotes, los escalamientos se envían de a uno.
+        modelos = (model_name, *self.modelos_escalamiento)
+        auditoria_resultado = None
+        for nivel, modelo in enumerate(modelos):
+            with telemetria.span("auditoria_nivel", nivel=nivel, modelo=modelo) as span:
+                resultado_nivel = auditar_con_modelo(modelo, con_lotes=nivel == 0)
+                if resultado_nivel is None:
+                    span["estado"] = "error"
+            if resultado_nivel is None:
+                if auditoria_resultado is not None:
+                    notificador.advertencia(f"El modelo de escalamiento '{modelo}' no respondió; se conserva el dictamen de '{modelos[nivel - 1]}'.")
+                break
+            auditoria_resultado = resultado_nivel
+            motivo = motivo_escalamiento(auditoria_resultado, ultimo_intento, self.motivos) if nivel + 1 < len(modelos) else None
+            if motivo is None:
+                break
+            telemetria.contar("auditoria_escalamientos_total", nivel=nivel, motivo=motivo)
+            logger.info("Auditoría escalada de '%s' a '%s': %s.", modelo, modelos[nivel + 1], MOTIVOS_ESCALAMIENTO[motivo])
+        return auditoria_resultado
+
+
+def convertir_salida_json(conversion, respuesta, descripcion):
+    # Convierte una respuesta JSON al formato de texto habitual. Si no cumple el esquema se devuelve
+    # tal cual: el parseo de texto la tratará como un formato no reconocido, igual que en el modo normal.
+    if respuesta is None:
+        return None
+    try:
+        return conversion(respuesta)
+    except ErrorSalidaEstructurada as e:
+        logger.warning("Respuesta JSON de %s inválida: %s", descripcion, e)
+        return respuesta
+
+
+# --- AUDITORÍA POR LOTES (MODO ESTACIÓN) ---
+# Varias auditorías con el mismo prefijo (criterios, manual e instrucciones del auditor) se envían
+# en una sola solicitud, con un veredicto delimitado por ítem. Si la respuesta de un ítem no se
+# puede separar o no trae DICTAMEN FINAL, ese ítem se audita de nuevo de forma individual.
+MARCADOR_AUDITORIA_LOTE = "--- AUDITORÍA POR LOTES ---"
+
+
+def construir_sufijo_auditoria_lote(sufijos_auditoria, salida_json=False):
+    bloques = "\n".join(
+        f"=== ÍTEM {numero} ===\n{sufijo}\n=== FIN ÍTEM {numero} ===" for numero, sufijo in enumerate(sufijos_auditoria, start=1)
+    )
+    if salida_json:
+        return f"""
+        {MARCADOR_AUDITORIA_LOTE}
+        A continuación hay {len(sufijos_auditoria)} ítems independientes, cada uno con sus propios PARÁMETROS DEL ÍTEM.
+        Audita cada ítem por separado con todos los criterios anteriores y devuelve en "auditorias" un elemento
+        por ítem, con su "numero" y su auditoría completa.
+
+        {bloques}
+        """
+    return f"""
+        {MARCADOR_AUDITORIA_LOTE}
+        A continuación hay {len(sufijos_auditoria)} ítems independientes, cada uno con sus propios PARÁMETROS DEL ÍTEM.
+        Audita cada ítem por separado con todos los criterios anteriores y devuelve, en el mismo orden y para
+        cada ítem, su auditoría completa con el formato estructurado indicado (incluidos DICTAMEN FINAL y
+        OBSERVACIONES FINALES) entre estas dos líneas:
+
+        === AUDITORÍA ÍTEM [número] ===
+        === FIN AUDITORÍA ÍTEM [número] ===
+
+        {bloques}
+        """
+
+
+def separar_auditorias_lote(respuesta_lote, cantidad):
+    # Devuelve una lista con la auditoría de cada ítem, o None donde no se pudo separar.
+    auditorias = []
+    for numero in range(1, cantidad + 1):
+        coincidencia = re.search(
+            rf"=== AUDITORÍA ÍTEM {numero} ===(.*?)(?:=== FIN AUDITORÍA ÍTEM {numero} ===|(?==== AUDITORÍA ÍTEM )|\Z)",
+            respuesta_lote, re.DOTALL
+        )
+        bloque = coincidencia.group(1).strip() if coincidencia else ""
+        auditorias.append(bloque if _PATRON_DICTAMEN.search(bloque) else None)
+    return auditorias
+
+
+class AuditorPorLotes:
+    # Reúne las auditorías que piden los hilos de una estación. El primer hilo que llega con un
+    # prefijo dado espera hasta espera_max_segundos a que se completen max_items y envía el lote;
+    # los demás esperan su veredicto. Un lote de un solo ítem se audita como siempre.
+    def __init__(self, cliente_llm, model_name, max_items=4, espera_max_segundos=1.5, salida_json=False):
+        self.cliente_llm = cliente_llm
+        self.model_name = model_name
+        self.salida_json = salida_json
+        self.max_items = max_items
+        self.espera_max_segundos = espera_max_segundos
+        self.lotes_enviados = 0
+        self.items_en_lotes = 0
+        self.auditorias_individuales = 0
+        self._pendientes = {}
+        self._lock = threading.Lock()
+
+    def auditar(self, prefijo_auditoria, sufijo_auditoria, notificador=None):
+        with self._lock:
+            lote = self._pendientes.get(prefijo_auditoria)
+            lider = lote is None
+            if lider:
+                lote = {"sufijos": [], "auditorias": None, "lleno": threading.Event(), "listo": threading.Event()}
+                self._pendientes[prefijo_auditoria] = lote
+            posicion = len(lote["sufijos"])
+            lote["sufijos"].append(sufijo_auditoria)
+            if len(lote["sufijos"]) >= self.max_items:
+                del self._pendientes[prefijo_auditoria]
+                lote["lleno"].set()
+
+        if lider:
+            lote["lleno"].wait(self.espera_max_segundos)
+            with self._lock:
+                if self._pendientes.get(prefijo_auditoria) is lote:
+                    del self._pendientes[prefijo_auditoria]
+            try:
+                if len(lote["sufijos"]) > 1:
+                    lote["auditorias"] = self._enviar_lote(prefijo_auditoria, lote["sufijos"], notificador)
+            finally:
+                lote["listo"].set()
+        else:
+            lote["listo"].wait()
+
+        auditoria = lote["auditorias"][posicion] if lote["auditorias"] else None
+        if auditoria is not None:
+            return auditoria
+        with self._lock:
+            self.auditorias_individuales += 1
+        if self.salida_json:
+            auditoria = self.cliente_llm.generar_texto(
+                self.model_name, sufijo_auditoria, prefijo_cacheable=prefijo_auditoria, notificador=notificador,
+                operacion="auditoria", generation_config=configuracion_json(ESQUEMA_AUDITORIA)
+            )
+            return convertir_salida_json(auditoria_json_a_texto, auditoria, "auditoría")
+        return self.cliente_llm.generar_texto(
+            self.model_name, sufijo_auditoria, prefijo_cacheable=prefijo_auditoria, notificador=notificador,
+            detener_cuando=dictamen_aprobado_en, operacion="auditoria"
+        )
+
+    def _enviar_lote(self, prefijo_auditoria, sufijos_auditoria, notificador):
+        respuesta_lote = self.cliente_llm.generar_texto(
+            self.model_name, construir_sufijo_auditoria_lote(sufijos_auditoria, self.salida_json), prefijo_cacheable=prefijo_auditoria,
+            notificador=notificador, operacion="auditoria_lote",
+            generation_config=configuracion_json(ESQUEMA_AUDITORIA_LOTE) if self.salida_json else None
+        )
+        with self._lock:
+            self.lotes_enviados += 1
+            self.items_en_lotes += len(sufijos_auditoria)
+        if respuesta_lote is None:
+            return None
+        if self.salida_json:
+            try:
+                auditorias = auditorias_lote_json_a_textos(respuesta_lote, len(sufijos_auditoria))
+            except ErrorSalidaEstructurada as e:
+                logger.warning("Respuesta JSON del lote de auditoría inválida: %s", e)
+                auditorias = [None] * len(sufijos_auditoria)
+        else:
+            auditorias = separar_auditorias_lote(respuesta_lote, len(sufijos_auditoria))
+        if None in auditorias:
+            self.cliente_llm.telemetria.contar("fallos_parseo_total", auditorias.count(None), tipo="auditoria_lote")
+            logger.warning("Auditoría por lotes: %s de %s ítems sin veredicto separable; se auditan individualmente.",
+                           auditorias.count(None), len(auditorias))
+        return auditorias
+
+    def estadisticas(self):
+        with self._lock:
+            return {"lotes_enviados": self.lotes_enviados, "items_en_lotes": self.items_en_lotes,
+                    "auditorias_individuales": self.auditorias_individuales}
+
+
+def construir_prefijo_generacion(criterios_generacion, manual_reglas_texto="", prompt_construccion_adicional="", salida_json=False):
+    # Parte estable del prompt de generación (rol, reglas de construcción, manual y formato de
+    # salida): se repite igual en todos los intentos e ítems, y se envía como prefijo cacheable.
+    tipo_pregunta = criterios_generacion.get("tipo_pregunta", "opción múltiple con 4 opciones")
+    formato_justificacion = criterios_generacion.get("formato_justificacion", """
+        • Justificación correcta: debe explicar el razonamiento o proceso cognitivo (NO por descarte).
+        • Justificaciones incorrectas: deben redactarse como: “El estudiante podría escoger la opción X porque… Sin embargo, esto es incorrecto porque…”
+    """)
+    prefijo = f"""
+            Eres un diseñador experto en ítems de evaluación educativa, especializado en pruebas tipo ICFES.
+            Tu tarea es construir un ítem de {tipo_pregunta} con una única respuesta correcta, según los parámetros indicados al final.
+
+            --- INSTRUCCIONES PARA LA CONSTRUCCIÓN ---
+            CONTEXTO: Incluye una situación relevante para el grado y área.
+            ENUNCIADO: Formula una pregunta clara y directa. Si usas negaciones, resáltalas en MAYÚSCULAS Y NEGRITA.
+            OPCIONES: Escribe exactamente cuatro opciones (A, B, C, D). Solo una correcta. Los distractores deben ser creíbles.
+            JUSTIFICACIONES: {formato_justificacion}
+
+            --- PROMPT ADICIONAL: REGLAS GENERALES DE CONSTRUCCIÓN ---
+            {prompt_construccion_adicional if prompt_construccion_adicional else "No se proporcionaron prompts adicionales."}
+            ---------------------------------------------------------
+
+            --- REGLAS ADICIONALES DEL MANUAL ---
+            Aplica estrictamente las directrices del siguiente manual:
+            {manual_reglas_texto}
+            ----------------------------------------------------
+
+            --- INSTRUCCIONES DE SALIDA PARA GRÁFICO ---
+            Después de las justificaciones, incluye:
+            GRAFICO_NECESARIO: [SÍ/NO]
+            DESCRIPCION_GRAFICO: [Si es SÍ, descripción detallada. Si es NO, escribe N/A.]
+
+            --- FORMATO ESPERADO DE SALIDA ---
+            PREGUNTA: [Enunciado]
+            A. [Opción A]
+            B. [Opción B]
+            C. [Opción C]
+            D. [Opción D]
+            RESPUESTA CORRECTA: [Letra]
+            JUSTIFICACIONES:
+            A. [Justificación A]
+            B. [Justificación B]
+            C. [Justificación C]
+            D. [Justificación D]
+            GRAFICO_NECESARIO: [SÍ/NO]
+            DESCRIPCION_GRAFICO: [Descripción o N/A]
+            """
+    return prefijo + INSTRUCCION_SALIDA_JSON if salida_json else prefijo
+
+
+def construir_sufijo_generacion(fila_datos, criterios_generacion, informacion_adicional_usuario="", prompt_bloom_adicional="",
+                                prompt_especifico_adicional="", contexto_general_estacion="", observaciones_auditoria=None,
+                                item_anterior=""):
+    # Parte variable del prompt de generación (parámetros del ítem y, al refinar, la retroalimentación
+    # del auditor con el ítem anterior).
+    proceso_cognitivo = fila_datos.get('PROCESO COGNITIVO', 'no especificado')
+    nanohabilidad = fila_datos.get('NANOHABILIDAD', 'no especificada')
+    descripcion_bloom = get_descripcion_bloom(proceso_cognitivo)
+    sufijo = f"""
+            --- CONTEXTO Y PARÁMETROS DEL ÍTEM ---
+            - Grado: {fila_datos.get('GRADO', 'no especificado')}
+            - Área: {fila_datos.get('ÁREA', 'no especificada')}
+            - Asignatura: {fila_datos.get('ASIGNATURA', 'no especificada')}
+            - Estación o unidad temática: {fila_datos.get('ESTACIÓN', 'no especificada')}
+            - Proceso cognitivo (Taxonomía de Bloom): {proceso_cognitivo}
+            - Descripción del proceso cognitivo: "{descripcion_bloom}"
+
+            --- PROMPT ADICIONAL: TAXONOMÍA DE BLOOM / PROCESOS COGNITIVOS ---
+            {prompt_bloom_adicional if prompt_bloom_adicional else "No se proporcionaron prompts adicionales."}
+            ------------------------------------------------------------------
+
+            - Nanohabilidad (foco principal): {nanohabilidad}
+            - Nivel educativo: {criterios_generacion.get("contexto_educativo", "general")}
+            - Dificultad deseada: {criterios_generacion.get("dificultad", "media")}
+
+            --- CONTEXTO GENERAL DE LA ESTACIÓN (si aplica) ---
+            {f"Considera este contexto general: {contexto_general_estacion}" if contexto_general_estacion else "Genera un contexto individual para este ítem."}
+            ----------------------------------------------------
+
+            --- INFORMACIÓN ADICIONAL DEL USUARIO ---
+            {informacion_adicional_usuario if informacion_adicional_usuario else "No se proporcionó información adicional."}
+            ---------------------------------------------------------------------------
+
+            --- PROMPT ADICIONAL: COSAS ESPECÍFICAS A TENER EN CUENTA ---
+            {prompt_especifico_adicional if prompt_especifico_adicional else "No se proporcionaron prompts adicionales."}
+            ----------------------------------------------------------
+
+            --- DATO CLAVE PARA LA CONSTRUCCIÓN ---
+            Basa el ítem en la siguiente nanohabilidad: "{nanohabilidad}"
+            """
+
+    if observaciones_auditoria is not None:
+        sufijo += f"""
+                --- RETROALIMENTACIÓN DE AUDITORÍA PARA REFINAMIENTO ---
+                El ítem anterior no cumplió los criterios. Revisa estas observaciones y mejora el ítem:
+                Observaciones del Auditor: {observaciones_auditoria}
+                --- ÍTEM ANTERIOR A REFINAR ---
+                {item_anterior}
+                -------------------------------
+                """
+    return sufijo
+
+
+# --- PARSEO DE RESPUESTAS ---
+def parsear_item_generado(full_llm_response):
+    # Devuelve (texto_item, grafico_necesario, descripcion_grafico, formato_reconocido).
+    item_and_graphic_match = re.search(r"(PREGUNTA:.*?)(GRAFICO_NECESARIO:\s*(SÍ|NO).*?DESCRIPCION_GRAFICO:.*)", full_llm_response, re.DOTALL)
+    if not item_and_graphic_match:
+        return full_llm_response, "NO", "", False
+
+    current_item_text = item_and_graphic_match.group(1).strip()
+    grafico_info_block = item_and_graphic_match.group(2).strip()
+
+    grafico_necesario_match = re.search(r"GRAFICO_NECESARIO:\s*(SÍ|NO)", grafico_info_block)
+    grafico_necesario = grafico_necesario_match.group(1).strip() if grafico_necesario_match else "NO"
+
+    descripcion_grafico_match = re.search(r"DESCRIPCION_GRAFICO:\s*(.*)", grafico_info_block, re.DOTALL)
+    descripcion_grafico = descripcion_grafico_match.group(1).strip() if descripcion_grafico_match else ""
+    if descripcion_grafico.upper() == 'N/A':
+        descripcion_grafico = ""
+    return current_item_text, grafico_necesario, descripcion_grafico, True
+
+
+_PATRON_DICTAMEN = re.compile(r"DICTAMEN FINAL:\s*\[(.*?)]", re.DOTALL)
+
+
+def dictamen_aprobado_en(auditoria_parcial):
+    # True en cuanto el texto (aunque esté incompleto) ya contiene un DICTAMEN FINAL aprobatorio.
+    dictamen_final_match = _PATRON_DICTAMEN.search(auditoria_parcial)
+    return bool(dictamen_final_match) and dictamen_final_match.group(1).strip() == DICTAMEN_APROBADO
+
+
+def parsear_auditoria(auditoria_resultado):
+    # Devuelve (dictamen, observaciones).
+    dictamen_final_match = _PATRON_DICTAMEN.search(auditoria_resultado)
+    auditoria_status = dictamen_final_match.group(1).strip() if dictamen_final_match else DICTAMEN_NO_EXTRAIDO
+
+    observaciones_start = auditoria_resultado.find("OBSERVACIONES FINALES:")
+    if observaciones_start != -1:
+        audit_observations = auditoria_resultado[observaciones_start + len("OBSERVACIONES FINALES:"):].strip()
+    elif auditoria_status == DICTAMEN_APROBADO:
+        audit_observations = "Sin observaciones (la auditoría se detuvo al leer el dictamen aprobatorio)."
+    else:
+        audit_observations = "No se pudieron extraer observaciones."
+    return auditoria_status, audit_observations
+
+
+# --- CICLO GENERAR → AUDITAR → REFINAR ---
+_RANGO_DICTAMEN = {"✅": 2, "⚠️": 1}
+
+
+def puntaje_candidato(candidato):
+    # Mayor es mejor: primero el dictamen, luego menos criterios marcados con ❌ y menos problemas estructurales.
+    rango = next((valor for simbolo, valor in _RANGO_DICTAMEN.items() if candidato["status"].startswith(simbolo)), 0)
+    return rango, -candidato["auditoria"].count("❌"), -len(candidato["problemas"])
+
+
+def primer_candidato_aprobado(producir_candidato, cantidad):
+    # Ejecuta producir_candidato(i, descartar) para i en range(cantidad) en paralelo y devuelve el
+    # primer candidato aprobado sin esperar a los demás; si ninguno se aprueba, el de mejor puntaje.
+    # El evento descartar se activa al salir, para que los candidatos en curso no sigan llamando al modelo.
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=cantidad, thread_name_prefix="candidato")
+    descartar = threading.Event()
+    candidatos = []
+    try:
+        futuros = [executor.submit(producir_candidato, i, descartar) for i in range(cantidad)]
+        for futuro in concurrent.futures.as_completed(futuros):
+            try:
+                candidato = futuro.result()
+            except Exception:
+                logger.exception("Error técnico produciendo un candidato")
+                continue
+            if candidato["status"] == DICTAMEN_APROBADO:
+                return candidato
+            candidatos.append(candidato)
+    finally:
+        # Las llamadas de los candidatos restantes no se esperan: su resultado ya no se usa.
+        descartar.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    if not candidatos:
+        raise RuntimeError("Ningún candidato pudo producirse.")
+    validos = [candidato for candidato in candidatos if not candidato["error"]]
+    return max(validos, key=puntaje_candidato) if validos else candidatos[0]
+
+
+def generar_pregunta_con_seleccion(cliente_llm, gen_model_name, audit_model_name,
+                                   fila_datos, criterios_generacion, manual_reglas_texto="",
+                                   informacion_adicional_usuario="",
+                                   prompt_bloom_adicional="", prompt_construccion_adicional="", prompt_especifico_adicional="",
+                                   prompt_auditor_adicional="",
+                                   contexto_general_estacion="", notificador=None, bitacora=None, validar_estructura=True,
+                                   seleccion_manual=None, candidatos_en_paralelo=1, auditor_lotes=None, salida_json=False,
+                                   cascada_auditoria=None, banco_items=None, detener=None):
+    # detener (threading.Event) cancela la generación entre llamadas al modelo: al activarse no se
+    # empieza otro intento ni se audita el ítem recién generado.
+    # Con banco_items los ítems aprobados se guardan en el banco y los casi duplicados de un ítem del
+    # banco vuelven al refinamiento sin auditarse (ver banco_items.py).
+    # Con salida_json el generador y el auditor responden con JSON validado contra un esquema (ver
+    # salida_estructurada.py), así que un desvío de formato no cuesta un intento de refinamiento.
+    notificador = notificador or NOTIFICADOR_POR_DEFECTO
+    if seleccion_manual is not None:
+        # Solo las secciones del manual relevantes para este ítem, dentro del presupuesto de tokens.
+        manual_reglas_texto = seleccion_manual.texto_para(fila_datos)
+    contexto_educativo = criterios_generacion.get("contexto_educativo", "general")
+
+    grado_elegido = fila_datos.get('GRADO', 'no especificado')
+    area_elegida = fila_datos.get('ÁREA', 'no especificada')
+    asignatura_elegida = fila_datos.get('ASIGNATURA', 'no especificada')
+    estacion_elegida = fila_datos.get('ESTACIÓN', 'no especificada')
+    proceso_cognitivo_elegido = fila_datos.get('PROCESO COGNITIVO', 'no especificado')
+    nanohabilidad_elegida = fila_datos.get('NANOHABILIDAD', 'no especificada')
+    microhabilidad_elegida = fila_datos.get('MICROHABILIDAD', 'no especificada')
+    competencia_nanohabilidad_elegida = fila_datos.get('COMPETENCIA NANOHABILIDAD', 'no especificada')
+
+    descripcion_bloom = get_descripcion_bloom(proceso_cognitivo_elegido)
+
+    current_item_text = ""
+    auditoria_status = "❌ RECHAZADO"
+    audit_observations = ""
+    attempt = 0
+    grafico_necesario = "NO"
+    descripcion_grafico = ""
+    item_final_data = None
+    full_generation_prompt = ""
+    full_auditor_prompt = ""
+
+    classification_details = {
+        "Grado": grado_elegido, "Área": area_elegida, "Asignatura": asignatura_elegida,
+        "Estación": estacion_elegida, "Proceso Cognitivo": proceso_cognitivo_elegido,
+        "Nanohabilidad": nanohabilidad_elegida, "Microhabilidad": microhabilidad_elegida,
+        "Competencia Nanohabilidad": competencia_nanohabilidad_elegida
+    }
+
+    prefijo_generacion = construir_prefijo_generacion(criterios_generacion, manual_reglas_texto, prompt_construccion_adicional, salida_json)
+
+    # Reanudación desde la bitácora: un ítem terminado se reutiliza tal cual; uno a medias
+    # continúa el refinamiento a partir de su último intento registrado.
+    clave_bitacora = clave_item(classification_details)
+    interrumpido = False
+    if bitacora is not None:
+        item_guardado = bitacora.item_terminado(clave_bitacora)
+        if item_guardado is not None:
+            logger.info("Ítem %s recuperado de la bitácora.", clave_bitacora)
+            return item_guardado
+        ultimo_intento = bitacora.ultimo_intento(clave_bitacora)
+        if ultimo_intento is not None:
+            attempt = ultimo_intento["intento"]
+            item_final_data = ultimo_intento["item_final_data"]
+            current_item_text = item_final_data["item_text"]
+            grafico_necesario = item_final_data["grafico_necesario"]
+            descripcion_grafico = item_final_data["descripcion_grafico"]
+            auditoria_status = item_final_data["final_audit_status"]
+            audit_observations = item_final_data["final_audit_observations"]
+            logger.info("Ítem %s reanudado desde el intento %s.", clave_bitacora, attempt)
+
+    telemetria = cliente_llm.telemetria
+    inicio_item = time.perf_counter()
+    intento_inicial = attempt
+
+    def producir_candidato(prompt_generacion, notificador_candidato, intento, etiqueta="", descartar=None):
+        # Genera, valida y audita un ítem. "error" indica si falló la llamada de generación o la de
+        # auditoría (o si se detuvo antes de auditar); en ese caso el resto del resultado no es utilizable.
+        candidato = {
+            "error": None, "prompt_generacion": prompt_generacion, "item_text": "", "grafico_necesario": "NO",
+            "descripcion_grafico": "", "status": "❌ RECHAZADO", "observaciones": "", "auditor_prompt": "",
+            "auditoria": "", "problemas": []
+        }
+        with notificador_candidato.etapa(f"Generando contenido con IA ({gen_model_name}, Intento {intento}{etiqueta})..."):
+            if salida_json:
+                # El JSON parcial no se muestra como borrador: el ítem aparece ya convertido a texto.
+                full_llm_response = convertir_salida_json(item_json_a_texto, cliente_llm.generar_texto(
+                    gen_model_name, prompt_generacion, prefijo_cacheable=prefijo_generacion, notificador=notificador_candidato,
+                    operacion="generacion", generation_config=configuracion_json(ESQUEMA_ITEM)
+                ), "generación")
+            else:
+                full_llm_response = cliente_llm.generar_texto(
+                    gen_model_name, prompt_generacion, prefijo_cacheable=prefijo_generacion, notificador=notificador_candidato,
+                    al_recibir_fragmento=notificador_candidato.borrador, operacion="generacion"
+                )
+            if full_llm_response is None:
+                candidato.update(error="generacion", status="❌ RECHAZADO (Error de Generación)",
+                                 observaciones="El modelo de generación no pudo producir una respuesta.")
+                return candidato
+
+            item_text, grafico, descripcion, formato_reconocido = parsear_item_generado(full_llm_response)
+            candidato.update(item_text=item_text, grafico_necesario=grafico, descripcion_grafico=descripcion)
+            if not formato_reconocido:
+                telemetria.contar("fallos_parseo_total", tipo="item")
+                notificador_candidato.advertencia("No se pudo parsear el formato de gráfico. Asumiendo que no se requiere.")
+
+        if validar_estructura:
+            candidato["problemas"] = validar_estructura_item(item_text, grafico, descripcion, formato_reconocido)
+        if candidato["problemas"]:
+            # Se ahorra la llamada de auditoría: el ítem vuelve al refinamiento con observaciones automáticas.
+            candidato.update(
+                status=DICTAMEN_RECHAZO_ESTRUCTURAL, observaciones=observaciones_validacion(candidato["problemas"]),
+                auditor_prompt="No se envió a auditoría con LLM: el ítem no pasó la validación estructural local."
+            )
+            return candidato
+
+        duplicado = banco_items.duplicado_de(item_text, classification_details) if banco_items is not None else None
+        if duplicado is not None:
+            # Un casi duplicado de un ítem del banco tampoco se audita: vuelve al refinamiento.
+            id_duplicado, similitud = duplicado
+            telemetria.contar("banco_duplicados_total")
+            candidato.update(
+                status=DICTAMEN_DUPLICADO,
+                observaciones=f"El ítem es casi idéntico al ítem #{id_duplicado} del banco (similitud {similitud:.0%}). "
+                              "Construye una situación, unos datos y unas opciones diferentes.",
+                auditor_prompt="No se envió a auditoría con LLM: el ítem es casi duplicado de uno del banco de ítems."
+            )
+            return candidato
+
+        if any(evento is not None and evento.is_set() for evento in (descartar, detener)):
+            # Otro candidato ya ganó o se canceló la generación: no se paga la auditoría de este.
+            candidato.update(error="detenido", status="❌ RECHAZADO (generación detenida)",
+                             observaciones="La generación se detuvo antes de auditar el ítem.")
+            return candidato
+
+        with notificador_candidato.etapa(f"Auditando ítem ({audit_model_name}, Intento {intento}{etiqueta})..."):
+            auditoria_resultado, candidato["auditor_prompt"] = auditar_item_con_llm(
+                cliente_llm, audit_model_name,
+                item_generado=item_text,
+                grado=grado_elegido, area=area_elegida, asignatura=asignatura_elegida, estacion=estacion_elegida,
+                proceso_cognitivo=proceso_cognitivo_elegido, nanohabilidad=nanohabilidad_elegida,
+                microhabilidad=microhabilidad_elegida, competencia_nanohabilidad=competencia_nanohabilidad_elegida,
+                contexto_educativo=contexto_educativo, manual_reglas_texto=manual_reglas_texto,
+                descripcion_bloom=descripcion_bloom,
+                grafico_necesario=grafico,
+                descripcion_grafico=descripcion,
+                prompt_auditor_adicional=prompt_auditor_adicional,
+                notificador=notificador_candidato,
+                auditor_lotes=auditor_lotes,
+                # El manual seleccionado cambia de un ítem a otro: en el prefijo impediría formar lotes.
+                manual_en_sufijo=auditor_lotes is not None and seleccion_manual is not None,
+                salida_json=salida_json,
+                cascada=cascada_auditoria,
+                ultimo_intento=intento == MAX_INTENTOS_REFINAMIENTO
+            )
+        if auditoria_resultado is None:
+            candidato.update(error="auditoria", status="❌ RECHAZADO (Error de Auditoría)",
+                             observaciones="El modelo de auditoría no pudo producir una respuesta.")
+            return candidato
+
+        candidato["auditoria"] = auditoria_resultado
+        candidato["status"], candidato["observaciones"] = parsear_auditoria(auditoria_resultado)
+        if candidato["status"] == DICTAMEN_NO_EXTRAIDO:
+            telemetria.contar("fallos_parseo_total", tipo="auditoria")
+        return candidato
+
+    while auditoria_status != DICTAMEN_APROBADO and attempt < MAX_INTENTOS_REFINAMIENTO:
+        if detener is not None and detener.is_set():
+            # Generación cancelada: el ítem queda interrumpido con el último intento registrado.
+            interrumpido = True
+            break
+        attempt += 1
+
+        prompt_content_for_llm = construir_sufijo_generacion(
+            fila_datos, criterios_generacion, informacion_adicional_usuario, prompt_bloom_adicional,
+            prompt_especifico_adicional, contexto_general_estacion,
+            observaciones_auditoria=audit_observations if attempt > 1 else None, item_anterior=current_item_text
+        )
+
+        full_generation_prompt = prefijo_generacion + prompt_content_for_llm
+
+        try:
+            if attempt == 1 and candidatos_en_paralelo > 1:
+                # Primer intento con varios candidatos a la vez: se usa el primero aprobado y, si
+                # ninguno lo está, el de mejor puntaje pasa al refinamiento.
+                prompts_candidatos = [
+                    prompt_content_for_llm + f"""
+            --- VARIANTE {numero} DE {candidatos_en_paralelo} ---
+            Construye una propuesta distinta de las demás variantes (otra situación, otros datos y otros distractores).
+            """
+                    for numero in range(1, candidatos_en_paralelo + 1)
+                ]
+                with notificador.etapa(f"Generando y auditando {candidatos_en_paralelo} candidatos en paralelo ({gen_model_name} / {audit_model_name})..."):
+                    candidato = primer_candidato_aprobado(
+                        lambda i, descartar: producir_candidato(prompts_candidatos[i], NOTIFICADOR_POR_DEFECTO, attempt,
+                                                                f", candidato {i + 1}/{candidatos_en_paralelo}", descartar),
+                        candidatos_en_paralelo
+                    )
+            else:
+                candidato = producir_candidato(prompt_content_for_llm, notificador, attempt)
+
+            if candidato["error"]:
+                auditoria_status = candidato["status"]
+                audit_observations = candidato["observaciones"]
+                interrumpido = True
+                break
+
+            full_generation_prompt = prefijo_generacion + candidato["prompt_generacion"]
+            current_item_text = candidato["item_text"]
+            grafico_necesario = candidato["grafico_necesario"]
+            descripcion_grafico = candidato["descripcion_grafico"]
+            auditoria_status = candidato["status"]
+            audit_observations = candidato["observaciones"]
+            full_auditor_prompt = candidato["auditor_prompt"]
+
+            item_final_data = {
+                "item_text": current_item_text, "classification": classification_details,
+                "grafico_necesario": grafico_necesario, "descripcion_grafico": descripcion_grafico,
+                "final_audit_status": auditoria_status, "final_audit_observations": audit_observations,
+                "generation_prompt_used": full_generation_prompt, "auditor_prompt_used": full_auditor_prompt
+            }
+            if bitacora is not None:
+                bitacora.registrar_intento(clave_bitacora, attempt, item_final_data)
+            telemetria.contar("intentos_total", intento=attempt, aprobado="si" if auditoria_status == DICTAMEN_APROBADO else "no")
+            telemetria.evento("intento", item=clave_bitacora, intento=attempt, dictamen=auditoria_status,
+                              problemas_estructurales=len(candidato["problemas"]))
+
+            if auditoria_status == DICTAMEN_APROBADO:
+                break
+
+        except Exception as e:
+            audit_observations = f"Error técnico durante la generación: {e}"
+            auditoria_status = "❌ RECHAZADO (error técnico)"
+            item_final_data = {
+                "item_text": current_item_text if current_item_text else "No se pudo generar el ítem.",
+                "classification": classification_details, "grafico_necesario": "NO", "descripcion_grafico": "",
+                "final_audit_status": auditoria_status, "final_audit_observations": audit_observations,
+                "generation_prompt_used": full_generation_prompt, "auditor_prompt_used": full_auditor_prompt
+            }
+            interrumpido = True
+            break
+
+    # Solo se marca como terminado si el ciclo acabó por dictamen o por agotar los intentos; tras un
+    # error, una nueva ejecución vuelve a intentarlo desde el último intento registrado.
+    if bitacora is not None and item_final_data is not None and not interrumpido:
+        bitacora.registrar_item(clave_bitacora, item_final_data)
+    if banco_items is not None and not interrumpido and auditoria_status == DICTAMEN_APROBADO:
+        banco_items.guardar(item_final_data)
+
+    resultado_item = "interrumpido" if interrumpido else ("aprobado" if auditoria_status == DICTAMEN_APROBADO else "rechazado")
+    segundos_item = time.perf_counter() - inicio_item
+    telemetria.contar("items_total", dictamen=resultado_item)
+    telemetria.observar("item_segundos", segundos_item, dictamen=resultado_item)
+    telemetria.evento("item", item=clave_bitacora, dictamen=resultado_item, intentos=attempt - intento_inicial,
+                      ultimo_intento=attempt, segundos=segundos_item)
+    return item_final_data
+
+
+# --- MODO ESTACIÓN ---
+def filas_de_estacion(df_estacion):
+    # Una fila por combinación única de proceso cognitivo / nanohabilidad / microhabilidad / competencia.
+    return df_estacion[COLUMNAS_FILA_ESTACION].drop_duplicates().to_dict('records')
+
+
+def estaciones_del_libro(df_datos):
+    # Devuelve [(grado, área, asignatura, estación, df_estacion), ...] para todo el libro de Excel.
+    df_validos = df_datos.dropna(subset=COLUMNAS_ESTACION)
+    return [(*claves, df_estacion) for claves, df_estacion in df_validos.groupby(COLUMNAS_ESTACION, sort=True, observed=True)]
+
+
+def ejecutar_en_paralelo(elementos, funcion, max_en_paralelo=4, al_cambiar_estado=None, nombre_hilos="motor", detener=None):
+    # Ejecuta funcion(elemento) en un pool de hilos acotado y devuelve los resultados en el orden
+    # original. al_cambiar_estado(i, estado, detalle) se invoca siempre desde el hilo que llama a
+    # esta función (estados: "en_cola", "procesando", "terminado", "error"), de modo que la
+    # interfaz puede actualizarse desde allí sin tocar los hilos de trabajo.
+    # detener (threading.Event) es la señal de cancelación que funcion consulta entre llamadas al
+    # modelo: si se activa, o si el llamador se interrumpe, los elementos que no empezaron se
+    # descartan y se espera a que los que están en curso se detengan.
+    total = len(elementos)
+    resultados = [None] * total
+    if total == 0:
+        return resultados
+
+    def notificar(i, estado, detalle=None):
+        if al_cambiar_estado is not None:
+            al_cambiar_estado(i, estado, detalle)
+
+    for i in range(total):
+        notificar(i, "en_cola")
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_en_paralelo, thread_name_prefix=nombre_hilos)
+    completo = False
+    try:
+        futuros = {executor.submit(funcion, elemento): i for i, elemento in enumerate(elementos)}
+        pendientes = set(futuros)
+        en_proceso = set()
+        while pendientes and not (detener is not None and detener.is_set()):
+            hechos, pendientes = concurrent.futures.wait(pendientes, timeout=0.5, return_when=concurrent.futures.FIRST_COMPLETED)
+            for futuro in hechos:
+                i = futuros[futuro]
+                try:
+                    resultados[i] = futuro.result()
+                    notificar(i, "terminado", resultados[i])
+                except Exception as e:
+                    logger.exception("Error técnico procesando el elemento %s", i)
+                    notificar(i, "error", e)
+            for futuro in pendientes:
+                if futuro.running() and futuro not in en_proceso:
+                    en_proceso.add(futuro)
+                    notificar(futuros[futuro], "procesando")
+        completo = not pendientes
+    finally:
+        # Los elementos que aún no empezaron no se esperan. Los que están en curso solo se esperan si
+        # pueden detenerse (con detener), para no devolver el hilo mientras siguen llamando al modelo.
+        if detener is not None and not completo:
+            detener.set()
+        executor.shutdown(wait=detener is not None, cancel_futures=True)
+
+    # Tras una cancelación se conservan los resultados de los elementos que alcanzaron a terminar.
+    for futuro, i in futuros.items():
+        if resultados[i] is None and futuro.done() and not futuro.cancelled() and futuro.exception() is None:
+            resultados[i] = futuro.result()
+    return resultados
+
+
+def generar_items_estacion(cliente_llm, gen_model_name, audit_model_name, grado, area, asignatura, estacion,
+                           filas_estacion, criterios_generacion, manual_reglas_texto="",
+                           informacion_adicional_usuario="", prompt_bloom_adicional="", prompt_construccion_adicional="",
+                           prompt_especifico_adicional="", prompt_auditor_adicional="", contexto_general_estacion="",
+                           max_en_paralelo=4, al_cambiar_estado=None, bitacora=None, validar_estructura=True,
+                           seleccion_manual=None, candidatos_en_paralelo=1, tamano_lote_auditoria=1, salida_json=False,
+                           cascada_auditoria=None, banco_items=None, reutilizar_banco=False, detener=None):
+    # detener (threading.Event) cancela las filas en curso entre llamadas al modelo (ver ejecutar_en_paralelo).
+    # Con reutilizar_banco, las filas que ya tienen un ítem aprobado en el banco se sirven desde allí y
+    # solo se generan las que faltan.
+    # Con tamano_lote_auditoria > 1 las auditorías de los ítems que se procesan a la vez se agrupan
+    # en solicitudes de hasta ese tamaño (acotado por los ítems y candidatos simultáneos).
+    auditor_lotes = None
+    tamano_lote_auditoria = min(tamano_lote_auditoria, max_en_paralelo * candidatos_en_paralelo)
+    if tamano_lote_auditoria > 1:
+        auditor_lotes = AuditorPorLotes(cliente_llm, audit_model_name, tamano_lote_auditoria, salida_json=salida_json)
+
+    def generar_fila_estacion(item_spec_row):
+        current_fila_datos = {'GRADO': grado, 'ÁREA': area, 'ASIGNATURA': asignatura, 'ESTACIÓN': estacion, **item_spec_row}
+        return generar_pregunta_con_seleccion(
+            cliente_llm, gen_model_name, audit_model_name, current_fila_datos, criterios_generacion, manual_reglas_texto,
+            informacion_adicional_usuario, prompt_bloom_adicional, prompt_construccion_adicional, prompt_especifico_adicional,
+            prompt_auditor_adicional, contexto_general_estacion, bitacora=bitacora,
+            validar_estructura=validar_estructura, seleccion_manual=seleccion_manual,
+            candidatos_en_paralelo=candidatos_en_paralelo, auditor_lotes=auditor_lotes, salida_json=salida_json,
+            cascada_auditoria=cascada_auditoria, banco_items=banco_items, detener=detener
+        )
+
+    # Los resultados conservan el orden original de las filas de la estación.
+    resultados = [None] * len(filas_estacion)
+    pendientes = list(range(len(filas_estacion)))
+    if banco_items is not None and reutilizar_banco:
+        pendientes = []
+        for i, item_spec_row in enumerate(filas_estacion):
+            # Los mismos valores (y valores por defecto) con que generar_pregunta_con_seleccion clasifica el ítem.
+            clasificacion = {"Grado": grado, "Área": area, "Asignatura": asignatura, "Estación": estacion,
+                             "Proceso Cognitivo": item_spec_row.get('PROCESO COGNITIVO', 'no especificado'),
+                             "Nanohabilidad": item_spec_row.get('NANOHABILIDAD', 'no especificada'),
+                             "Microhabilidad": item_spec_row.get('MICROHABILIDAD', 'no especificada'),
+                             "Competencia Nanohabilidad": item_spec_row.get('COMPETENCIA NANOHABILIDAD', 'no especificada')}
+            existentes = banco_items.items_de(clasificacion, dictamen=DICTAMEN_APROBADO, limite=1)
+            if existentes:
+                resultados[i] = existentes[0]
+            else:
+                pendientes.append(i)
+        servidos = len(filas_estacion) - len(pendientes)
+        cliente_llm.telemetria.contar("banco_reutilizados_total", servidos)
+        logger.info("Banco de ítems en %s: %s ítem(s) reutilizados, %s por generar.", estacion, servidos, len(pendientes))
+        for i, item_data in enumerate(resultados):
+            if item_data is not None and al_cambiar_estado is not None:
+                al_cambiar_estado(i, "terminado", item_data)
+
+    def notificar_pendiente(posicion, estado, detalle):
+        if al_cambiar_estado is not None:
+            al_cambiar_estado(pendientes[posicion], estado, detalle)
+
+    detener = detener or threading.Event()
+    generados = ejecutar_en_paralelo([filas_estacion[i] for i in pendientes], generar_fila_estacion, max_en_paralelo,
+                                     notificar_pendiente, nombre_hilos="estacion", detener=detener)
+    for i, item_data in zip(pendientes, generados):
+        resultados[i] = item_data
+    if auditor_lotes is not None:
+        logger.info("Auditoría por lotes en %s: %s", estacion, auditor_lotes.estadisticas())
+    return resultados
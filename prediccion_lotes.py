@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import sys
+
+import motor
+from exportacion import exportar_a_word, item_a_linea_jsonl
+from recuperacion_manual import IndiceManual, SeleccionManual, PRESUPUESTO_TOKENS_POR_DEFECTO, MAX_SECCIONES_POR_DEFECTO
+from taxonomia import leer_libro_excel
+from validador import validar_estructura_item, observaciones_validacion
+
+# --- PREDICCIÓN POR LOTES EN VERTEX AI (SIN CONEXIÓN) ---
+# Para bancos grandes, en lugar de una solicitud en línea por generación y auditoría, cada ronda
+# del ciclo generar→auditar→refinar se escribe como archivos JSONL de batch prediction (uno por
+# modelo) y se importan sus resultados:
+#   1. python prediccion_lotes.py exportar --excel ESTRUCTURA_TOTAL.xlsx --manual manual.pdf --trabajo lote/
+#      → lote/ronda_01_generacion_<modelo>.jsonl
+#   2. Cada archivo se sube a GCS y se lanza un trabajo de batch prediction con el modelo de su nombre
+#      (p. ej. vertexai.batch_prediction.BatchPredictionJob.submit).
+#   3. python prediccion_lotes.py importar --trabajo lote/ resultados/*.jsonl
+#      → aplica los resultados y escribe la ronda siguiente (auditorías y refinamientos).
+# Se repiten 2 y 3 hasta que no queden solicitudes; entonces se escriben lote/items.jsonl y
+# lote/items.docx. El estado del trabajo vive en lote/estado.json.
+# Para probar todo el flujo sin Vertex AI: python prediccion_lotes.py responder-local --trabajo lote/ --backend falso
+
+logger = logging.getLogger("prediccion_lotes")
+
+ARCHIVO_ESTADO = "estado.json"
+MAX_FALLOS_SOLICITUD = 3
+
+
+def _hash_prompt(prompt):
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+def linea_solicitud(clave, prompt):
+    # Formato de entrada de batch prediction para Gemini; la clave viaja en las etiquetas de la solicitud.
+    solicitud = {"contents": [{"role": "user", "parts": [{"text": prompt}]}], "labels": {"clave": clave}}
+    return json.dumps({"request": solicitud}, ensure_ascii=False) + "\n"
+
+
+def leer_linea_resultado(linea):
+    # Devuelve (clave o None, hash del prompt, texto o None, error o None).
+    registro = json.loads(linea)
+    solicitud = registro.get("request", {})
+    clave = registro.get("clave") or solicitud.get("labels", {}).get("clave")
+    prompt = "".join(parte.get("text", "") for contenido in solicitud.get("contents", []) for parte in contenido.get("parts", []))
+    error = registro.get("status") or None
+    candidatos = (registro.get("response") or {}).get("candidates") or []
+    partes = candidatos[0].get("content", {}).get("parts", []) if candidatos else []
+    texto = "".join(parte.get("text", "") for parte in partes) or None
+    if texto is None and error is None:
+        error = "Respuesta sin texto."
+    return clave, _hash_prompt(prompt), texto, error
+
+
+# --- ESTADO DEL TRABAJO ---
+def _ruta_estado(directorio):
+    return os.path.join(directorio, ARCHIVO_ESTADO)
+
+
+def cargar_estado(directorio):
+    with open(_ruta_estado(directorio), encoding="utf-8") as archivo:
+        return json.load(archivo)
+
+
+def guardar_estado(directorio, estado):
+    ruta = _ruta_estado(directorio)
+    temporal = ruta + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as archivo:
+        json.dump(estado, archivo, ensure_ascii=False, default=str)
+    os.replace(temporal, ruta)
+
+
+def _seleccion_manual(estado):
+    configuracion = estado["configuracion"]
+    if not configuracion["manual"] or not configuracion["presupuesto_manual_tokens"]:
+        return None
+    return SeleccionManual(IndiceManual(configuracion["manual"]), configuracion["presupuesto_manual_tokens"],
+                           configuracion["secciones_manual"])
+
+
+def _manual_para(estado, fila_datos, seleccion_manual):
+    if seleccion_manual is not None:
+        return seleccion_manual.texto_para(fila_datos)
+    return motor.recortar_manual(estado["configuracion"]["manual"])[0]
+
+
+def _solicitud_generacion(estado, item, manual, observaciones=None):
+    configuracion = estado["configuracion"]
+    prompt = motor.construir_prefijo_generacion(configuracion["criterios"], manual) + motor.construir_sufijo_generacion(
+        item["fila"], configuracion["criterios"], observaciones_auditoria=observaciones,
+        item_anterior=(item["item_final_data"] or {}).get("item_text", "")
+    )
+    item["intento"] += 1
+    item["pendiente"] = {"tipo": "generacion", "clave": f"i{item['indice']:05d}-generacion-{item['intento']}",
+                         "prompt": prompt, "fallos": 0}
+
+
+def _solicitud_auditoria(estado, item, manual, item_text, grafico_necesario, descripcion_grafico):
+    configuracion = estado["configuracion"]
+    fila = item["fila"]
+    proceso_cognitivo = fila.get('PROCESO COGNITIVO', 'no especificado')
+    prompt = motor.construir_prefijo_auditoria(manual) + motor.construir_sufijo_auditoria(
+        item_text, fila.get('GRADO', 'no especificado'), fila.get('ÁREA', 'no especificada'),
+        fila.get('ASIGNATURA', 'no especificada'), fila.get('ESTACIÓN', 'no especificada'), proceso_cognitivo,
+        fila.get('NANOHABILIDAD', 'no especificada'), fila.get('MICROHABILIDAD', 'no especificada'),
+        fila.get('COMPETENCIA NANOHABILIDAD', 'no especificada'), configuracion["criterios"].get("contexto_educativo", "general"),
+        motor.get_descripcion_bloom(proceso_cognitivo), grafico_necesario, descripcion_grafico
+    )
+    item["pendiente"] = {"tipo": "auditoria", "clave": f"i{item['indice']:05d}-auditoria-{item['intento']}",
+                         "prompt": prompt, "fallos": 0}
+
+
+def _clasificacion(fila):
+    return {
+        "Grado": fila.get('GRADO', 'no especificado'), "Área": fila.get('ÁREA', 'no especificada'),
+        "Asignatura": fila.get('ASIGNATURA', 'no especificada'), "Estación": fila.get('ESTACIÓN', 'no especificada'),
+        "Proceso Cognitivo": fila.get('PROCESO COGNITIVO', 'no especificado'),
+        "Nanohabilidad": fila.get('NANOHABILIDAD', 'no especificada'),
+        "Microhabilidad": fila.get('MICROHABILIDAD', 'no especificada'),
+        "Competencia Nanohabilidad": fila.get('COMPETENCIA NANOHABILIDAD', 'no especificada')
+    }
+
+
+def _registrar_resultado(estado, item, dictamen, observaciones, item_text, grafico_necesario, descripcion_grafico,
+                         auditor_prompt, generation_prompt):
+    item["item_final_data"] = {
+        "item_text": item_text, "classification": _clasificacion(item["fila"]),
+        "grafico_necesario": grafico_necesario, "descripcion_grafico": descripcion_grafico,
+        "final_audit_status": dictamen, "final_audit_observations": observaciones,
+        "generation_prompt_used": generation_prompt, "auditor_prompt_used": auditor_prompt
+    }
+
+
+def aplicar_resultado(estado, item, texto, seleccion_manual):
+    # Avanza el ciclo de un ítem con la respuesta de su solicitud pendiente y deja lista la siguiente
+    # (auditoría o refinamiento) o lo marca como terminado.
+    pendiente = item["pendiente"]
+    manual = _manual_para(estado, item["fila"], seleccion_manual)
+    if pendiente["tipo"] == "generacion":
+        item_text, grafico_necesario, descripcion_grafico, formato_reconocido = motor.parsear_item_generado(texto)
+        item["generacion"] = {"item_text": item_text, "grafico_necesario": grafico_necesario,
+                              "descripcion_grafico": descripcion_grafico, "prompt": pendiente["prompt"]}
+        problemas = []
+        if estado["configuracion"]["validar_estructura"]:
+            problemas = validar_estructura_item(item_text, grafico_necesario, descripcion_grafico, formato_reconocido)
+        if not problemas:
+            _solicitud_auditoria(estado, item, manual, item_text, grafico_necesario, descripcion_grafico)
+            return
+        dictamen, observaciones = motor.DICTAMEN_RECHAZO_ESTRUCTURAL, observaciones_validacion(problemas)
+        auditor_prompt = "No se envió a auditoría con LLM: el ítem no pasó la validación estructural local."
+    else:
+        dictamen, observaciones = motor.parsear_auditoria(texto)
+        auditor_prompt = pendiente["prompt"]
+
+    generacion = item["generacion"]
+    _registrar_resultado(estado, item, dictamen, observaciones, generacion["item_text"], generacion["grafico_necesario"],
+                         generacion["descripcion_grafico"], auditor_prompt, generacion["prompt"])
+    if dictamen != motor.DICTAMEN_APROBADO and item["intento"] < motor.MAX_INTENTOS_REFINAMIENTO:
+        _solicitud_generacion(estado, item, manual, observaciones)
+    else:
+        item["pendiente"] = None
+
+
+def escribir_ronda(directorio, estado):
+    # Escribe un archivo de solicitudes por tipo (y modelo) para la ronda actual; devuelve sus rutas.
+    configuracion = estado["configuracion"]
+    modelos = {"generacion": configuracion["gen_model_name"], "auditoria": configuracion["audit_model_name"]}
+    lineas = {"generacion": [], "auditoria": []}
+    for item in estado["items"]:
+        if item["pendiente"]:
+            lineas[item["pendiente"]["tipo"]].append(linea_solicitud(item["pendiente"]["clave"], item["pendiente"]["prompt"]))
+
+    rutas = []
+    for tipo, lineas_tipo in lineas.items():
+        if not lineas_tipo:
+            continue
+        ruta = os.path.join(directorio, f"ronda_{estado['ronda']:02d}_{tipo}_{modelos[tipo]}.jsonl")
+        with open(ruta, "w", encoding="utf-8") as archivo:
+            archivo.writelines(lineas_tipo)
+        estado["archivos_ronda"][os.path.basename(ruta)] = modelos[tipo]
+        rutas.append(ruta)
+    return rutas
+
+
+def escribir_salida(directorio, estado):
+    items = [item["item_final_data"] for item in estado["items"] if item["item_final_data"]]
+    with open(os.path.join(directorio, "items.jsonl"), "w", encoding="utf-8") as archivo:
+        archivo.writelines(item_a_linea_jsonl(item_data) for item_data in items)
+    with open(os.path.join(directorio, "items.docx"), "wb") as archivo:
+        archivo.write(exportar_a_word(items).getvalue())
+    return items
+
+
+# --- SUBCOMANDOS ---
+def exportar(args):
+    df_datos = leer_libro_excel(args.excel)
+    filtros = {"GRADO": args.grado, "ÁREA": args.area, "ASIGNATURA": args.asignatura, "ESTACIÓN": args.estacion}
+    for columna, valor in filtros.items():
+        if valor is not None:
+            df_datos = df_datos[df_datos[columna].astype(str) == str(valor)]
+
+    manual = ""
+    if args.manual:
+        with open(args.manual, "rb") as archivo_pdf:
+            manual = motor.extraer_texto_pdf(archivo_pdf.read())
+
+    filas = []
+    for grado, area, asignatura, estacion, df_estacion in motor.estaciones_del_libro(df_datos):
+        for fila in motor.filas_de_estacion(df_estacion):
+            filas.append({'GRADO': grado, 'ÁREA': area, 'ASIGNATURA': asignatura, 'ESTACIÓN': estacion, **fila})
+    if not filas:
+        logger.error("No hay ítems para exportar con los filtros indicados.")
+        return 1
+
+    os.makedirs(args.trabajo, exist_ok=True)
+    estado = {
+        "configuracion": {
+            "gen_model_name": args.modelo_generacion, "audit_model_name": args.modelo_auditoria,
+            "criterios": motor.CRITERIOS_POR_DEFECTO, "manual": manual,
+            "presupuesto_manual_tokens": args.presupuesto_manual_tokens, "secciones_manual": args.secciones_manual,
+            "validar_estructura": not args.sin_validacion_local
+        },
+        "ronda": 1, "archivos_ronda": {},
+        "items": [{"indice": i, "fila": fila, "intento": 0, "pendiente": None, "generacion": None, "item_final_data": None}
+                  for i, fila in enumerate(filas)]
+    }
+    # Ida y vuelta por JSON para que las filas tengan los mismos tipos que al reanudar desde estado.json.
+    estado = json.loads(json.dumps(estado, ensure_ascii=False, default=str))
+    seleccion_manual = _seleccion_manual(estado)
+    for item in estado["items"]:
+        _solicitud_generacion(estado, item, _manual_para(estado, item["fila"], seleccion_manual))
+    rutas = escribir_ronda(args.trabajo, estado)
+    guardar_estado(args.trabajo, estado)
+    logger.info("%s ítem(s) exportados. Solicitudes de la ronda 1: %s", len(filas), ", ".join(rutas))
+    return 0
+
+
+def importar(args):
+    estado = cargar_estado(args.trabajo)
+    seleccion_manual = _seleccion_manual(estado)
+    pendientes_por_clave = {item["pendiente"]["clave"]: item for item in estado["items"] if item["pendiente"]}
+    pendientes_por_prompt = {_hash_prompt(item["pendiente"]["prompt"]): item for item in pendientes_por_clave.values()}
+
+    aplicados, fallidos = 0, 0
+    for ruta in args.resultados:
+        with open(ruta, encoding="utf-8") as archivo:
+            for linea in archivo:
+                if not linea.strip():
+                    continue
+                clave, hash_prompt, texto, error = leer_linea_resultado(linea)
+                item = pendientes_por_clave.get(clave) or pendientes_por_prompt.get(hash_prompt)
+                if item is None or item["pendiente"] is None or item["pendiente"]["clave"] not in pendientes_por_clave:
+                    continue
+                del pendientes_por_clave[item["pendiente"]["clave"]]
+                if error is not None:
+                    # La misma solicitud se repite en la ronda siguiente, hasta MAX_FALLOS_SOLICITUD veces.
+                    fallidos += 1
+                    item["pendiente"]["fallos"] += 1
+                    if item["pendiente"]["fallos"] >= MAX_FALLOS_SOLICITUD:
+                        logger.error("La solicitud %s falló %s veces (%s); el ítem se da por terminado.",
+                                     item["pendiente"]["clave"], MAX_FALLOS_SOLICITUD, error)
+                        item["pendiente"] = None
+                    continue
+                aplicar_resultado(estado, item, texto, seleccion_manual)
+                aplicados += 1
+
+    sin_respuesta = len(pendientes_por_clave)
+    estado["ronda"] += 1
+    estado["archivos_ronda"] = {}
+    rutas = escribir_ronda(args.trabajo, estado)
+    guardar_estado(args.trabajo, estado)
+    logger.info("Ronda %s importada: %s resultado(s) aplicados, %s con error, %s solicitud(es) sin respuesta (se repiten).",
+                estado["ronda"] - 1, aplicados, fallidos, sin_respuesta)
+    if rutas:
+        logger.info("Solicitudes de la ronda %s: %s", estado["ronda"], ", ".join(rutas))
+        return 0
+    items = escribir_salida(args.trabajo, estado)
+    dictamenes = {}
+    for item_data in items:
+        dictamenes[item_data["final_audit_status"]] = dictamenes.get(item_data["final_audit_status"], 0) + 1
+    logger.info("Trabajo terminado: %s ítem(s) en %s. Dictámenes: %s", len(items), os.path.join(args.trabajo, "items.jsonl"), dictamenes)
+    return 0
+
+
+def responder_local(args):
+    # Produce archivos de resultados con el mismo formato que batch prediction usando un backend
+    # local (por defecto el simulado), para probar el flujo completo sin Vertex AI.
+    from backends_llm import obtener_backend
+    estado = cargar_estado(args.trabajo)
+    backend = obtener_backend(args.backend)
+    directorio_resultados = os.path.join(args.trabajo, "resultados")
+    os.makedirs(directorio_resultados, exist_ok=True)
+    for nombre_archivo, model_name in estado["archivos_ronda"].items():
+        ruta_resultados = os.path.join(directorio_resultados, nombre_archivo)
+        with open(os.path.join(args.trabajo, nombre_archivo), encoding="utf-8") as entrada, \
+                open(ruta_resultados, "w", encoding="utf-8") as salida:
+            for linea in entrada:
+                registro = json.loads(linea)
+                prompt = registro["request"]["contents"][0]["parts"][0]["text"]
+                try:
+                    texto = backend.generar(model_name, prompt)
+                    registro.update(status="", response={"candidates": [{"content": {"role": "model", "parts": [{"text": texto}]}}]})
+                except Exception as e:
+                    registro.update(status=str(e))
+                salida.write(json.dumps(registro, ensure_ascii=False) + "\n")
+        logger.info("Resultados locales para %s → %s", nombre_archivo, ruta_resultados)
+    return 0
+
+
+def construir_parser():
+    parser = argparse.ArgumentParser(description="Genera y audita ítems con predicción por lotes de Vertex AI.")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    parser_exportar = subparsers.add_parser("exportar", help="Crea el trabajo y escribe las solicitudes de la primera ronda.")
+    parser_exportar.add_argument("--excel", required=True, help="Ruta al libro ESTRUCTURA_TOTAL.xlsx.")
+    parser_exportar.add_argument("--manual", help="Ruta al PDF del manual de construcción de pruebas.")
+    parser_exportar.add_argument("--trabajo", required=True, help="Directorio del trabajo (estado y archivos de cada ronda).")
+    parser_exportar.add_argument("--modelo-generacion", default="gemini-2.0-flash")
+    parser_exportar.add_argument("--modelo-auditoria", default="gemini-2.0-flash-lite")
+    parser_exportar.add_argument("--grado")
+    parser_exportar.add_argument("--area")
+    parser_exportar.add_argument("--asignatura")
+    parser_exportar.add_argument("--estacion")
+    parser_exportar.add_argument("--presupuesto-manual-tokens", type=int, default=PRESUPUESTO_TOKENS_POR_DEFECTO,
+                                 help="Tokens del manual por ítem (secciones relevantes elegidas con BM25). 0 recorta el manual.")
+    parser_exportar.add_argument("--secciones-manual", type=int, default=MAX_SECCIONES_POR_DEFECTO)
+    parser_exportar.add_argument("--sin-validacion-local", action="store_true")
+
+    parser_importar = subparsers.add_parser("importar", help="Aplica archivos de resultados y escribe la ronda siguiente.")
+    parser_importar.add_argument("--trabajo", required=True)
+    parser_importar.add_argument("resultados", nargs="+", help="Archivos JSONL de resultados (se aceptan comodines).")
+
+    parser_local = subparsers.add_parser("responder-local", help="Responde la ronda actual con un backend local.")
+    parser_local.add_argument("--trabajo", required=True)
+    parser_local.add_argument("--backend", default="falso")
+    return parser
+
+
+def main(argv=None):
+    args = construir_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if args.comando == "importar":
+        args.resultados = [ruta for patron in args.resultados for ruta in sorted(glob.glob(patron)) or [patron]]
+    return {"exportar": exportar, "importar": importar, "responder-local": responder_local}[args.comando](args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import math
+import re
+import unicodedata
+
+from backends_llm import estimar_tokens
+
+# --- RECUPERACIÓN DE SECCIONES DEL MANUAL (BM25 EN PROCESO) ---
+# En lugar de recortar el manual a sus primeros caracteres, el texto del PDF se divide en
+# secciones y se indexa una sola vez. Para cada ítem se envían solo las secciones más relevantes
+# para su área, asignatura, proceso cognitivo y nanohabilidad, dentro de un presupuesto de tokens.
+
+PRESUPUESTO_TOKENS_POR_DEFECTO = 3000
+MAX_SECCIONES_POR_DEFECTO = 6
+MIN_CARACTERES_SECCION = 200
+MAX_CARACTERES_SECCION = 2000
+# Términos de construcción de ítems que se suman a toda consulta para no perder las reglas generales.
+TERMINOS_GENERALES_CONSULTA = "ítem enunciado pregunta opciones distractores respuesta correcta justificaciones"
+
+_PALABRAS_VACIAS = set("""
+    a al ante bajo como con contra cual cuales de del desde donde el ella ellas ellos en entre era es esa ese eso esta
+    este esto estos estas fue ha han hay la las le les lo los mas mismo muy no nos o para pero por que se ser si sin
+    sobre son su sus tambien tiene todo todos un una unas uno unos y ya
+""".split())
+
+_PATRON_ENCABEZADO = re.compile(
+    r"^\s*(?:(?:\d+(?:\.\d+)*\.?|[IVXLC]+\.)\s+\S.{0,100}|(?:CAP[IÍ]TULO|SECCI[OÓ]N|ANEXO)\b.{0,100}|[A-ZÁÉÍÓÚÑ][A-ZÁÉÍÓÚÑ0-9 ,:;()\-]{3,80})\s*$"
+)
+
+
+def normalizar_terminos(texto):
+    sin_tildes = unicodedata.normalize("NFKD", texto.lower()).encode("ascii", "ignore").decode("ascii")
+    return [termino for termino in re.findall(r"[a-z0-9]{3,}", sin_tildes) if termino not in _PALABRAS_VACIAS]
+
+
+def dividir_en_secciones(texto, min_caracteres=MIN_CARACTERES_SECCION, max_caracteres=MAX_CARACTERES_SECCION):
+    # Corta en los encabezados detectados; une secciones muy cortas y parte las muy largas por líneas.
+    secciones, actual = [], []
+    for linea in texto.splitlines():
+        if _PATRON_ENCABEZADO.match(linea) and sum(len(l) for l in actual) >= min_caracteres:
+            secciones.append("\n".join(actual))
+            actual = []
+        actual.append(linea)
+    if actual:
+        secciones.append("\n".join(actual))
+
+    resultado = []
+    for seccion in secciones:
+        seccion = seccion.strip()
+        if not seccion:
+            continue
+        while len(seccion) > max_caracteres:
+            corte = seccion.rfind("\n", 0, max_caracteres)
+            if corte <= min_caracteres:
+                corte = max_caracteres
+            resultado.append(seccion[:corte].strip())
+            seccion = seccion[corte:].strip()
+        if seccion:
+            resultado.append(seccion)
+    return resultado
+
+
+class IndiceManual:
+    def __init__(self, texto_manual, k1=1.5, b=0.75):
+        self.secciones = dividir_en_secciones(texto_manual)
+        self.k1 = k1
+        self.b = b
+        self._frecuencias = [collections.Counter(normalizar_terminos(seccion)) for seccion in self.secciones]
+        self._longitudes = [sum(frecuencias.values()) for frecuencias in self._frecuencias]
+        self._longitud_media = (sum(self._longitudes) / len(self._longitudes)) if self._longitudes else 0.0
+        documentos_por_termino = collections.Counter()
+        for frecuencias in self._frecuencias:
+            documentos_por_termino.update(frecuencias.keys())
+        total = len(self.secciones)
+        self._idf = {
+            termino: math.log(1 + (total - n + 0.5) / (n + 0.5))
+            for termino, n in documentos_por_termino.items()
+        }
+        self.tokens_totales = estimar_tokens(texto_manual)
+
+    def puntuar(self, consulta):
+        terminos = normalizar_terminos(consulta)
+        puntajes = []
+        for frecuencias, longitud in zip(self._frecuencias, self._longitudes):
+            puntaje = 0.0
+            normalizacion = self.k1 * (1 - self.b + self.b * longitud / (self._longitud_media or 1))
+            for termino in terminos:
+                frecuencia = frecuencias.get(termino)
+                if not frecuencia:
+                    continue
+                puntaje += self._idf[termino] * frecuencia * (self.k1 + 1) / (frecuencia + normalizacion)
+            puntajes.append(puntaje)
+        return puntajes
+
+    def seleccionar(self, consulta, presupuesto_tokens=PRESUPUESTO_TOKENS_POR_DEFECTO, max_secciones=MAX_SECCIONES_POR_DEFECTO):
+        # Devuelve el texto de las secciones elegidas, en el orden en que aparecen en el manual.
+        if not self.secciones:
+            return ""
+        puntajes = self.puntuar(f"{consulta} {TERMINOS_GENERALES_CONSULTA}")
+        candidatas = sorted((i for i, puntaje in enumerate(puntajes) if puntaje > 0), key=lambda i: -puntajes[i])
+        if not candidatas:
+            # Sin coincidencias, se conserva el comportamiento anterior: el inicio del manual.
+            candidatas = list(range(len(self.secciones)))
+
+        elegidas, tokens_usados = [], 0
+        for i in candidatas:
+            if len(elegidas) >= max_secciones:
+                break
+            tokens_seccion = estimar_tokens(self.secciones[i])
+            if tokens_usados + tokens_seccion > presupuesto_tokens:
+                continue
+            elegidas.append(i)
+            tokens_usados += tokens_seccion
+        return "\n\n[...]\n\n".join(self.secciones[i] for i in sorted(elegidas))
+
+
+class SeleccionManual:
+    # Configuración por ejecución sobre un índice compartido (el índice se construye una vez por manual).
+    def __init__(self, indice, presupuesto_tokens=PRESUPUESTO_TOKENS_POR_DEFECTO, max_secciones=MAX_SECCIONES_POR_DEFECTO):
+        self.indice = indice
+        self.presupuesto_tokens = presupuesto_tokens
+        self.max_secciones = max_secciones
+
+    def texto_para(self, fila_datos):
+        return self.indice.seleccionar(consulta_para_item(fila_datos), self.presupuesto_tokens, self.max_secciones)
+
+
+def consulta_para_item(fila_datos):
+    return " ".join(
+        str(fila_datos.get(columna, "")) for columna in
+        ('ÁREA', 'ASIGNATURA', 'PROCESO COGNITIVO', 'NANOHABILIDAD', 'MICROHABILIDAD')
+    )
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import os
+import uuid
+
+import streamlit as st
+
+from backends_llm import obtener_backend
+from banco_items import BancoItems, RUTA_BANCO_POR_DEFECTO
+from cache_llm import CacheRespuestasLLM, RUTA_CACHE_POR_DEFECTO, TTL_POR_DEFECTO_SEGUNDOS, MAX_ENTRADAS_POR_DEFECTO
+from cola_trabajos import ColaTrabajos
+from exportacion import FORMATOS_EXPORTACION
+from extraccion_pdf import extraer_manual_pdf
+from recuperacion_manual import IndiceManual
+from resiliencia import ResilienciaLLM
+from taxonomia import IndiceTaxonomia, leer_libro_excel
+from telemetria import Telemetria
+
+# --- RECURSOS COMPARTIDOS DE LA APLICACIÓN DE STREAMLIT ---
+# Streamlit vuelve a ejecutar app.py completo en cada interacción. Las funciones de este módulo se
+# definen una sola vez por proceso (el módulo se importa una vez) y los recursos que crean
+# (backend con vertexai.init, caché, capa resiliente, telemetría, cola de trabajos, banco de ítems,
+# libros e índices) se comparten entre todas las sesiones con st.cache_resource. Las librerías
+# pesadas (vertexai, pandas, PyPDF2, python-docx, openpyxl) solo se importan la primera vez que
+# algo las necesita.
+
+_arranque = {"primera_ejecucion": True}
+
+
+# --- INICIALIZACIÓN ÚNICA POR PROCESO ---
+@st.cache_resource
+def obtener_backend_llm():
+    # LLM_BACKEND=vertex (por defecto) usa GCP_PROJECT_ID y GCP_LOCATION; LLM_BACKEND=falso usa un
+    # backend local simulado. vertexai se importa e inicializa aquí, una sola vez.
+    return obtener_backend()
+
+
+@st.cache_resource
+def obtener_cache_llm():
+    return CacheRespuestasLLM(
+        ruta=os.environ.get("LLM_CACHE_PATH", RUTA_CACHE_POR_DEFECTO),
+        ttl_segundos=int(os.environ.get("LLM_CACHE_TTL_SECONDS", TTL_POR_DEFECTO_SEGUNDOS)),
+        max_entradas=int(os.environ.get("LLM_CACHE_MAX_ENTRIES", MAX_ENTRADAS_POR_DEFECTO))
+    )
+
+
+@st.cache_resource
+def obtener_banco_items():
+    return BancoItems(os.environ.get("ITEM_BANK_PATH", RUTA_BANCO_POR_DEFECTO))
+
+
+@st.cache_resource
+def obtener_resiliencia_llm():
+    return ResilienciaLLM.desde_entorno()
+
+
+@st.cache_resource
+def obtener_telemetria():
+    return Telemetria.desde_entorno()
+
+
+@st.cache_resource
+def obtener_cola_trabajos():
+    # Un solo pool de trabajadores por proceso (JOBS_MAX_WORKERS), compartido por todas las sesiones.
+    return ColaTrabajos.desde_entorno(obtener_telemetria())
+
+
+def identificar_usuario():
+    # Detrás de IAP, Cloud Run recibe el correo del usuario autenticado; sin él, cada sesión del
+    # navegador cuenta como un usuario distinto para el reparto de la cola de trabajos.
+    correo = st.context.headers.get("X-Goog-Authenticated-User-Email")
+    return correo or st.session_state.setdefault("id_usuario", uuid.uuid4().hex)
+
+
+def registrar_ejecucion_script(telemetria, segundos_script, segundos_importaciones):
+    # La primera ejecución del script en el proceso es el arranque en frío (incluye importar los
+    # módulos y crear los recursos compartidos); las demás son los reruns de cada interacción.
+    arranque = "frio" if _arranque.pop("primera_ejecucion", False) else "caliente"
+    telemetria.observar("app_script_segundos", segundos_script, arranque=arranque)
+    telemetria.observar("app_importaciones_segundos", segundos_importaciones, arranque=arranque)
+    if arranque == "frio":
+        telemetria.evento("arranque", segundos_script=segundos_script, segundos_importaciones=segundos_importaciones)
+
+
+# --- ARCHIVOS CARGADOS ---
+@st.cache_resource(max_entries=8)
+def leer_excel_cargado(contenido_excel, nombre_archivo):
+    # El libro se lee por streaming y se indexa una sola vez; todas las sesiones que suben el
+    # mismo archivo comparten el DataFrame y el índice de la taxonomía (de solo lectura). Solo se
+    # conservan los últimos libros, y un error se propaga (no se guarda), así que volver a subir
+    # el archivo lo reintenta.
+    df = leer_libro_excel(contenido_excel)
+    st.sidebar.success(f"Archivo Excel '{nombre_archivo}' cargado exitosamente.")
+    return df, IndiceTaxonomia(df)
+
+
+@st.cache_data
+def leer_pdf_cargado(uploaded_file):
+    if uploaded_file is not None:
+        try:
+            extraccion = extraer_manual_pdf(uploaded_file.getvalue())
+            st.sidebar.success(f"Archivo PDF '{uploaded_file.name}' leído exitosamente.")
+            segundos_por_pagina = extraccion["segundos_por_pagina"]
+            pagina_mas_lenta = max(range(len(segundos_por_pagina)), key=segundos_por_pagina.__getitem__) if segundos_por_pagina else 0
+            st.sidebar.caption(
+                f"{len(extraccion['paginas'])} páginas en {extraccion['segundos_totales']:.2f} s"
+                + (" (desde la caché en disco)" if extraccion["desde_cache"] else
+                   f" · página más lenta: {pagina_mas_lenta + 1} ({max(segundos_por_pagina, default=0):.2f} s)")
+            )
+            return extraccion["texto"]
+        except Exception as e:
+            st.sidebar.error(f"Ocurrió un error al leer el archivo PDF: {e}")
+            return ""
+    return ""
+
+
+@st.cache_resource
+def indexar_manual(texto_manual):
+    # Se construye una sola vez por manual y se comparte entre sesiones.
+    return IndiceManual(texto_manual)
+
+
+@st.cache_data(max_entries=16)
+def construir_exportacion(formato, hash_lista_items, _items):
+    # _items no se hashea (el guion bajo lo excluye); la clave es el hash calculado al generar.
+    return FORMATOS_EXPORTACION[formato][3](_items)
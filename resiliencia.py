@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+
+import concurrent.futures
+import logging
+import os
+import random
+import threading
+import time
+
+from backends_llm import ErrorBackendLLM
+
+# --- CAPA RESILIENTE PARA LAS LLAMADAS AL LLM ---
+# Cada llamada pasa, por modelo, por:
+#   1. un interruptor de circuito: si el modelo acumula fallos transitorios seguidos, se pausa un
+#      tiempo y las llamadas esperan (acotadamente) en lugar de fallar una tras otra;
+#   2. un cubo de tokens con el límite de solicitudes por minuto configurado para el modelo, y un
+#      semáforo con el máximo de llamadas simultáneas al modelo (LLM_MAX_CONCURRENT_PER_MODEL);
+#   3. reintentos con backoff exponencial y jitter completo ante errores transitorios (429, 5xx,
+#      timeouts);
+#   4. opcionalmente, una solicitud de cobertura ("hedged request"): si la primera no respondió en
+#      LLM_HEDGE_AFTER_SECONDS, se lanza una segunda y se usa la que termine primero.
+# Una sola instancia por proceso, compartida por todas las sesiones, para que los límites sean globales.
+
+logger = logging.getLogger(__name__)
+
+CODIGOS_REINTENTABLES = {429, 500, 502, 503, 504}
+NOMBRES_ERRORES_REINTENTABLES = {
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+    "DeadlineExceeded", "GatewayTimeout", "BadGateway", "Aborted",
+}
+
+
+class ErrorCircuitoAbierto(ErrorBackendLLM):
+    pass
+
+
+def es_error_reintentable(error):
+    if isinstance(error, ErrorBackendLLM):
+        return error.reintentable
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # Excepciones de google.api_core, sin importar la librería: por nombre o por código HTTP.
+    if type(error).__name__ in NOMBRES_ERRORES_REINTENTABLES:
+        return True
+    codigo = getattr(error, "code", None)
+    return isinstance(codigo, int) and codigo in CODIGOS_REINTENTABLES
+
+
+class CuboTokens:
+    def __init__(self, tasa_por_segundo, capacidad=1.0):
+        self.tasa_por_segundo = tasa_por_segundo
+        self.capacidad = max(1.0, capacidad)
+        self._tokens = self.capacidad
+        self._ultima_recarga = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _recargar(self):
+        ahora = time.monotonic()
+        self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultima_recarga) * self.tasa_por_segundo)
+        self._ultima_recarga = ahora
+
+    def intentar_adquirir(self):
+        with self._lock:
+            self._recargar()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def adquirir(self):
+        # Bloquea hasta obtener un token; devuelve los segundos esperados.
+        esperado = 0.0
+        while True:
+            with self._lock:
+                self._recargar()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return esperado
+                espera = (1 - self._tokens) / self.tasa_por_segundo
+            time.sleep(espera)
+            esperado += espera
+
+
+class InterruptorCircuito:
+    # Estados: "cerrado" (normal), "abierto" (en pausa) y "semiabierto" (una llamada de sondeo en curso).
+    def __init__(self, umbral_fallos=5, segundos_pausa=30.0):
+        self.umbral_fallos = umbral_fallos
+        self.segundos_pausa = segundos_pausa
+        self.estado = "cerrado"
+        self.aperturas = 0
+        self._fallos_seguidos = 0
+        self._abierto_hasta = 0.0
+        self._lock = threading.Lock()
+
+    def espera_necesaria(self):
+        # 0 si la llamada puede hacerse ya; si no, los segundos que conviene esperar antes de volver a preguntar.
+        with self._lock:
+            if self.estado == "cerrado":
+                return 0.0
+            ahora = time.monotonic()
+            if ahora < self._abierto_hasta:
+                return self._abierto_hasta - ahora
+            if self.estado == "abierto":
+                # Termina la pausa: solo una llamada sondea al modelo; las demás esperan su resultado.
+                self.estado = "semiabierto"
+                return 0.0
+            return 0.5
+
+    def registrar_exito(self):
+        with self._lock:
+            self.estado = "cerrado"
+            self._fallos_seguidos = 0
+
+    def registrar_fallo(self):
+        with self._lock:
+            self._fallos_seguidos += 1
+            if self.estado == "semiabierto" or self._fallos_seguidos >= self.umbral_fallos:
+                if self.estado != "abierto":
+                    self.aperturas += 1
+                    logger.warning("Circuito abierto durante %.0f s tras %s fallo(s) seguidos.", self.segundos_pausa, self._fallos_seguidos)
+                self.estado = "abierto"
+                self._abierto_hasta = time.monotonic() + self.segundos_pausa
+
+
+def _limites_desde_entorno(texto):
+    # "gemini-2.5-pro=10,gemini-2.0-flash=120" → {"gemini-2.5-pro": 10.0, "gemini-2.0-flash": 120.0}
+    limites = {}
+    for parte in (texto or "").split(","):
+        if "=" in parte:
+            modelo, valor = parte.split("=", 1)
+            limites[modelo.strip()] = float(valor)
+    return limites
+
+
+def _liberando(semaforo, funcion):
+    # funcion envuelta para liberar, al terminar, el lugar ya adquirido en el semáforo del modelo.
+    if semaforo is None:
+        return funcion
+
+    def llamada():
+        try:
+            return funcion()
+        finally:
+            semaforo.release()
+    return llamada
+
+
+class ResilienciaLLM:
+    def __init__(self, max_intentos=4, backoff_base_segundos=1.0, backoff_max_segundos=30.0,
+                 solicitudes_por_minuto=0, limites_por_modelo=None, segundos_cobertura=0.0,
+                 umbral_fallos_circuito=5, segundos_pausa_circuito=30.0, max_espera_circuito_segundos=60.0,
+                 max_concurrentes_por_modelo=8, concurrencia_por_modelo=None):
+        self.max_intentos = max(1, max_intentos)
+        self.backoff_base_segundos = backoff_base_segundos
+        self.backoff_max_segundos = backoff_max_segundos
+        self.solicitudes_por_minuto = solicitudes_por_minuto
+        self.limites_por_modelo = limites_por_modelo or {}
+        self.segundos_cobertura = segundos_cobertura
+        self.umbral_fallos_circuito = umbral_fallos_circuito
+        self.segundos_pausa_circuito = segundos_pausa_circuito
+        self.max_espera_circuito_segundos = max_espera_circuito_segundos
+        self.max_concurrentes_por_modelo = max_concurrentes_por_modelo
+        self.concurrencia_por_modelo = concurrencia_por_modelo or {}
+        self._cubos = {}
+        self._semaforos = {}
+        self._interruptores = {}
+        self._metricas = {}
+        self._lock = threading.Lock()
+        self._ejecutor_coberturas = None
+
+    @classmethod
+    def desde_entorno(cls):
+        return cls(
+            max_intentos=int(os.environ.get("LLM_MAX_ATTEMPTS", 4)),
+            backoff_base_segundos=float(os.environ.get("LLM_BACKOFF_BASE_SECONDS", 1.0)),
+            backoff_max_segundos=float(os.environ.get("LLM_BACKOFF_MAX_SECONDS", 30.0)),
+            solicitudes_por_minuto=float(os.environ.get("LLM_RATE_LIMIT_RPM", 0)),
+            limites_por_modelo=_limites_desde_entorno(os.environ.get("LLM_RATE_LIMITS")),
+            segundos_cobertura=float(os.environ.get("LLM_HEDGE_AFTER_SECONDS", 0)),
+            umbral_fallos_circuito=int(os.environ.get("LLM_CIRCUIT_FAILURES", 5)),
+            segundos_pausa_circuito=float(os.environ.get("LLM_CIRCUIT_PAUSE_SECONDS", 30.0)),
+            max_espera_circuito_segundos=float(os.environ.get("LLM_CIRCUIT_MAX_WAIT_SECONDS", 60.0)),
+            max_concurrentes_por_modelo=int(os.environ.get("LLM_MAX_CONCURRENT_PER_MODEL", 8)),
+            concurrencia_por_modelo={modelo: int(limite) for modelo, limite in
+                                     _limites_desde_entorno(os.environ.get("LLM_CONCURRENCY_LIMITS")).items()}
+        )
+
+    def _del_modelo(self, model_name):
+        # Devuelve (cubo o None, semáforo o None, interruptor, métricas) del modelo, creándolos la primera vez.
+        with self._lock:
+            if model_name not in self._interruptores:
+                por_minuto = self.limites_por_modelo.get(model_name, self.solicitudes_por_minuto)
+                # Ráfaga de hasta 10 segundos de cupo, para que las estaciones arranquen en paralelo.
+                self._cubos[model_name] = CuboTokens(por_minuto / 60.0, por_minuto / 6.0) if por_minuto > 0 else None
+                # Llamadas en vuelo por modelo, sumando todas las sesiones y trabajos del proceso (0 = sin tope).
+                concurrentes = self.concurrencia_por_modelo.get(model_name, self.max_concurrentes_por_modelo)
+                self._semaforos[model_name] = threading.BoundedSemaphore(concurrentes) if concurrentes > 0 else None
+                self._interruptores[model_name] = InterruptorCircuito(self.umbral_fallos_circuito, self.segundos_pausa_circuito)
+                self._metricas[model_name] = {
+                    "llamadas": 0, "exitos": 0, "reintentos": 0, "errores_transitorios": 0, "errores_definitivos": 0,
+                    "segundos_espera_limite": 0.0, "segundos_espera_concurrencia": 0.0, "segundos_espera_circuito": 0.0,
+                    "rechazos_circuito": 0,
+                    "coberturas_lanzadas": 0, "coberturas_ganadoras": 0,
+                }
+            return self._cubos[model_name], self._semaforos[model_name], self._interruptores[model_name], self._metricas[model_name]
+
+    def _sumar(self, metricas, nombre, cantidad=1):
+        with self._lock:
+            metricas[nombre] += cantidad
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                model_name: {**metricas, "estado_circuito": self._interruptores[model_name].estado,
+                             "aperturas_circuito": self._interruptores[model_name].aperturas}
+                for model_name, metricas in self._metricas.items()
+            }
+
+    def ejecutar(self, model_name, funcion, permitir_cobertura=True):
+        # funcion() hace la llamada completa al backend. La cobertura solo se usa si funcion no
+        # toca la interfaz (puede ejecutarse en otro hilo y dos veces a la vez).
+        cubo, semaforo, interruptor, metricas = self._del_modelo(model_name)
+        self._sumar(metricas, "llamadas")
+        espera_circuito = 0.0
+        intento = 0
+        while True:
+            espera = interruptor.espera_necesaria()
+            if espera > 0:
+                if espera_circuito + espera > self.max_espera_circuito_segundos:
+                    self._sumar(metricas, "rechazos_circuito")
+                    raise ErrorCircuitoAbierto(f"El modelo '{model_name}' está en pausa por fallos repetidos.")
+                time.sleep(espera)
+                espera_circuito += espera
+                self._sumar(metricas, "segundos_espera_circuito", espera)
+                continue
+
+            intento += 1
+            if cubo is not None:
+                self._sumar(metricas, "segundos_espera_limite", cubo.adquirir())
+            if semaforo is not None:
+                inicio_espera = time.monotonic()
+                semaforo.acquire()
+                self._sumar(metricas, "segundos_espera_concurrencia", time.monotonic() - inicio_espera)
+            try:
+                if permitir_cobertura and self.segundos_cobertura > 0:
+                    resultado = self._con_cobertura(funcion, cubo, semaforo, metricas)
+                else:
+                    resultado = _liberando(semaforo, funcion)()
+            except Exception as e:
+                if not es_error_reintentable(e):
+                    # El modelo respondió (p. ej. una solicitud inválida): no cuenta como caída del servicio.
+                    interruptor.registrar_exito()
+                    self._sumar(metricas, "errores_definitivos")
+                    raise
+                self._sumar(metricas, "errores_transitorios")
+                interruptor.registrar_fallo()
+                if intento >= self.max_intentos:
+                    raise
+                # Backoff exponencial con jitter completo, para que los hilos no reintenten a la vez.
+                espera = random.uniform(0, min(self.backoff_max_segundos, self.backoff_base_segundos * 2 ** (intento - 1)))
+                logger.warning("Error transitorio con '%s' (intento %s/%s): %s — reintentando en %.1f s.",
+                               model_name, intento, self.max_intentos, e, espera)
+                self._sumar(metricas, "reintentos")
+                time.sleep(espera)
+                continue
+            interruptor.registrar_exito()
+            self._sumar(metricas, "exitos")
+            return resultado
+
+    def _con_cobertura(self, funcion, cubo, semaforo, metricas):
+        with self._lock:
+            if self._ejecutor_coberturas is None:
+                self._ejecutor_coberturas = concurrent.futures.ThreadPoolExecutor(max_workers=16, thread_name_prefix="cobertura")
+            ejecutor = self._ejecutor_coberturas
+        # Cada solicitud libera su lugar en el semáforo al terminar, aunque la otra ya haya respondido.
+        llamada = _liberando(semaforo, funcion)
+        en_marcha = threading.Event()
+
+        def llamada_principal():
+            en_marcha.set()
+            return llamada()
+
+        principal = ejecutor.submit(llamada_principal)
+        # El plazo de la cobertura cuenta desde que la llamada empieza, no desde que entra a la fila
+        # del pool: esperar un hilo libre no es latencia del modelo y cubrirlo solo alargaría la fila.
+        en_marcha.wait()
+        try:
+            return principal.result(timeout=self.segundos_cobertura)
+        except concurrent.futures.TimeoutError:
+            pass
+        # La cobertura duplica el costo de la llamada: solo se lanza si hay cupo sin esperar.
+        if semaforo is not None and not semaforo.acquire(blocking=False):
+            return principal.result()
+        if cubo is not None and not cubo.intentar_adquirir():
+            if semaforo is not None:
+                semaforo.release()
+            return principal.result()
+        self._sumar(metricas, "coberturas_lanzadas")
+        cobertura = ejecutor.submit(_liberando(semaforo, funcion))
+        pendientes = {principal, cobertura}
+        while pendientes:
+            hechos, pendientes = concurrent.futures.wait(pendientes, return_when=concurrent.futures.FIRST_COMPLETED)
+            for futuro in hechos:
+                if futuro.exception() is None:
+                    if futuro is cobertura:
+                        self._sumar(metricas, "coberturas_ganadoras")
+                    return futuro.result()
+        # Ambas fallaron: se propaga el error de la solicitud principal.
+        return principal.result()
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+# --- SALIDA ESTRUCTURADA (JSON CON ESQUEMA) PARA ÍTEMS Y AUDITORÍAS ---
+# En el modo JSON el modelo responde con un objeto que sigue un esquema de respuesta
+# (response_mime_type/response_schema de Vertex AI) en lugar de texto libre interpretado con
+# expresiones regulares. Cada respuesta se valida por tipos y se convierte al mismo texto que pide
+# el formato normal, de modo que el resto del ciclo (validación estructural, refinamiento,
+# bitácora y exportación) no cambia y el parseo de ese texto nunca falla por deriva de formato.
+
+LETRAS_OPCIONES = ("A", "B", "C", "D")
+DICTAMENES = ("✅ CUMPLE TOTALMENTE", "⚠️ CUMPLE PARCIALMENTE", "❌ RECHAZADO")
+RESULTADOS_CRITERIO = ("✅", "⚠️", "❌")
+CRITERIOS_AUDITORIA = (
+    "Formato del Enunciado", "Número de Opciones (4)", "Respuesta Correcta Indicada", "Diseño de Justificaciones",
+    "Estilo y Restricciones", "Alineación del Contenido", "Gráfico (si aplica)",
+)
+
+_TEXTO = {"type": "string"}
+_POR_LETRA = {"type": "object", "properties": {letra: _TEXTO for letra in LETRAS_OPCIONES}, "required": list(LETRAS_OPCIONES)}
+
+ESQUEMA_ITEM = {
+    "type": "object",
+    "properties": {
+        "pregunta": {"type": "string", "description": "Contexto y enunciado, formulado como pregunta."},
+        "opciones": _POR_LETRA,
+        "respuesta_correcta": {"type": "string", "enum": list(LETRAS_OPCIONES)},
+        "justificaciones": _POR_LETRA,
+        "grafico_necesario": {"type": "boolean"},
+        "descripcion_grafico": {"type": "string", "description": "Descripción detallada del gráfico, o vacío si no se necesita."},
+    },
+    "required": ["pregunta", "opciones", "respuesta_correcta", "justificaciones", "grafico_necesario", "descripcion_grafico"],
+}
+
+_PROPIEDADES_AUDITORIA = {
+    "criterios": {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "criterio": {"type": "string", "enum": list(CRITERIOS_AUDITORIA)},
+                "resultado": {"type": "string", "enum": list(RESULTADOS_CRITERIO)},
+                "comentario": _TEXTO,
+            },
+            "required": ["criterio", "resultado"],
+        },
+    },
+    "dictamen_final": {"type": "string", "enum": list(DICTAMENES)},
+    "observaciones_finales": _TEXTO,
+}
+
+ESQUEMA_AUDITORIA = {
+    "type": "object",
+    "properties": _PROPIEDADES_AUDITORIA,
+    "required": ["criterios", "dictamen_final", "observaciones_finales"],
+}
+
+ESQUEMA_AUDITORIA_LOTE = {
+    "type": "object",
+    "properties": {
+        "auditorias": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"numero": {"type": "integer"}, **_PROPIEDADES_AUDITORIA},
+                "required": ["numero", "criterios", "dictamen_final", "observaciones_finales"],
+            },
+        },
+    },
+    "required": ["auditorias"],
+}
+
+# Se agrega al prefijo de generación y de auditoría: las secciones del formato de texto pasan a ser
+# campos del esquema.
+INSTRUCCION_SALIDA_JSON = """
+            --- SALIDA EN JSON ---
+            Responde únicamente con un objeto JSON que siga el esquema de respuesta configurado. Cada campo
+            corresponde a una sección del formato indicado arriba; no agregues texto fuera del JSON.
+            """
+
+
+class ErrorSalidaEstructurada(ValueError):
+    pass
+
+
+def configuracion_json(esquema):
+    return {"response_mime_type": "application/json", "response_schema": esquema}
+
+
+def _leer_json(texto):
+    texto = texto.strip()
+    if texto.startswith("```"):
+        # Algunos modelos envuelven el JSON en un bloque de código aunque se pida JSON puro.
+        texto = texto.strip("`")
+        texto = texto[texto.find("\n") + 1:] if texto.lower().startswith("json") else texto
+    try:
+        return json.loads(texto)
+    except json.JSONDecodeError as e:
+        raise ErrorSalidaEstructurada(f"La respuesta no es JSON válido: {e}") from e
+
+
+def _exigir_tipo(valor, tipo, campo):
+    if not isinstance(valor, tipo) or (tipo is int and isinstance(valor, bool)):
+        raise ErrorSalidaEstructurada(f"El campo '{campo}' debe ser de tipo {tipo.__name__}.")
+    return valor
+
+
+def _normalizar_simbolos(valor):
+    # "⚠" puede llegar con o sin el selector de variación (U+FE0F); se normaliza a "⚠️" como en el esquema.
+    if not isinstance(valor, str):
+        return valor
+    return valor.strip().replace("\ufe0f", "").replace("⚠", "⚠\ufe0f")
+
+
+def _exigir_valor(valor, permitidos, campo):
+    valor = _normalizar_simbolos(valor)
+    if valor not in permitidos:
+        raise ErrorSalidaEstructurada(f"El campo '{campo}' debe ser uno de: {', '.join(permitidos)}.")
+    return valor
+
+
+def _por_letra(datos, campo):
+    _exigir_tipo(datos.get(campo), dict, campo)
+    return {letra: _exigir_tipo(datos[campo].get(letra, ""), str, f"{campo}.{letra}").strip() for letra in LETRAS_OPCIONES}
+
+
+# --- VALIDACIÓN POR TIPOS ---
+def validar_item(datos):
+    # Devuelve el ítem normalizado o lanza ErrorSalidaEstructurada.
+    _exigir_tipo(datos, dict, "ítem")
+    return {
+        "pregunta": _exigir_tipo(datos.get("pregunta"), str, "pregunta").strip(),
+        "opciones": _por_letra(datos, "opciones"),
+        "respuesta_correcta": _exigir_valor(str(datos.get("respuesta_correcta", "")).strip().upper(), LETRAS_OPCIONES, "respuesta_correcta"),
+        "justificaciones": _por_letra(datos, "justificaciones"),
+        "grafico_necesario": _exigir_tipo(datos.get("grafico_necesario"), bool, "grafico_necesario"),
+        "descripcion_grafico": _exigir_tipo(datos.get("descripcion_grafico", ""), str, "descripcion_grafico").strip(),
+    }
+
+
+def validar_auditoria(datos):
+    _exigir_tipo(datos, dict, "auditoría")
+    criterios = []
+    for posicion, criterio in enumerate(_exigir_tipo(datos.get("criterios"), list, "criterios")):
+        campo = f"criterios[{posicion}]"
+        _exigir_tipo(criterio, dict, campo)
+        criterios.append({
+            "criterio": _exigir_tipo(criterio.get("criterio"), str, f"{campo}.criterio").strip(),
+            "resultado": _exigir_valor(criterio.get("resultado"), RESULTADOS_CRITERIO, f"{campo}.resultado"),
+            "comentario": _exigir_tipo(criterio.get("comentario", ""), str, f"{campo}.comentario").strip(),
+        })
+    return {
+        "criterios": criterios,
+        "dictamen_final": _exigir_valor(datos.get("dictamen_final"), DICTAMENES, "dictamen_final"),
+        "observaciones_finales": _exigir_tipo(datos.get("observaciones_finales"), str, "observaciones_finales").strip(),
+    }
+
+
+# --- CONVERSIÓN AL FORMATO DE TEXTO ---
+def item_a_texto(item):
+    return "\n".join([
+        f"PREGUNTA: {item['pregunta']}",
+        *(f"{letra}. {item['opciones'][letra]}" for letra in LETRAS_OPCIONES),
+        f"RESPUESTA CORRECTA: {item['respuesta_correcta']}",
+        "JUSTIFICACIONES:",
+        *(f"{letra}. {item['justificaciones'][letra]}" for letra in LETRAS_OPCIONES),
+        f"GRAFICO_NECESARIO: {'SÍ' if item['grafico_necesario'] else 'NO'}",
+        f"DESCRIPCION_GRAFICO: {item['descripcion_grafico'] or 'N/A'}",
+    ])
+
+
+def auditoria_a_texto(auditoria):
+    lineas = ["VALIDACIÓN DE CRITERIOS:"]
+    for criterio in auditoria["criterios"]:
+        comentario = f" {criterio['comentario']}" if criterio["comentario"] else ""
+        lineas.append(f"- {criterio['criterio']}: {criterio['resultado']}{comentario}")
+    lineas += ["", "DICTAMEN FINAL:", f"[{auditoria['dictamen_final']}]", "", "OBSERVACIONES FINALES:",
+               auditoria["observaciones_finales"] or "Sin observaciones."]
+    return "\n".join(lineas)
+
+
+def item_json_a_texto(respuesta):
+    return item_a_texto(validar_item(_leer_json(respuesta)))
+
+
+def auditoria_json_a_texto(respuesta):
+    return auditoria_a_texto(validar_auditoria(_leer_json(respuesta)))
+
+
+def auditorias_lote_json_a_textos(respuesta, cantidad):
+    # Devuelve el texto de la auditoría de cada ítem (por su "numero"), o None donde falta o no es válida.
+    datos = _leer_json(respuesta)
+    _exigir_tipo(datos, dict, "lote")
+    textos = [None] * cantidad
+    for auditoria in _exigir_tipo(datos.get("auditorias"), list, "auditorias"):
+        try:
+            numero = _exigir_tipo(auditoria.get("numero") if isinstance(auditoria, dict) else None, int, "numero")
+            if 1 <= numero <= cantidad and textos[numero - 1] is None:
+                textos[numero - 1] = auditoria_a_texto(validar_auditoria(auditoria))
+        except ErrorSalidaEstructurada:
+            continue
+    return textos
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import io
+
+# --- ÍNDICE JERÁRQUICO DE LA TAXONOMÍA DEL LIBRO DE EXCEL ---
+# GRADO → ÁREA → ASIGNATURA → ESTACIÓN → PROCESO COGNITIVO → NANOHABILIDAD se indexa una sola vez
+# al cargar el libro: cada nodo guarda sus opciones ya ordenadas y las posiciones de sus filas,
+# de modo que cada selector de la interfaz es una búsqueda en diccionarios en lugar de volver a
+# filtrar todo el DataFrame con máscaras encadenadas en cada rerun.
+
+NIVELES_TAXONOMIA = ('GRADO', 'ÁREA', 'ASIGNATURA', 'ESTACIÓN', 'PROCESO COGNITIVO', 'NANOHABILIDAD')
+# Columnas de texto muy repetidas que se guardan como categóricas para reducir memoria.
+COLUMNAS_CATEGORICAS = NIVELES_TAXONOMIA[1:] + ('MICROHABILIDAD', 'COMPETENCIA NANOHABILIDAD')
+
+
+def _valor_celda(valor):
+    # Igual que pandas.read_excel: los números enteros guardados como float se devuelven como int y
+    # la cadena vacía es un valor faltante; una celda con solo espacios se conserva tal cual.
+    if isinstance(valor, float) and valor.is_integer():
+        return int(valor)
+    if valor == "":
+        return None
+    return valor
+
+
+def leer_libro_excel(origen):
+    # Lee la primera hoja con openpyxl en modo read_only (por streaming, sin cargar los estilos ni
+    # el árbol XML completo del libro) y devuelve un DataFrame equivalente al de pandas.read_excel.
+    import openpyxl
+    import pandas as pd
+
+    if isinstance(origen, (bytes, bytearray)):
+        origen = io.BytesIO(origen)
+    libro = openpyxl.load_workbook(origen, read_only=True, data_only=True)
+    try:
+        filas = libro.worksheets[0].iter_rows(values_only=True)
+        encabezado = next(filas, None)
+        if encabezado is None:
+            return pd.DataFrame()
+        columnas = [valor if valor is not None else f"Unnamed: {i}" for i, valor in enumerate(encabezado)]
+        registros = []
+        for fila in filas:
+            valores = [_valor_celda(valor) for valor in fila[:len(columnas)]]
+            if any(valor is not None for valor in valores):
+                registros.append(valores + [None] * (len(columnas) - len(valores)))
+    finally:
+        libro.close()
+
+    df = pd.DataFrame.from_records(registros, columns=columnas)
+    for columna in COLUMNAS_CATEGORICAS:
+        if columna in df.columns:
+            df[columna] = df[columna].astype("category")
+    return df
+
+
+class IndiceTaxonomia:
+    def __init__(self, df_datos, niveles=NIVELES_TAXONOMIA):
+        self.df = df_datos
+        self.niveles = tuple(nivel for nivel in niveles if nivel in df_datos.columns)
+        self._raiz = self._nodo_nuevo()
+
+        # Una sola pasada por las filas. Se compara por str(valor), como hacía el filtro de GRADO,
+        # para que 3 y "3" caigan en la misma opción.
+        columnas = [df_datos[nivel].tolist() for nivel in self.niveles]
+        for posicion, valores in enumerate(zip(*columnas)):
+            nodo = self._raiz
+            for valor in valores:
+                if _es_nulo(valor):
+                    break
+                clave = str(valor)
+                if clave not in nodo["hijos"]:
+                    nodo["hijos"][clave] = self._nodo_nuevo()
+                    nodo["valores"][clave] = valor
+                nodo = nodo["hijos"][clave]
+                nodo["posiciones"].append(posicion)
+
+        self._ordenar(self._raiz)
+
+    @staticmethod
+    def _nodo_nuevo():
+        return {"hijos": {}, "valores": {}, "posiciones": [], "opciones": []}
+
+    def _ordenar(self, nodo):
+        pila = [nodo]
+        while pila:
+            actual = pila.pop()
+            valores = list(actual["valores"].values())
+            try:
+                actual["opciones"] = sorted(valores)
+            except TypeError:
+                # Tipos mezclados en una misma columna (p. ej. números y textos).
+                actual["opciones"] = sorted(valores, key=str)
+            pila.extend(actual["hijos"].values())
+
+    def _nodo(self, ruta):
+        nodo = self._raiz
+        for valor in ruta:
+            nodo = nodo["hijos"].get(str(valor))
+            if nodo is None:
+                return None
+        return nodo
+
+    def opciones(self, *ruta):
+        # Opciones ordenadas del nivel siguiente a la ruta dada (p. ej. opciones(grado, área) → asignaturas).
+        nodo = self._nodo(ruta)
+        return nodo["opciones"] if nodo else []
+
+    def filas(self, *ruta):
+        # Filas del libro bajo la ruta dada, en su orden original.
+        nodo = self._nodo(ruta)
+        if nodo is None:
+            return self.df.iloc[0:0]
+        if nodo is self._raiz:
+            return self.df
+        return self.df.iloc[nodo["posiciones"]]
+
+
+def _es_nulo(valor):
+    return valor is None or (isinstance(valor, float) and valor != valor)
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import contextlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+# --- TELEMETRÍA: SPANS, CONTADORES Y RESÚMENES ---
+# Cada llamada al LLM y cada intento del ciclo generar→auditar→refinar se registran como spans
+# (duración, estado y atributos) y alimentan contadores y resúmenes de latencia en memoria. Los
+# spans y eventos se agregan a un archivo JSONL; los contadores y resúmenes se exportan en el
+# formato de texto de Prometheus, a un archivo (p. ej. para el textfile collector) y, si se
+# configura TELEMETRY_PROMETHEUS_PORT, en un endpoint HTTP /metrics.
+
+logger = logging.getLogger(__name__)
+
+RUTA_JSONL_POR_DEFECTO = os.path.join(".cache", "telemetria.jsonl")
+RUTA_PROMETHEUS_POR_DEFECTO = os.path.join(".cache", "metricas.prom")
+MAX_OBSERVACIONES_POR_SERIE = 5000
+
+
+def _clave_serie(nombre, etiquetas):
+    return nombre, tuple(sorted((clave, str(valor)) for clave, valor in etiquetas.items()))
+
+
+def _texto_etiquetas(etiquetas, extra=()):
+    pares = list(etiquetas) + list(extra)
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{clave}="{str(valor).replace(chr(34), chr(39))}"' for clave, valor in pares) + "}"
+
+
+def percentil(valores, p):
+    # Percentil por rango más cercano; None si no hay valores.
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+
+class Telemetria:
+    def __init__(self, ruta_jsonl=None, prefijo_metricas="sumun"):
+        self.ruta_jsonl = ruta_jsonl
+        self.prefijo_metricas = prefijo_metricas
+        self._contadores = collections.defaultdict(float)
+        self._observaciones = {}
+        self._lock = threading.Lock()
+        self._archivo = None
+        self._servidor = None
+
+    @classmethod
+    def desde_entorno(cls, ruta_jsonl_por_defecto=RUTA_JSONL_POR_DEFECTO):
+        # TELEMETRY_JSONL_PATH vacío desactiva el archivo JSONL.
+        telemetria = cls(ruta_jsonl=os.environ.get("TELEMETRY_JSONL_PATH", ruta_jsonl_por_defecto) or None)
+        puerto = os.environ.get("TELEMETRY_PROMETHEUS_PORT")
+        if puerto:
+            telemetria.servir_prometheus(int(puerto))
+        return telemetria
+
+    # --- Registro ---
+    def contar(self, nombre, cantidad=1, **etiquetas):
+        with self._lock:
+            self._contadores[_clave_serie(nombre, etiquetas)] += cantidad
+
+    def observar(self, nombre, valor, **etiquetas):
+        clave = _clave_serie(nombre, etiquetas)
+        with self._lock:
+            serie = self._observaciones.get(clave)
+            if serie is None:
+                serie = self._observaciones[clave] = {"valores": collections.deque(maxlen=MAX_OBSERVACIONES_POR_SERIE),
+                                                      "suma": 0.0, "cantidad": 0}
+            serie["valores"].append(valor)
+            serie["suma"] += valor
+            serie["cantidad"] += 1
+
+    def evento(self, nombre, **atributos):
+        self._escribir({"tipo": "evento", "nombre": nombre, "ts": time.time(), **atributos})
+
+    @contextlib.contextmanager
+    def span(self, nombre, **etiquetas):
+        # Las etiquetas (pocas y de baja cardinalidad) identifican la serie de latencia; el diccionario
+        # que se entrega permite agregar atributos al span (tokens, dictamen, etc.) dentro del bloque.
+        atributos = {}
+        inicio = time.time()
+        t0 = time.perf_counter()
+        estado = "ok"
+        try:
+            yield atributos
+        except BaseException:
+            estado = "error"
+            raise
+        finally:
+            duracion = time.perf_counter() - t0
+            estado = atributos.pop("estado", estado)
+            self.observar(f"{nombre}_segundos", duracion, **etiquetas)
+            self.contar(f"{nombre}_total", estado=estado, **etiquetas)
+            self._escribir({"tipo": "span", "nombre": nombre, "inicio": inicio, "duracion": duracion,
+                            "estado": estado, **etiquetas, **atributos})
+
+    def _escribir(self, registro):
+        if not self.ruta_jsonl:
+            return
+        linea = json.dumps(registro, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            try:
+                if self._archivo is None:
+                    directorio = os.path.dirname(self.ruta_jsonl)
+                    if directorio:
+                        os.makedirs(directorio, exist_ok=True)
+                    self._archivo = open(self.ruta_jsonl, "a", encoding="utf-8")
+                self._archivo.write(linea)
+                self._archivo.flush()
+            except OSError as e:
+                # La telemetría nunca debe interrumpir la generación.
+                logger.warning("No se pudo escribir la telemetría en %s: %s", self.ruta_jsonl, e)
+                self.ruta_jsonl = None
+
+    # --- Consulta ---
+    def suma_contador(self, nombre, **filtro):
+        # Suma las series del contador cuyas etiquetas incluyen el filtro dado.
+        filtro = {clave: str(valor) for clave, valor in filtro.items()}
+        with self._lock:
+            return sum(
+                valor for (nombre_serie, etiquetas), valor in self._contadores.items()
+                if nombre_serie == nombre and filtro.items() <= dict(etiquetas).items()
+            )
+
+    def valores_observados(self, nombre, **filtro):
+        filtro = {clave: str(valor) for clave, valor in filtro.items()}
+        with self._lock:
+            return [
+                valor for (nombre_serie, etiquetas), serie in self._observaciones.items()
+                if nombre_serie == nombre and filtro.items() <= dict(etiquetas).items()
+                for valor in serie["valores"]
+            ]
+
+    def etiquetas_de(self, nombre, etiqueta, **filtro):
+        # Valores distintos que toma una etiqueta en las series de un contador (con el filtro dado).
+        filtro = {clave: str(valor) for clave, valor in filtro.items()}
+        with self._lock:
+            return sorted({dict(etiquetas).get(etiqueta) for nombre_serie, etiquetas in self._contadores
+                           if nombre_serie == nombre and etiqueta in dict(etiquetas) and filtro.items() <= dict(etiquetas).items()})
+
+    def resumen(self):
+        # Indicadores del panel de rendimiento.
+        latencias = {}
+        for operacion in ("generacion", "auditoria", "auditoria_lote"):
+            valores = self.valores_observados("llm_llamada_segundos", operacion=operacion)
+            if valores:
+                latencias[operacion] = {"p50": percentil(valores, 50), "p95": percentil(valores, 95), "llamadas": len(valores)}
+
+        items_aprobados = self.suma_contador("items_total", dictamen="aprobado")
+        # Los tokens servidos desde la caché de contexto ya están incluidos en los de entrada.
+        tokens = self.suma_contador("llm_tokens_total", tipo="entrada") + self.suma_contador("llm_tokens_total", tipo="salida")
+        tasa_por_intento = {}
+        for intento in self.etiquetas_de("intentos_total", "intento"):
+            total = self.suma_contador("intentos_total", intento=intento)
+            aprobados = self.suma_contador("intentos_total", intento=intento, aprobado="si")
+            tasa_por_intento[int(intento)] = {"intentos": int(total), "tasa_aprobacion": aprobados / total if total else 0.0}
+
+        # Auditoría en cascada: latencia, tokens y tasa de escalamiento de cada nivel.
+        cascada = {}
+        for nivel in self.etiquetas_de("auditoria_nivel_total", "nivel"):
+            # auditoria_nivel_total es el contador del span "auditoria_nivel" (por estado).
+            auditorias = self.suma_contador("auditoria_nivel_total", nivel=nivel, estado="ok")
+            modelos = self.etiquetas_de("auditoria_nivel_total", "modelo", nivel=nivel)
+            valores = self.valores_observados("auditoria_nivel_segundos", nivel=nivel)
+            cascada[int(nivel)] = {
+                "modelos": modelos, "auditorias": int(auditorias),
+                "p50": percentil(valores, 50), "p95": percentil(valores, 95),
+                "tokens": int(sum(self.suma_contador("llm_tokens_total", modelo=modelo, operacion=operacion, tipo=tipo)
+                                  for modelo in modelos for operacion in ("auditoria", "auditoria_lote")
+                                  for tipo in ("entrada", "salida"))),
+                "tasa_escalamiento": self.suma_contador("auditoria_escalamientos_total", nivel=nivel) / auditorias if auditorias else 0.0,
+                "motivos": {motivo: int(self.suma_contador("auditoria_escalamientos_total", nivel=nivel, motivo=motivo))
+                            for motivo in self.etiquetas_de("auditoria_escalamientos_total", "motivo", nivel=nivel)},
+            }
+
+        arranques = self.valores_observados("app_script_segundos", arranque="frio")
+        aciertos = self.suma_contador("llm_cache_total", resultado="acierto")
+        consultas = self.suma_contador("llm_cache_total")
+        return {
+            "latencias": latencias,
+            "tokens_totales": int(tokens),
+            "items_aprobados": int(items_aprobados),
+            "tokens_por_item_aprobado": tokens / items_aprobados if items_aprobados else None,
+            "tasa_aprobacion_por_intento": dict(sorted(tasa_por_intento.items())),
+            "tasa_aciertos_cache": aciertos / consultas if consultas else None,
+            "fallos_parseo": int(self.suma_contador("fallos_parseo_total")),
+            "items_reutilizados_banco": int(self.suma_contador("banco_reutilizados_total")),
+            "duplicados_banco": int(self.suma_contador("banco_duplicados_total")),
+            "cascada_auditoria": dict(sorted(cascada.items())),
+            "arranque_en_frio_segundos": max(arranques) if arranques else None,
+            "rerun_p50_segundos": percentil(self.valores_observados("app_script_segundos", arranque="caliente"), 50),
+        }
+
+    # --- Exportación Prometheus ---
+    def texto_prometheus(self):
+        lineas = []
+        with self._lock:
+            contadores = sorted(self._contadores.items())
+            observaciones = sorted((clave, list(serie["valores"]), serie["suma"], serie["cantidad"])
+                                   for clave, serie in self._observaciones.items())
+        tipos_declarados = set()
+        for (nombre, etiquetas), valor in contadores:
+            metrica = f"{self.prefijo_metricas}_{nombre}"
+            if metrica not in tipos_declarados:
+                lineas.append(f"# TYPE {metrica} counter")
+                tipos_declarados.add(metrica)
+            lineas.append(f"{metrica}{_texto_etiquetas(etiquetas)} {valor:g}")
+        for (nombre, etiquetas), valores, suma, cantidad in observaciones:
+            metrica = f"{self.prefijo_metricas}_{nombre}"
+            if metrica not in tipos_declarados:
+                lineas.append(f"# TYPE {metrica} summary")
+                tipos_declarados.add(metrica)
+            for cuantil in (0.5, 0.95, 0.99):
+                lineas.append(f"{metrica}{_texto_etiquetas(etiquetas, [('quantile', cuantil)])} {percentil(valores, cuantil * 100):g}")
+            lineas.append(f"{metrica}_sum{_texto_etiquetas(etiquetas)} {suma:g}")
+            lineas.append(f"{metrica}_count{_texto_etiquetas(etiquetas)} {cantidad}")
+        return "\n".join(lineas) + "\n"
+
+    def escribir_prometheus(self, ruta_por_defecto=RUTA_PROMETHEUS_POR_DEFECTO):
+        # Escritura atómica, para que un recolector nunca lea el archivo a medias.
+        ruta = os.environ.get("TELEMETRY_PROMETHEUS_PATH", ruta_por_defecto)
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        with open(temporal, "w", encoding="utf-8") as archivo:
+            archivo.write(self.texto_prometheus())
+        os.replace(temporal, ruta)
+        return ruta
+
+    def servir_prometheus(self, puerto):
+        # Endpoint /metrics en un hilo aparte; una sola vez por instancia.
+        if self._servidor is not None:
+            return self._servidor
+        import http.server
+        telemetria = self
+
+        class Manejador(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                cuerpo = telemetria.texto_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def log_message(self, formato, *args):
+                pass
+
+        self._servidor = http.server.ThreadingHTTPServer(("0.0.0.0", puerto), Manejador)
+        threading.Thread(target=self._servidor.serve_forever, name="telemetria-metricas", daemon=True).start()
+        logger.info("Métricas de Prometheus en http://0.0.0.0:%s/metrics", puerto)
+        return self._servidor
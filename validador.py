@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import re
+
+# --- VALIDACIÓN ESTRUCTURAL LOCAL (PREVIA A LA AUDITORÍA CON LLM) ---
+# Revisa sin modelo lo que los criterios 1–4 y 7 de la auditoría piden sobre la forma del ítem:
+# enunciado en forma de pregunta o de instrucción, exactamente cuatro opciones A–D, una RESPUESTA CORRECTA válida,
+# cuatro justificaciones y un bloque GRAFICO_NECESARIO coherente. Un ítem que no pasa vuelve
+# directamente al refinamiento con estas observaciones, sin gastar una llamada de auditoría.
+
+LETRAS_OPCIONES = ("A", "B", "C", "D")
+ENCABEZADO_OBSERVACIONES = "Validación estructural automática (sin LLM):"
+
+_PATRON_LINEA_OPCION = re.compile(r"^\s*\**\s*([A-D])\s*[\.\)]\s*\**\s*(.*)$")
+# La letra debe ir sola ("B", "B.", "[B]", "Opción B"); en "Opción B" no se toma la "O".
+_PATRON_RESPUESTA = re.compile(
+    r"RESPUESTA CORRECTA:\**\s*\**\s*\[?\s*(?:(?:la\s+)?(?:opci[oó]n|literal|letra)\s+)?\**([A-D])\b", re.IGNORECASE
+)
+# Verbos con los que un enunciado se formula como instrucción en lugar de pregunta.
+_PATRON_ENUNCIADO_IMPERATIVO = re.compile(
+    r"\b(?:seleccion[ae]|elij[ae]|elige|escoj[ae]|escoge|determin[ae]|identifi(?:que|ca)|indi(?:que|ca)|señal[ae]|"
+    r"calcul[ae]|complet[ae]|marqu?[ae]|encuentr[ae]|resuelv[ae]|estim[ae]|compar[ae]|explique|explica|ordene|ordena)\b",
+    re.IGNORECASE
+)
+
+
+def _opciones_en(texto):
+    # Devuelve [(letra, texto), ...] para las líneas con forma "A. texto" / "A) texto".
+    opciones = []
+    for linea in texto.splitlines():
+        coincidencia = _PATRON_LINEA_OPCION.match(linea)
+        if coincidencia:
+            opciones.append((coincidencia.group(1), coincidencia.group(2).strip(" *")))
+    return opciones
+
+
+def validar_estructura_item(item_text, grafico_necesario="NO", descripcion_grafico="", formato_grafico_reconocido=True):
+    # Devuelve la lista de problemas encontrados; una lista vacía significa que el ítem es apto
+    # para pasar a la auditoría con LLM.
+    problemas = []
+
+    inicio_pregunta = item_text.find("PREGUNTA:")
+    inicio_respuesta = item_text.upper().find("RESPUESTA CORRECTA:")
+    inicio_justificaciones = item_text.upper().find("JUSTIFICACIONES:")
+
+    if inicio_pregunta == -1:
+        problemas.append("Falta la sección 'PREGUNTA:' con el enunciado.")
+    if inicio_respuesta == -1:
+        problemas.append("Falta la sección 'RESPUESTA CORRECTA:'.")
+    if inicio_justificaciones == -1:
+        problemas.append("Falta la sección 'JUSTIFICACIONES:'.")
+    if problemas:
+        return problemas
+
+    # --- Enunciado y opciones (criterios 1 y 2) ---
+    bloque_pregunta = item_text[inicio_pregunta + len("PREGUNTA:"):inicio_respuesta]
+    opciones = _opciones_en(bloque_pregunta)
+    primera_opcion = re.search(r"^\s*\**\s*A\s*[\.\)]", bloque_pregunta, re.MULTILINE)
+    enunciado = bloque_pregunta[:primera_opcion.start()] if primera_opcion else bloque_pregunta
+    if not enunciado.strip():
+        problemas.append("El enunciado está vacío.")
+    elif "?" not in enunciado and not _PATRON_ENUNCIADO_IMPERATIVO.search(enunciado):
+        problemas.append("El enunciado no está formulado como una pregunta ni como una instrucción (p. ej. 'Seleccione…').")
+
+    letras = [letra for letra, _ in opciones]
+    if tuple(letras) != LETRAS_OPCIONES:
+        problemas.append(
+            f"Se encontraron {len(opciones)} opción(es) ({', '.join(letras) or 'ninguna'}); "
+            "deben ser exactamente cuatro, en orden A, B, C, D."
+        )
+    if any(not texto for _, texto in opciones):
+        problemas.append("Hay opciones sin texto.")
+    textos_opciones = [texto.lower() for _, texto in opciones if texto]
+    if len(set(textos_opciones)) < len(textos_opciones):
+        problemas.append("Hay opciones repetidas; los distractores deben ser distintos.")
+
+    # --- Respuesta correcta (criterio 3) ---
+    coincidencia_respuesta = _PATRON_RESPUESTA.search(item_text)
+    letra_correcta = (coincidencia_respuesta.group(1) or "").upper() if coincidencia_respuesta else ""
+    if letra_correcta not in LETRAS_OPCIONES:
+        problemas.append("La 'RESPUESTA CORRECTA:' debe indicar una sola letra válida (A, B, C o D).")
+
+    # --- Justificaciones (parte del criterio 4) ---
+    justificaciones = dict(_opciones_en(item_text[inicio_justificaciones + len("JUSTIFICACIONES:"):]))
+    faltantes = [letra for letra in LETRAS_OPCIONES if not justificaciones.get(letra)]
+    if faltantes:
+        problemas.append(f"Faltan justificaciones para: {', '.join(faltantes)}. Debe haber una por cada opción.")
+    elif letra_correcta in LETRAS_OPCIONES and "descarte" in justificaciones[letra_correcta].lower():
+        problemas.append("La justificación de la opción correcta no debe construirse por descarte.")
+
+    # --- Bloque de gráfico (criterio 7) ---
+    if not formato_grafico_reconocido:
+        problemas.append("Falta el bloque 'GRAFICO_NECESARIO: [SÍ/NO]' seguido de 'DESCRIPCION_GRAFICO:'.")
+    elif grafico_necesario == "SÍ" and not descripcion_grafico.strip():
+        problemas.append("GRAFICO_NECESARIO es SÍ pero DESCRIPCION_GRAFICO está vacía.")
+
+    return problemas
+
+
+def observaciones_validacion(problemas):
+    return ENCABEZADO_OBSERVACIONES + "\n" + "\n".join(f"- {problema}" for problema in problemas)